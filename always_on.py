@@ -3,7 +3,11 @@ import sys
 
 import requests
 
+from async_api import *
+from changes import *
 from chatbot import *
+from device_index import get_org_index
+from metrics import dump
 
 
 # Store credentials in a separate file
@@ -22,28 +26,60 @@ def gather_credentials():
     return cam_key, chatbot_token, user_email, org_id, on_tag
 
 
-# List the devices in an organization
-# https://api.meraki.com/api_docs#list-the-devices-in-an-organization
-def get_org_devices(session, api_key, org_id):
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-    response = session.get(f'https://api.meraki.com/api/v0/organizations/{org_id}/devices', headers=headers)
-    return response.json()
-
+# Format the status transitions of the given devices since the last run, or None if nothing went down or came back
+def format_changes(transitions, index, serials):
+    lines = []
+    for t in transitions:
+        if t.field != 'status' or t.serial not in serials:
+            continue
+        if t.after != 'online' and t.after is not None:
+            change = '❌ offline' if t.before is None else f'❌ {t.before} → {t.after}'
+        elif t.after == 'online' and t.before not in (None, 'online'):
+            change = f'✅ {t.before} → online'
+        else:
+            continue
+        device = index[t.serial]
+        network = index.network(t.serial)
+        lines.append(f'  \n- _{network["name"]}_: **{device["name"] or device["mac"]}** - {device["model"]} {change}')
+    if not lines:
+        return None
+    plural = 'devices have' if len(lines) > 1 else 'device has'
+    return f'**{len(lines)} {plural} changed status**: ' + ''.join(lines)
+
+
+# Report the tagged devices (or all of them) that are offline, or with changes=True only those that went down or came back
+def report_offline(session, headers, payload, org_id, on_tag, index, changes=False):
+    if on_tag:
+        interesting_devices = [d['serial'] for d in index.select(tag=on_tag)]
+    else:
+        interesting_devices = list(index.devices)
 
-# List the status of every Meraki device in the organization
-# https://api.meraki.com/api_docs#list-the-status-of-every-meraki-device-in-the-organization
-def get_org_statuses(session, api_key, org_id):
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-    response = session.get(f'https://api.meraki.com/api/v0/organizations/{org_id}/deviceStatuses', headers=headers)
-    return response.json()
+    # Only report devices that went down or came back since the last run
+    if changes:
+        baseline = StatusBaseline(baseline_path(org_id))
+        message = format_changes(baseline.update(index.statuses.values()), index, set(interesting_devices))
+        if message:
+            post_message(session, headers, payload, message)
+        return
 
+    # Format message
+    currently_down = index.not_in_status(interesting_devices, 'online')
+    total = len(currently_down)
+    if total > 0:
+        plural = 'devices are' if total > 1 else 'device is'
+        message = f'**{total} {plural} ❌ offline**: '
+        for d in currently_down:
+            device = index[d]
+            network = index.network(d)
+            if device['name']:
+                message += f'  \n- _{network["name"]}_: **{device["name"]}** - {device["model"]}'
+            else:
+                message += f'  \n- _{network["name"]}_: **{device["mac"]}** - {device["model"]}'
+    else:
+        message = 'All tagged devices are ✅ online!'
 
-# List the networks in an organization
-# https://api.meraki.com/api_docs#list-the-networks-in-an-organization
-def get_org_networks(session, api_key, org_id):
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-    response = session.get(f'https://api.meraki.com/api/v0/organizations/{org_id}/networks', headers=headers)
-    return response.json()
+    # Send message to user
+    post_message(session, headers, payload, message)
 
 
 # Main function
@@ -61,36 +97,13 @@ if __name__ == '__main__':
         'toPersonEmail': user_email
     }
 
-    # Get org data
-    devices = get_org_devices(session, api_key, org_id)
-    statuses = get_org_statuses(session, api_key, org_id)
-    networks = get_org_networks(session, api_key, org_id)
+    # Get org data, all at once, and index it
+    dashboard = AsyncDashboard(api_key, session)
+    index = run(get_org_index(dashboard, org_id))
+    dashboard.close()
 
-    # Analyze the data
-    device_serials = [d['serial'] for d in devices]
-    if on_tag:
-        interesting_devices = [d['serial'] for d in devices if 'tags' in d and on_tag in d['tags']]
-    else:
-        interesting_devices = device_serials
-    online_statuses = [d['serial'] for d in statuses if d['status'] == 'online']
-    net_ids = [n['id'] for n in networks]
+    # Analyze the data and send message to user
+    report_offline(session, headers, payload, org_id, on_tag, index, '--changes' in sys.argv)
 
-    # Format message
-    currently_down = [d for d in interesting_devices if d not in online_statuses]
-    total = len(currently_down)
-    if total > 0:
-        plural = 'devices are' if total > 1 else 'device is'
-        message = f'**{total} {plural} ❌ offline**: '
-        for d in currently_down:
-            device = devices[device_serials.index(d)]
-            net_id = device['networkId']
-            network = networks[net_ids.index(net_id)]
-            if device['name']:
-                message += f'  \n- _{network["name"]}_: **{device["name"]}** - {device["model"]}'
-            else:
-                message += f'  \n- _{network["name"]}_: **{device["mac"]}** - {device["model"]}'
-    else:
-        message = 'All tagged devices are ✅ online!'
-
-    # Send message to user
-    post_message(session, headers, payload, message)
+    # Print API call metrics, if enabled with METRICS=1
+    dump()
@@ -0,0 +1,135 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from jsonstream import iter_array
+from metrics import instrument
+
+base_url = 'https://api.meraki.com/api/v0'
+
+# Maximum number of API calls in flight at once
+CONCURRENCY = 10
+
+# Bytes read at a time from streamed responses
+CHUNK_SIZE = 64 * 1024
+
+
+# Asyncio wrappers for the Meraki dashboard API, running the blocking calls on a bounded pool of threads
+class AsyncDashboard:
+    def __init__(self, api_key, session=None, concurrency=CONCURRENCY):
+        self.api_key = api_key
+        self.headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+        if session:
+            self.session = session
+        else:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+            self.session.mount('https://', adapter)
+        instrument(self.session)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    # Make one API call without blocking the event loop, returning the JSON data or None if unsuccessful
+    async def call(self, method, path, **kwargs):
+        loop = asyncio.get_running_loop()
+        request = partial(self.session.request, method, f'{base_url}{path}', headers=self.headers, **kwargs)
+        try:
+            response = await loop.run_in_executor(self.executor, request)
+        except requests.RequestException:
+            return None
+        return response.json() if response.ok else None
+
+    # Make a GET call, feeding each element of the returned JSON array to consume() as it streams in; True if successful
+    async def stream(self, path, consume):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.stream_array, path, consume)
+
+    def stream_array(self, path, consume):
+        try:
+            with self.session.get(f'{base_url}{path}', headers=self.headers, stream=True) as response:
+                if not response.ok:
+                    return False
+                for element in iter_array(response.iter_content(CHUNK_SIZE)):
+                    consume(element)
+        except (requests.RequestException, ValueError):
+            return False
+        return True
+
+    # Make the same call for each org concurrently, returning a dict of org ID to data
+    async def for_orgs(self, call, org_ids):
+        results = await asyncio.gather(*[call(org_id) for org_id in org_ids])
+        return dict(zip(org_ids, results))
+
+    # List the organizations that the user has privileges on
+    # https://api.meraki.com/api_docs#list-the-organizations-that-the-user-has-privileges-on
+    async def get_organizations(self):
+        return await self.call('GET', '/organizations')
+
+    # List the status of every Meraki device in the organization
+    # https://api.meraki.com/api_docs#list-the-status-of-every-meraki-device-in-the-organization
+    async def get_device_statuses(self, org_id):
+        return await self.call('GET', f'/organizations/{org_id}/deviceStatuses')
+
+    # Return the uplink loss and latency for every MX in the organization from at latest 2 minutes ago
+    # https://api.meraki.com/api_docs#return-the-uplink-loss-and-latency-for-every-mx-in-the-organization-from-at-latest-2-minutes-ago
+    async def get_uplinks_loss_latency(self, org_id):
+        return await self.call('GET', f'/organizations/{org_id}/uplinksLossAndLatency')
+
+    # List the devices in an organization
+    # https://api.meraki.com/api_docs#list-the-devices-in-an-organization
+    async def get_org_devices(self, org_id):
+        return await self.call('GET', f'/organizations/{org_id}/devices')
+
+    # List the networks in an organization
+    # https://api.meraki.com/api_docs#list-the-networks-in-an-organization
+    async def get_org_networks(self, org_id):
+        return await self.call('GET', f'/organizations/{org_id}/networks')
+
+    # Return the inventory for an organization
+    # https://api.meraki.com/api_docs#return-the-inventory-for-an-organization
+    async def get_org_inventory(self, org_id):
+        return await self.call('GET', f'/organizations/{org_id}/inventory')
+
+    # Return a network
+    # https://api.meraki.com/api_docs#return-a-network
+    async def get_network(self, net_id):
+        return await self.call('GET', f'/networks/{net_id}')
+
+    # List the devices in a network
+    # https://api.meraki.com/api_docs#list-the-devices-in-a-network
+    async def get_network_devices(self, net_id):
+        return await self.call('GET', f'/networks/{net_id}/devices')
+
+    # Returns video link to the specified camera. If a timestamp is supplied, it links to that timestamp.
+    # https://api.meraki.com/api_docs#returns-video-link-to-the-specified-camera
+    async def get_video_link(self, net_id, serial, timestamp=None):
+        params = {'timestamp': timestamp} if timestamp else None
+        data = await self.call('GET', f'/networks/{net_id}/cameras/{serial}/videoLink', params=params)
+        return data['url'] if data else None
+
+    # Generate a snapshot of what the camera sees at the specified time and return a link to that image.
+    # https://api.meraki.com/api_docs#generate-a-snapshot-of-what-the-camera-sees-at-the-specified-time-and-return-a-link-to-that-image
+    async def generate_snapshot(self, net_id, serial, timestamp=None):
+        payload = {'timestamp': timestamp} if timestamp else {}
+        data = await self.call('POST', f'/networks/{net_id}/cameras/{serial}/snapshot', json=payload)
+        return data['url'] if data else None
+
+    # Release the worker threads; the session is left open for the caller
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+# Await several calls at once, returning their results in the same order
+async def gather(*calls):
+    return await asyncio.gather(*calls)
+
+
+# Run a coroutine to completion from blocking code, such as a chatbot handler or script
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
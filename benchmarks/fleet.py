@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+import random
+
+# Model mix of a typical org, with more access points and switches than appliances and cameras
+MODELS = ['MR33'] * 6 + ['MR42'] * 4 + ['MS220-8P'] * 4 + ['MS120-24P'] * 2 + ['MX64', 'MX84', 'Z3', 'MV12WE', 'MV22']
+
+# Devices per network, and share of devices that are not online
+NETWORK_SIZE = 20
+OFFLINE = .03
+ALERTING = .02
+
+
+# Synthetic org with the same response shapes as the Meraki dashboard API v0, generated deterministically from a seed
+class Fleet:
+    def __init__(self, devices=1000, org_id='123456', seed=0, unused=.05, samples=5):
+        rng = random.Random(seed)
+        self.org_id = org_id
+        self.organizations = [{'id': org_id, 'name': f'Benchmark Org ({devices} devices)'}]
+        self.networks = [{'id': f'N_{n}', 'organizationId': org_id, 'name': f'Site {n}', 'timeZone': 'America/Los_Angeles',
+                          'tags': None, 'type': 'combined'}
+                         for n in range(max(devices // NETWORK_SIZE, 1))]
+
+        self.devices = []
+        self.statuses = []
+        self.inventory = []
+        for d in range(devices):
+            serial = f'Q2{d // 10000:02d}-{d // 100 % 100:02d}{d % 100:02d}-BNCH'
+            model = rng.choice(MODELS)
+            mac = ':'.join(f'{b:02x}' for b in (0x88, 0x15, 0x44, d >> 16 & 255, d >> 8 & 255, d & 255))
+            network = rng.choice(self.networks)
+            tags = ' '.join(tag for tag in ('always_on', 'check_perf', 'chatbot') if rng.random() < .3)
+            lan_ip = f'10.{d >> 16 & 255}.{d >> 8 & 255}.{d & 255}'
+
+            # Some of the inventory is not yet claimed into a network
+            if rng.random() < unused:
+                self.inventory.append({'mac': mac, 'serial': serial, 'networkId': None, 'model': model,
+                                       'claimedAt': '2019-01-01T00:00:00Z', 'publicIp': None, 'name': None})
+                continue
+
+            device = {'name': f'{model} {d}', 'serial': serial, 'mac': mac, 'model': model, 'networkId': network['id'],
+                      'lanIp': lan_ip, 'tags': f' {tags} ' if tags else None, 'lat': 37.4180951010362,
+                      'lng': -122.098531723022, 'address': '1600 Amphitheatre Pkwy, Mountain View, CA', 'firmware': 'wired-14-40'}
+            roll = rng.random()
+            status = {'name': device['name'], 'serial': serial, 'mac': mac, 'publicIp': '123.123.123.1',
+                      'networkId': network['id'], 'lanIp': lan_ip,
+                      'status': 'offline' if roll < OFFLINE else 'alerting' if roll < OFFLINE + ALERTING else 'online'}
+            if model[:2] in ('MX', 'Z3'):
+                status['usingCellularFailover'] = rng.random() < .1
+            self.devices.append(device)
+            self.statuses.append(status)
+            self.inventory.append({'mac': mac, 'serial': serial, 'networkId': network['id'], 'model': model,
+                                   'claimedAt': '2019-01-01T00:00:00Z', 'publicIp': '123.123.123.1', 'name': device['name']})
+
+        # Uplink probes of each appliance, a sample a minute for the last few minutes
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        times = [(now - timedelta(minutes=samples - i)).strftime('%Y-%m-%dT%H:%M:%SZ') for i in range(samples)]
+        self.uplinks = []
+        for device in self.devices:
+            if device['model'][:2] not in ('MX', 'Z3'):
+                continue
+            for uplink in ('wan1', 'wan2'):
+                loss = rng.choice([0.0, 0.0, 0.0, 1.5, 12.0])
+                latency = rng.choice([18.0, 25.0, 32.0, 70.0])
+                self.uplinks.append({'networkId': device['networkId'], 'serial': device['serial'], 'uplink': uplink,
+                                     'ip': '8.8.8.8',
+                                     'timeSeries': [{'ts': ts, 'lossPercent': loss, 'latencyMs': latency + rng.random()}
+                                                    for ts in times]})
+
+        self.by_serial = {d['serial']: d for d in self.devices}
+        self.networks_by_id = {n['id']: n for n in self.networks}
+
+    # Devices of a network
+    def network_devices(self, net_id):
+        return [d for d in self.devices if d['networkId'] == net_id]
+
+    # Cameras that are online, as selected by the snapshot command
+    def online_cameras(self):
+        online = set(s['serial'] for s in self.statuses if s['status'] == 'online')
+        return [d for d in self.devices if d['model'][:2] == 'MV' and d['serial'] in online]
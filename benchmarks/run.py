@@ -0,0 +1,234 @@
+# Usage: python -m benchmarks.run [--devices 20000] [--latency 0.05] [--webex-429 0.1] [--output results.json]
+
+import argparse
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import platform
+import runpy
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import zipfile
+
+# The modules under test are top-level scripts in the repository root
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import requests
+
+from benchmarks.fleet import Fleet
+from benchmarks.standins import StandIn, redirected
+
+API_KEY = 'abcdefghijklmnopqrstuvwxyz0123456789csco'
+TOKEN = 'benchmark-bot-token'
+EMAIL = 'user@example.com'
+
+# Cards and settings that the scripts read from their working directory
+CARDS = ['deploy.json', 'error.json', 'success.json']
+CREDENTIALS = f'''[meraki]
+key1 = {API_KEY}
+key2 = {API_KEY}
+organization = {{org_id}}
+cameras =
+lookback = 3
+secret =
+tag1 = always_on
+tag2 = check_perf
+
+[chatbot]
+token = {TOKEN}
+email = {EMAIL}
+'''
+
+
+# Everything a scenario needs to call into the code under test
+class Context:
+    def __init__(self, fleet, standin, workdir):
+        self.fleet = fleet
+        self.standin = standin
+        self.workdir = workdir
+        self.org_id = fleet.org_id
+        self.api_key = API_KEY
+        self.session = requests.Session()
+        self.headers = {'content-type': 'application/json; charset=utf-8', 'authorization': f'Bearer {TOKEN}'}
+        self.payload = {'toPersonEmail': EMAIL}
+        self.room_payload = {'roomId': 'room-1'}
+
+
+# Chatbot "status" command
+def bench_device_status(context):
+    import status
+    status.device_status(context.session, context.headers, context.payload, context.api_key)
+
+
+# Chatbot "snapshot" command for all online cameras
+def bench_return_snapshots(context):
+    import snapshot
+    snapshot.return_snapshots(context.session, context.headers, context.payload, context.api_key,
+                              context.org_id, 'snapshot all cameras', [])
+
+
+# Scheduled appliance uplink check, as run from cron
+def bench_check_perf(context):
+    runpy.run_path(os.path.join(REPO, 'check_perf.py'), run_name='__main__')
+
+
+# Scheduled offline device check, as run from cron
+def bench_always_on(context):
+    runpy.run_path(os.path.join(REPO, 'always_on.py'), run_name='__main__')
+
+
+# Provisioning card submission, creating a network and claiming an unused device of each family
+def bench_process_inputs(context):
+    import provision
+    unused = {}
+    for device in context.fleet.inventory:
+        family = 'MX' if device['model'][:2] in ('MX', 'Z1', 'Z3') else device['model'][:2]
+        if not device['networkId'] and family not in unused:
+            unused[family] = device['serial']
+    context.runs = getattr(context, 'runs', 0) + 1
+    inputs = {'inputs': {'myLocation': f'Benchmark {context.runs} {time.monotonic_ns()}', 'myAddress': '1 Main St',
+                         'MXSelectVal': unused.get('MX', 'none'), 'MSSelectVal': unused.get('MS', 'none'),
+                         'MRSelectVal': unused.get('MR', 'none'), 'MVSelectVal': unused.get('MV', 'none')}}
+    provision.process_inputs(context.session, context.headers, context.room_payload, context.api_key,
+                             context.org_id, inputs)
+
+
+# Dashboard webhook handler from the AWS Lambda package, for a motion alert with snapshot and a plain alert
+def bench_webhook(context):
+    handler = load_webhook_handler()
+    camera = context.fleet.online_cameras()[0]
+    network = context.fleet.networks_by_id[camera['networkId']]
+    base = {'version': '0.1', 'sharedSecret': '', 'organizationId': context.org_id, 'organizationName': 'Benchmark',
+            'networkId': network['id'], 'networkName': network['name'],
+            'networkUrl': 'https://n1.meraki.com/o/benchmark/manage/nodes/list', 'sentAt': '2019-01-01T00:00:00.000000Z'}
+    events = [
+        dict(base, alertId='1', alertType='Motion detected', deviceSerial=camera['serial'], deviceName=camera['name'],
+             deviceUrl='https://n1.meraki.com/o/benchmark/manage/nodes/new_list/camera',
+             alertData={'timestamp': time.time(), 'imageUrl': None}),
+        dict(base, alertId='2', alertType='APs went down', alertData={'name': 'Front', 'minutes': 5}),
+    ]
+    for event in events:
+        handler.lambda_handler({'body': json.dumps(event)}, None)
+
+
+# The Lambda package's handler, importing the shared modules from the repository as it would once deployed
+def load_webhook_handler():
+    if 'lambda_function' not in sys.modules:
+        with zipfile.ZipFile(os.path.join(REPO, 'dashboard_AWS.zip')) as package:
+            source = package.read('lambda_function.py')
+        module = types.ModuleType('lambda_function')
+        module.__file__ = os.path.join(REPO, 'dashboard_AWS.zip', 'lambda_function.py')
+        exec(compile(source, module.__file__, 'exec'), module.__dict__)
+        sys.modules['lambda_function'] = module
+    return sys.modules['lambda_function']
+
+
+SCENARIOS = {
+    'device_status': bench_device_status,
+    'return_snapshots': bench_return_snapshots,
+    'check_perf': bench_check_perf,
+    'always_on': bench_always_on,
+    'process_inputs': bench_process_inputs,
+    'webhook': bench_webhook,
+}
+
+
+# Forget anything cached between runs, so each one pays for its own calls
+def reset_caches():
+    import cache
+    cache.cache.clear()
+
+
+# Run a scenario untraced for timing, then once more under tracemalloc for peak memory, counting calls of each run
+def measure(name, scenario, context, repeat):
+    result = {'seconds': [], 'calls': None, 'throttled': None}
+    output = io.StringIO()
+    try:
+        for _ in range(repeat):
+            reset_caches()
+            context.standin.reset()
+            with redirect_stdout(output):
+                started = time.perf_counter()
+                scenario(context)
+                result['seconds'].append(time.perf_counter() - started)
+            stats = context.standin.stats()
+
+        reset_caches()
+        tracemalloc.start()
+        with redirect_stdout(output):
+            scenario(context)
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    except (Exception, SystemExit) as e:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        result['error'] = f'{type(e).__name__}: {e}'
+        return result
+
+    result.update(median=statistics.median(result['seconds']), min=min(result['seconds']),
+                  peak_memory=peak, calls=stats['calls'], throttled=stats['throttled'],
+                  total_calls=stats['total_calls'], bytes_sent=stats['bytes_sent'],
+                  bytes_received=stats['bytes_received'], output_lines=output.getvalue().count('\n') // (repeat + 1))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the chatbot and scripts against local Meraki/Webex stand-ins')
+    parser.add_argument('--devices', type=int, default=1000, help='devices in the synthetic org (10 to 100000)')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds added to every API response')
+    parser.add_argument('--meraki-429', type=float, default=0.0, help='share of Meraki calls answered 429')
+    parser.add_argument('--webex-429', type=float, default=0.0, help='share of Webex calls answered 429')
+    parser.add_argument('--snapshot-size', type=int, default=64 * 1024, help='bytes of each camera snapshot')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each scenario')
+    parser.add_argument('--only', nargs='*', choices=sorted(SCENARIOS), help='scenarios to run (default all)')
+    parser.add_argument('--output', help='write JSON results to this file instead of standard output')
+    args = parser.parse_args(argv)
+
+    fleet = Fleet(args.devices)
+    standin = StandIn(fleet, args.latency, args.meraki_429, args.webex_429, args.snapshot_size, EMAIL)
+
+    # The scripts read credentials and cards from their working directory
+    workdir = tempfile.mkdtemp(prefix='benchmark_')
+    with open(os.path.join(workdir, 'credentials.ini'), 'w') as fp:
+        fp.write(CREDENTIALS.format(org_id=fleet.org_id))
+    for card in CARDS:
+        shutil.copy(os.path.join(REPO, card), workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    context = Context(fleet, standin, workdir)
+    results = {}
+    try:
+        with redirected(standin):
+            for name in args.only or SCENARIOS:
+                results[name] = measure(name, SCENARIOS[name], context, args.repeat)
+    finally:
+        os.chdir(cwd)
+        standin.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'config': {'devices': args.devices, 'networks': len(fleet.networks), 'cameras': len(fleet.online_cameras()),
+                   'appliance_uplinks': len(fleet.uplinks), 'latency': args.latency, 'meraki_429': args.meraki_429,
+                   'webex_429': args.webex_429, 'snapshot_size': args.snapshot_size, 'repeat': args.repeat},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
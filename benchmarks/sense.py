@@ -0,0 +1,342 @@
+# Usage: python -m benchmarks.sense record recording.mvs [--host localhost] [--seconds 600]
+#        python -m benchmarks.sense generate recording.mvs [--cameras 10] [--seconds 600] [--rate 5]
+#        python -m benchmarks.sense replay recording.mvs [--cameras 500] [--speed 0] [--broker localhost]
+
+from array import array
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import struct
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# The modules under test are top-level scripts in the repository root
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from detection import DEFAULT_RULES, parse_rule
+from mqtt import QUEUE_SIZE, Camera, SenseEngine
+from occupancy import OccupancySeries
+
+# Recordings are gzipped: this magic and the recording's start (epoch seconds), then per message its milliseconds
+# since the start, topic number and payload length, followed by the payload. A topic number of NEW_TOPIC instead
+# introduces the next topic, with its name as the payload.
+MAGIC = b'MVSENSE1'
+HEADER = struct.Struct('<d')
+RECORD = struct.Struct('<IHI')
+NEW_TOPIC = 0xFFFF
+
+TOPIC = '/merakimv/{}/raw_detections'
+SUBSCRIPTION = TOPIC.format('+')
+
+
+# Writes messages to a recording as they arrive, from the paho network thread or directly
+class Recorder:
+    def __init__(self, path, start=None):
+        self.start = time.time() if start is None else start
+        self.file = gzip.open(path, 'wb')
+        self.file.write(MAGIC + HEADER.pack(self.start))
+        self.topics = {}
+        self.messages = 0
+        self.lock = threading.Lock()
+
+    # Add a message received at the given epoch seconds, or now
+    def record(self, topic, payload, received=None):
+        ms = round(((time.time() if received is None else received) - self.start) * 1000)
+        with self.lock:
+            number = self.topics.get(topic)
+            if number is None:
+                number = self.topics[topic] = len(self.topics)
+                name = topic.encode()
+                self.file.write(RECORD.pack(ms, NEW_TOPIC, len(name)) + name)
+            self.file.write(RECORD.pack(ms, number, len(payload)) + payload)
+            self.messages += 1
+
+    def on_connect(self, client, user_data, flags, rc):
+        client.subscribe(SUBSCRIPTION)
+
+    def on_message(self, client, user_data, msg):
+        self.record(msg.topic, msg.payload)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+# Messages of a recording as (milliseconds since its start, topic, payload)
+def read_recording(path):
+    with gzip.open(path, 'rb') as fp:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not an MV Sense recording')
+        fp.read(HEADER.size)
+        topics = []
+        while True:
+            header = fp.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            (ms, number, length) = RECORD.unpack(header)
+            payload = fp.read(length)
+            if number == NEW_TOPIC:
+                topics.append(payload.decode())
+            else:
+                yield ms, topics[number], payload
+
+
+# Serial of the camera publishing to a raw detections topic
+def serial_of(topic):
+    return topic.split('/')[2]
+
+
+# The recorded messages spread over a fleet of at least the given number of cameras, each recorded camera's stream
+# played by as many synthetic copies as needed
+def fleet(messages, cameras):
+    messages = list(messages)
+    recorded = sorted(set(topic for (ms, topic, payload) in messages))
+    copies = max(-(-cameras // len(recorded)), 1) if recorded else 1
+    if copies == 1:
+        return messages
+    topics = {topic: [TOPIC.format(f'{serial_of(topic)}-{copy}') for copy in range(copies)] for topic in recorded}
+    return [(ms, copy, payload) for (ms, topic, payload) in messages for copy in topics[topic]]
+
+
+# Messages as they become due at the given multiple of real time, or all at once for a speed of 0
+def paced(messages, speed):
+    if not speed:
+        yield from messages
+        return
+    start = time.monotonic()
+    for message in messages:
+        delay = start + message[0] / 1000 / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield message
+
+
+# Engine timing each message it handles, counting the alerts instead of sending them
+class TimedEngine(SenseEngine):
+    def __init__(self, cameras, rules=None, default=None, queue_size=QUEUE_SIZE, series=None):
+        super().__init__(cameras, self.alert, rules, default, queue_size, series)
+        self.latencies = array('Q')
+        self.alerting = set()
+        self.done = threading.Event()
+        self.expected = None
+
+    def alert(self, camera, counts):
+        self.alerting.add(camera.serial)
+
+    def handle(self, topic, payload):
+        started = time.perf_counter_ns()
+        try:
+            return super().handle(topic, payload)
+        finally:
+            self.latencies.append(time.perf_counter_ns() - started)
+            if self.expected is not None and len(self.latencies) >= self.expected:
+                self.done.set()
+
+
+# Replay messages to the engine directly, returning the seconds taken
+def replay_direct(engine, messages, speed):
+    started = time.perf_counter()
+    for (ms, topic, payload) in paced(messages, speed):
+        engine.handle(topic, payload)
+    return time.perf_counter() - started
+
+
+# Replay messages through an MQTT broker, publishing from one client to the engine subscribed with another as
+# mqtt.py is, returning the seconds taken until the engine had handled or dropped them all
+def replay_broker(engine, messages, speed, host, port, timeout=60):
+    import paho.mqtt.client as mqtt
+
+    subscriber = mqtt.Client()
+    subscribed = threading.Event()
+    subscriber.on_connect = engine.on_connect
+    subscriber.on_subscribe = lambda *args: subscribed.set()
+    subscriber.on_message = engine.on_message
+    subscriber.connect(host, port, 300)
+    subscriber.loop_start()
+    publisher = mqtt.Client()
+    publisher.connect(host, port, 300)
+    publisher.loop_start()
+    try:
+        if not subscribed.wait(timeout):
+            raise RuntimeError(f'Could not subscribe via the broker at {host}:{port}')
+        engine.expected = len(messages)
+        engine.start()
+        started = time.perf_counter()
+        for (ms, topic, payload) in paced(messages, speed):
+            publisher.publish(topic, payload)
+
+        # Messages dropped by the engine's queue never reach the handler
+        deadline = time.monotonic() + timeout
+        while not engine.done.wait(.1) and time.monotonic() < deadline:
+            if len(engine.latencies) + engine.stats()['dropped'] >= len(messages):
+                break
+        return time.perf_counter() - started
+    finally:
+        publisher.loop_stop()
+        publisher.disconnect()
+        subscriber.loop_stop()
+        subscriber.disconnect()
+        engine.stop()
+
+
+# Nearest-rank percentiles of handler latencies, in microseconds
+def percentiles(latencies, points=(50, 90, 99, 99.9)):
+    ordered = sorted(latencies)
+    if not ordered:
+        return {}
+    result = {f'p{p:g}': ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)] / 1000 for p in points}
+    result.update(mean=sum(ordered) / len(ordered) / 1000, max=ordered[-1] / 1000)
+    return result
+
+
+# Synthetic recording of cameras publishing raw detections at the given rate per second, with people and vehicles
+# coming and going so that alerts trip now and then
+def generate(path, cameras=10, seconds=600, rate=5, seed=0, start=None):
+    rng = random.Random(seed)
+    start = time.time() if start is None else start
+    recorder = Recorder(path, start)
+    serials = [f'Q2GV-{c // 10000:02d}{c // 100 % 100:02d}-{c % 100:02d}MV' for c in range(cameras)]
+    scenes = {serial: {'person': 0, 'vehicle': 0} for serial in serials}
+    oid = 0
+    try:
+        for tick in range(int(seconds * rate)):
+            elapsed = tick / rate
+            for serial in serials:
+                scene = scenes[serial]
+                for kind in scene:
+                    roll = rng.random()
+                    if roll < .01:
+                        scene[kind] += 1
+                    elif roll < .02 and scene[kind]:
+                        scene[kind] -= 1
+                objects = []
+                for (kind, count) in scene.items():
+                    for _ in range(count):
+                        oid += 1
+                        (x, y) = (rng.random() * .8, rng.random() * .8)
+                        objects.append({'frame': tick, 'oid': oid, 'type': kind, 'x0': round(x, 3),
+                                        'y0': round(y, 3), 'x1': round(x + .1, 3), 'y1': round(y + .2, 3)})
+                payload = json.dumps({'ts': int((start + elapsed) * 1000), 'objects': objects}).encode()
+                recorder.record(TOPIC.format(serial), payload, start + elapsed)
+    finally:
+        recorder.close()
+    return recorder.messages
+
+
+# Record raw detections from a broker until the time is up or interrupted, returning the messages recorded
+def record(path, host, port, seconds=None):
+    import paho.mqtt.client as mqtt
+
+    recorder = Recorder(path)
+    client = mqtt.Client()
+    client.on_connect = recorder.on_connect
+    client.on_message = recorder.on_message
+    client.connect(host, port, 300)
+    client.loop_start()
+    try:
+        if seconds:
+            time.sleep(seconds)
+        else:
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        recorder.close()
+    return recorder.messages
+
+
+# Replay a recording across a fleet of cameras, returning the results; with occupancy, the engine also keeps
+# occupancy series, in a temporary directory
+def replay(path, cameras=0, speed=0, broker=None, port=1883, rules=None, default=None, queue_size=QUEUE_SIZE,
+           occupancy=False):
+    messages = fleet(read_recording(path), cameras)
+    directory = tempfile.mkdtemp(prefix='occupancy_') if occupancy else None
+    series = OccupancySeries(directory) if occupancy else None
+    engine = TimedEngine([Camera(serial_of(topic), None, 'N_1', 'MV12') for topic in
+                          set(topic for (ms, topic, payload) in messages)], rules, default, queue_size, series)
+    try:
+        if broker:
+            seconds = replay_broker(engine, messages, speed, broker, port)
+        else:
+            seconds = replay_direct(engine, messages, speed)
+    finally:
+        if series:
+            series.close()
+            shutil.rmtree(directory, ignore_errors=True)
+    handled = len(engine.latencies)
+    return {'messages': len(messages), 'cameras': len(engine.topics), 'seconds': seconds,
+            'recorded_seconds': messages[-1][0] / 1000 if messages else 0,
+            'messages_per_second': handled / seconds if seconds else None,
+            'latency_us': percentiles(engine.latencies), 'alerts': engine.stats()['alerts'],
+            'cameras_alerting': len(engine.alerting), 'engine': engine.stats()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record, generate and replay MV Sense raw detections')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    recording = commands.add_parser('record', help='record raw detections from a broker')
+    recording.add_argument('path')
+    recording.add_argument('--host', default='localhost', help='MQTT broker the cameras publish to')
+    recording.add_argument('--port', type=int, default=1883)
+    recording.add_argument('--seconds', type=float, help='stop after this long (default until interrupted)')
+
+    generating = commands.add_parser('generate', help='write a synthetic recording')
+    generating.add_argument('path')
+    generating.add_argument('--cameras', type=int, default=10)
+    generating.add_argument('--seconds', type=float, default=600)
+    generating.add_argument('--rate', type=float, default=5, help='messages per second from each camera')
+    generating.add_argument('--seed', type=int, default=0)
+
+    replaying = commands.add_parser('replay', help='replay a recording and report throughput, latency and alerts')
+    replaying.add_argument('path')
+    replaying.add_argument('--cameras', type=int, default=0, help='cameras to spread the recording over')
+    replaying.add_argument('--speed', type=float, default=0, help='multiple of real time (default 0, as fast as possible)')
+    replaying.add_argument('--broker', help='publish via the MQTT broker on this host instead of calling the handler')
+    replaying.add_argument('--port', type=int, default=1883)
+    replaying.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help='messages the engine queues from the broker')
+    replaying.add_argument('--occupancy', action='store_true', help='also keep occupancy series, as mqtt.py does')
+    replaying.add_argument('--rule', action='append', default=[], metavar='CLASS=SETTINGS',
+                           help="detection rule as in credentials.ini, such as person='min_hits=3 rising=no'")
+    replaying.add_argument('--output', help='write JSON results to this file instead of standard output')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        print(f'{record(args.path, args.host, args.port, args.seconds)} messages recorded')
+    elif args.command == 'generate':
+        print(f'{generate(args.path, args.cameras, args.seconds, args.rate, args.seed)} messages generated')
+    else:
+        rules = dict(DEFAULT_RULES)
+        for rule in args.rule:
+            (cls, text) = rule.split('=', 1)
+            rules[cls.strip()] = parse_rule(text)
+        default = rules.pop('default', None)
+
+        report = {
+            'config': {'recording': args.path, 'cameras': args.cameras, 'speed': args.speed, 'broker': args.broker,
+                       'occupancy': args.occupancy,
+                       'rules': {cls: repr(rule) for (cls, rule) in rules.items()}, 'default': repr(default)},
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())},
+            'results': replay(args.path, args.cameras, args.speed, args.broker, args.port, rules, default,
+                              args.queue_size, args.occupancy),
+        }
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as fp:
+                fp.write(text + '\n')
+        else:
+            print(text)
+
+
+if __name__ == '__main__':
+    main()
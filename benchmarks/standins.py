@@ -0,0 +1,229 @@
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Hosts whose requests are answered by the stand-in instead: the dashboard API, Webex, and camera snapshot URLs
+HOSTS = re.compile(r'^(api\.meraki\.com|api\.ciscospark\.com|webexapis\.com|[\w.-]*\.meraki\.com)$')
+
+# Bytes of each stand-in camera snapshot
+SNAPSHOT_SIZE = 64 * 1024
+
+
+# Local HTTP server answering the Meraki dashboard API v0 and Webex endpoints used here from a synthetic fleet,
+# with added latency and a share of requests rejected with 429 Too Many Requests, counting every call
+class StandIn:
+    def __init__(self, fleet, latency=0.0, meraki_429=0.0, webex_429=0.0, snapshot_size=SNAPSHOT_SIZE,
+                 email='user@example.com', seed=0):
+        self.fleet = fleet
+        self.latency = latency
+        self.throttle = {'meraki': meraki_429, 'webex': webex_429}
+        self.snapshot = bytes(random.Random(seed).getrandbits(8) for _ in range(snapshot_size))
+        self.email = email
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.received = 0
+        self.sent = 0
+        self.cache = {}
+        self.created = 0
+
+        # Routes as (method, pattern, name), the name also grouping calls in the results
+        self.routes = [
+            ('GET', r'^/api/v0/organizations$', 'organizations'),
+            ('GET', r'^/api/v0/organizations/[^/]+/devices$', 'org_devices'),
+            ('GET', r'^/api/v0/organizations/[^/]+/deviceStatuses$', 'device_statuses'),
+            ('GET', r'^/api/v0/organizations/[^/]+/networks$', 'org_networks'),
+            ('POST', r'^/api/v0/organizations/[^/]+/networks$', 'create_network'),
+            ('GET', r'^/api/v0/organizations/[^/]+/inventory$', 'inventory'),
+            ('GET', r'^/api/v0/organizations/[^/]+/uplinksLossAndLatency$', 'uplinks'),
+            ('GET', r'^/api/v0/networks/(?P<net_id>[^/]+)$', 'network'),
+            ('GET', r'^/api/v0/networks/(?P<net_id>[^/]+)/devices$', 'network_devices'),
+            ('POST', r'^/api/v0/networks/[^/]+/devices/claim$', 'claim_device'),
+            ('PUT', r'^/api/v0/networks/[^/]+/devices/(?P<serial>[^/]+)$', 'update_device'),
+            ('GET', r'^/api/v0/networks/[^/]+/cameras/(?P<serial>[^/]+)/videoLink$', 'video_link'),
+            ('POST', r'^/api/v0/networks/[^/]+/cameras/(?P<serial>[^/]+)/snapshot$', 'generate_snapshot'),
+            ('GET', r'^/stream/jpeg/snapshot/(?P<serial>[^/]+)$', 'snapshot_image'),
+            ('POST', r'^/v1/messages$', 'webex_messages'),
+            ('GET', r'^/v1/messages$', 'webex_list_messages'),
+            ('GET', r'^/v1/rooms$', 'webex_rooms'),
+            ('GET', r'^/v1/people/(?P<person_id>[^/]+)$', 'webex_person'),
+        ]
+        self.routes = [(method, re.compile(pattern), name) for (method, pattern, name) in self.routes]
+
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                standin.handle(self, 'GET')
+
+            def do_POST(self):
+                standin.handle(self, 'POST')
+
+            def do_PUT(self):
+                standin.handle(self, 'PUT')
+
+            def do_DELETE(self):
+                standin.handle(self, 'DELETE')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    # Find the route of a request, returning its name and path parameters
+    def route(self, method, path):
+        for (route_method, pattern, name) in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                return name, match.groupdict()
+        return None, {}
+
+    # JSON body of a route, serialized once for the large org-wide listings
+    def body(self, name, params, request):
+        fleet = self.fleet
+        listings = {'organizations': fleet.organizations, 'org_devices': fleet.devices,
+                    'device_statuses': fleet.statuses, 'org_networks': fleet.networks,
+                    'inventory': fleet.inventory, 'uplinks': fleet.uplinks}
+        if name in listings:
+            if name not in self.cache:
+                self.cache[name] = json.dumps(listings[name]).encode()
+            return self.cache[name]
+
+        if name == 'network':
+            data = fleet.networks_by_id.get(params['net_id'])
+        elif name == 'network_devices':
+            data = fleet.network_devices(params['net_id'])
+        elif name == 'create_network':
+            with self.lock:
+                self.created += 1
+                data = dict(request, id=f'N_new_{self.created}', organizationId=fleet.org_id)
+        elif name == 'claim_device':
+            data = {}
+        elif name == 'update_device':
+            data = dict(fleet.by_serial.get(params['serial'], {'serial': params['serial']}), **request)
+        elif name == 'video_link':
+            data = {'url': f'https://n1.meraki.com/o/benchmark/manage/nodes/new_list/{params["serial"]}'}
+        elif name == 'generate_snapshot':
+            data = {'url': f'https://spn1.meraki.com/stream/jpeg/snapshot/{params["serial"]}'}
+        elif name == 'webex_messages':
+            data = {'id': f'message-{time.monotonic_ns()}', 'created': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())}
+        elif name == 'webex_list_messages':
+            data = {'items': []}
+        elif name == 'webex_rooms':
+            data = {'items': [{'id': 'room-1', 'title': 'Benchmark', 'type': 'direct', 'creatorId': 'person-1'}]}
+        elif name == 'webex_person':
+            data = {'id': params['person_id'], 'emails': [self.email], 'displayName': 'Benchmark User'}
+        else:
+            data = None
+        return json.dumps(data).encode()
+
+    def handle(self, handler, method):
+        length = int(handler.headers.get('Content-Length') or 0)
+        raw = handler.rfile.read(length) if length else b''
+        path = urlsplit(handler.path).path
+        (name, params) = self.route(method, path)
+        time.sleep(self.latency)
+
+        with self.lock:
+            self.calls[name or f'unknown {method} {path}'] += 1
+            api = 'webex' if path.startswith('/v1/') else 'meraki'
+            throttled = name and self.rng.random() < self.throttle[api]
+            if throttled:
+                self.throttled[name] += 1
+
+        if name is None:
+            sent = self.respond(handler, 404, b'', 'application/json')
+        elif throttled:
+            sent = self.respond(handler, 429, b'{"errors":["Too many requests"]}', 'application/json', {'Retry-After': '0'})
+        elif name == 'snapshot_image':
+            sent = self.respond(handler, 200, self.snapshot, 'image/jpeg')
+        else:
+            try:
+                request = json.loads(raw) if raw and handler.headers.get('Content-Type', '').startswith('application/json') else {}
+            except ValueError:
+                request = {}
+            sent = self.respond(handler, 200, self.body(name, params, request), 'application/json')
+        with self.lock:
+            self.received += length
+            self.sent += sent
+
+    def respond(self, handler, status, body, content_type, headers=None):
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        for (key, value) in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+        return len(body)
+
+    # Counts of calls (and those throttled) per route, and bytes each way, since the last reset
+    def stats(self):
+        with self.lock:
+            return {'calls': dict(self.calls), 'throttled': dict(self.throttled), 'total_calls': sum(self.calls.values()),
+                    'bytes_received': self.received, 'bytes_sent': self.sent}
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.throttled.clear()
+            self.received = 0
+            self.sent = 0
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Transport adapter sending requests for the real API hosts to the stand-in, over plain HTTP with pooled connections
+class StandInAdapter(HTTPAdapter):
+    def __init__(self, url, **kwargs):
+        self.target = urlsplit(url)
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = request.url
+        parts = urlsplit(url)
+        if HOSTS.match(parts.hostname or ''):
+            request.url = urlunsplit((self.target.scheme, self.target.netloc, parts.path, parts.query, parts.fragment))
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            # Responses still show the real URL, for redirects and per-endpoint metrics
+            request.url = url
+
+
+# Route every session's HTTPS requests through the stand-in while in this context, including those sessions
+# that the code under test creates for itself
+@contextmanager
+def redirected(standin, pool_size=32):
+    adapter = StandInAdapter(standin.url, pool_connections=pool_size, pool_maxsize=pool_size)
+    get_adapter = requests.Session.get_adapter
+
+    def stand_in_adapter(session, url):
+        if HOSTS.match(urlsplit(url).hostname or ''):
+            return adapter
+        return get_adapter(session, url)
+
+    requests.Session.get_adapter = stand_in_adapter
+    try:
+        yield adapter
+    finally:
+        requests.Session.get_adapter = get_adapter
+        adapter.close()
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from functools import wraps
+import inspect
+import threading
+import time
+
+# Seconds that responses are reused for, per endpoint
+TTLS = {
+    'organizations': 300,
+    'network': 300,
+    'networks': 60,
+    'inventory': 30,
+    'deviceStatuses': 15,
+}
+DEFAULT_TTL = 30
+
+# Most responses held at once, beyond which the least recently used are evicted
+MAX_ENTRIES = 256
+
+
+# Size-bounded LRU cache of API responses, expiring entries after their endpoint's TTL
+class TTLCache:
+    def __init__(self, ttls=None, max_entries=MAX_ENTRIES):
+        self.ttls = dict(TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def count(self, endpoint, stat):
+        stats = self.counts.setdefault(endpoint, {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0})
+        stats[stat] += 1
+
+    # Return (True, data) if a fresh response is cached, otherwise (False, None)
+    def get(self, endpoint, key):
+        with self.lock:
+            entry = self.entries.get((endpoint, key))
+            if entry is None:
+                self.count(endpoint, 'misses')
+                return (False, None)
+            (expires, params, data) = entry
+            if time.monotonic() >= expires:
+                del self.entries[(endpoint, key)]
+                self.count(endpoint, 'expired')
+                self.count(endpoint, 'misses')
+                return (False, None)
+            self.entries.move_to_end((endpoint, key))
+            self.count(endpoint, 'hits')
+            return (True, data)
+
+    def set(self, endpoint, key, params, data):
+        expires = time.monotonic() + self.ttls.get(endpoint, DEFAULT_TTL)
+        with self.lock:
+            self.entries[(endpoint, key)] = (expires, params, data)
+            self.entries.move_to_end((endpoint, key))
+            while len(self.entries) > self.max_entries:
+                ((evicted, _), _) = self.entries.popitem(last=False)
+                self.count(evicted, 'evicted')
+
+    # Drop cached responses for the endpoint (or all endpoints) whose call arguments match those given
+    def invalidate(self, endpoint=None, **match):
+        with self.lock:
+            for (cached_endpoint, key), (_, params, _) in list(self.entries.items()):
+                if endpoint and cached_endpoint != endpoint:
+                    continue
+                if all(params.get(name) == value for (name, value) in match.items()):
+                    del self.entries[(cached_endpoint, key)]
+                    self.count(cached_endpoint, 'invalidated')
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # Hit/miss statistics per endpoint, plus the current number of entries
+    def stats(self):
+        with self.lock:
+            report = {endpoint: dict(stats) for (endpoint, stats) in self.counts.items()}
+            for stats in report.values():
+                lookups = stats['hits'] + stats['misses']
+                stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+            return {'size': len(self.entries), 'endpoints': report}
+
+
+# Cache shared by all modules in this process
+cache = TTLCache()
+
+
+# Decorator to reuse an API wrapper's responses for the endpoint, keyed on all arguments other than the session
+def cached(endpoint, keep=lambda data: data is not None):
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {name: value for (name, value) in bound.arguments.items() if name != 'session'}
+            key = (function.__module__, function.__name__) + tuple(params.items())
+            (found, data) = cache.get(endpoint, key)
+            if found:
+                return data
+            data = function(*args, **kwargs)
+            if keep(data):
+                cache.set(endpoint, key, params, data)
+            return data
+        return wrapper
+    return decorator
+
+
+# Invalidate cached responses after a write, for example invalidate('networks', org_id=org_id)
+def invalidate(endpoint=None, **match):
+    cache.invalidate(endpoint, **match)
+
+
+# Hit/miss statistics of the shared cache
+def cache_stats():
+    return cache.stats()
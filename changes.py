@@ -0,0 +1,76 @@
+from collections import namedtuple
+import json
+import os
+import tempfile
+
+# Where baselines are kept between runs; /tmp also survives between warm Lambda/Cloud Functions invocations
+BASELINE_DIR = tempfile.gettempdir()
+
+# Fields of each device's status that are tracked, in the order stored in the baseline
+FIELDS = ('status', 'lanIp', 'publicIp', 'usingCellularFailover')
+
+# A change to one field of a device since the last poll; before is None for new devices, after is None for removed ones
+Transition = namedtuple('Transition', ['serial', 'field', 'before', 'after', 'device'])
+
+
+# Path of the baseline file for an org
+def baseline_path(org_id):
+    return os.path.join(BASELINE_DIR, f'baseline_{org_id}.json')
+
+
+# Compact per-serial record of device statuses, persisted between runs to find only what changed
+class StatusBaseline:
+    def __init__(self, path=None):
+        self.path = path
+        self.devices = {}
+        self.listeners = []
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                self.devices = json.load(fp)
+        except (OSError, ValueError):
+            self.devices = {}
+
+    # Write the baseline atomically, so an interrupted run never leaves it half written
+    def save(self):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(self.devices, fp, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+
+    # Register callback(transition) to be called for each change found by update()
+    def on_change(self, callback):
+        self.listeners.append(callback)
+
+    # Yield transitions from the baseline to the given device statuses, moving the baseline forward as it goes
+    def changes(self, statuses):
+        seen = set()
+        for device in statuses:
+            serial = device['serial']
+            seen.add(serial)
+            current = [device.get(field) for field in FIELDS]
+            previous = self.devices.get(serial)
+            if previous is None:
+                yield Transition(serial, 'status', None, current[0], device)
+            elif previous != current:
+                for (field, before, after) in zip(FIELDS, previous, current):
+                    if before != after:
+                        yield Transition(serial, field, before, after, device)
+            self.devices[serial] = current
+
+        # Devices no longer in the org
+        for serial in [serial for serial in self.devices if serial not in seen]:
+            yield Transition(serial, 'status', self.devices.pop(serial)[0], None, None)
+
+    # Find all transitions, notify listeners, persist the new baseline, and return the transitions
+    def update(self, statuses):
+        transitions = list(self.changes(statuses))
+        for transition in transitions:
+            for callback in self.listeners:
+                callback(transition)
+        if self.path:
+            self.save()
+        return transitions
@@ -0,0 +1,269 @@
+from datetime import datetime
+from datetime import timedelta
+
+from outbox import deliver, fetch
+from readiness import wait_for_snapshot
+
+# Largest file held in memory when relaying from a URL, and the size of chunks read
+MAX_BUFFER = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+# Get the event (most recent message) that triggered the webhook
+def get_message(session, event, headers):
+    url = f'https://api.ciscospark.com/v1/messages/{event["data"]["id"]}'
+    response = fetch(session, url, headers)
+    return response.json()['text']
+
+
+# Get user's info
+def get_user(session, user_id, headers):
+    url = f'https://api.ciscospark.com/v1/people/{user_id}'
+    response = fetch(session, url, headers)
+    return response.json()
+
+
+# Get user's name
+def get_name(session, user_id, headers):
+    data = get_user(session, user_id, headers)
+    if data['displayName']:
+        return data['displayName']
+    else:
+        return f'{data["firstName"]} {data["lastName"]}'
+
+
+# Get user's emails
+def get_emails(session, user_id, headers):
+    data = get_user(session, user_id, headers)
+    return data['emails']
+
+
+# Get chatbot's own ID
+def get_chatbot_id(session, headers):
+    response = fetch(session, 'https://api.ciscospark.com/v1/people/me', headers)
+    return response.json()['id']
+
+
+# Get chatbot's rooms
+def get_chatbot_rooms(session, headers):
+    response = fetch(session, 'https://api.ciscospark.com/v1/rooms', headers)
+    return response.json()
+
+
+# Get room ID for desired space
+def get_room_id(session, headers, room_name):
+    rooms = get_chatbot_rooms(session, headers)
+    for room in rooms:
+        if room['title'] == room_name:
+            return room['id']
+    return None
+
+
+# Get card submission data
+def get_card_data(session, headers, room_id):
+    response = fetch(session, f'https://api.ciscospark.com/v1/attachment/actions/{room_id}', headers)
+    return response.json()
+
+
+# Send a message in Webex Teams, waiting out any rate limiting
+def post_message(session, headers, payload, message):
+    body = dict(payload)
+    body['markdown'] = message
+    return deliver(session, headers, body)
+
+
+# Send a message with file attachment in Webex Teams
+def post_file(session, headers, payload, message, file_url):
+    body = dict(payload)
+    body['file'] = file_url
+    return post_message(session, headers, body, message)
+
+
+# Send a message with file attached, either from local storage (path) or from memory/stream (contents and file name),
+# waiting out any rate limiting as post_message does
+def send_file(session, headers, payload, message, file_path, file_type='text/plain', file_name=None):
+    # file_type such as 'image/png'
+    if isinstance(file_path, str):
+        with open(file_path, 'rb') as fp:
+            return send_file(session, headers, payload, message, fp, file_type, file_name or file_path)
+
+    if 'toPersonEmail' in payload:
+        p = {'toPersonEmail': payload['toPersonEmail']}
+    elif 'roomId' in payload:
+        p = {'roomId': payload['roomId']}
+    p['markdown'] = message
+    return deliver(session, headers, p, (file_name, file_path, file_type))
+
+
+# File-like view of a response body of known length, so that an upload reads it straight off the network. What has
+# been read is kept, so that a retried upload can rewind and read it again.
+class ResponseStream:
+    def __init__(self, response):
+        self.raw = response.raw
+        self.length = int(response.headers['Content-Length'])
+        self.buffer = bytearray()
+        self.position = 0
+
+    # Bytes left to read, as the multipart encoder expects
+    @property
+    def len(self):
+        return self.length - self.position
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if self.position < len(self.buffer):
+            chunk = bytes(self.buffer[self.position:self.position + size])
+        else:
+            chunk = self.raw.read(size)
+            if not chunk and size:
+                raise IOError(f'Stream ended with {remaining} bytes left to read')
+            self.buffer.extend(chunk)
+        self.position += len(chunk)
+        return chunk
+
+    def rewind(self):
+        self.position = 0
+
+
+# Read a streamed response into memory, or None if larger than the limit
+def read_file(response, max_size=MAX_BUFFER):
+    buffer = bytearray()
+    for chunk in response.iter_content(CHUNK_SIZE):
+        buffer.extend(chunk)
+        if len(buffer) > max_size:
+            response.close()
+            return None
+    return bytes(buffer)
+
+
+# Relay a file from URL into a message once it is ready, streamed through if its length is known or else buffered in memory
+def relay_file(session, headers, payload, message, file_name, file_url, file_type='image/jpg', model=None):
+    response = wait_for_snapshot(session, file_url, model)
+    if not response:
+        print(f'Unsuccessful in retrieving {file_url}')
+        return False
+    try:
+        if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+            contents = ResponseStream(response)
+        else:
+            contents = read_file(response)
+            if contents is None:
+                print(f'File at {file_url} is larger than {MAX_BUFFER} bytes')
+                return False
+        send_file(session, headers, payload, message, contents, file_type, f'{file_name}.jpg')
+    finally:
+        response.close()
+    return True
+
+
+# Save a streamed file response to local tmp storage
+def save_file(response, file_name):
+    temp_file = f'/tmp/{file_name}.jpg'
+    with open(temp_file, 'wb') as f:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            f.write(chunk)
+    return temp_file
+
+
+# Download file from URL once it is ready and write to local tmp storage
+def download_file(session, file_name, file_url, model=None):
+    response = wait_for_snapshot(session, file_url, model)
+    if response:
+        print(f'Successfully retrieved {file_url}')
+        return save_file(response, file_name)
+    print(f'Unsuccessful in retrieving {file_url}')
+    return None
+
+
+# Function to check whether message begins with one of multiple possible options
+def message_begins(text, options):
+    message = text.strip().lower()
+    for option in options:
+        if message.startswith(option):
+            return True
+    return False
+
+
+# Function to check whether message contains one of multiple possible options
+def message_contains(text, options):
+    message = text.strip().lower()
+    for option in options:
+        if option in message:
+            return True
+    return False
+
+
+# Clear your screen and display Miles!
+def clear_screen(session, headers, payload):
+    post_message(session, headers, payload,
+                 '''```
+                                   ./(((((((((((((((((/.
+                             *(((((((((((((((((((((((((((((
+                         .(((((((((((((((((((((((((((((((((((/
+                       ((((((((((((((((((((((((((((((((((((((((/
+                    ,((((((((((((((((((((((((((((((((((((((((((((
+                  .((((((((((((((((((((     ((((((/     ((((((((((,
+                 ((((((((((((((((((((((     ((((((/     (((((((((((
+               /((((((((((((((((((((((((((((((((((((((((((((((((((((
+              ((((((((((((((((((((((((((((((((((((((((((((((((((((((*
+             ((((((((((((((((((((((((((((((((((((((((((((((((((((((((
+            (((((((((((((((((((((((((((((((((((((((((((((((((((((((((
+           ((((((((((((((((((((((((     ((((((((((((((/     (((((((((
+          ,((((((((((((((((((((((((     ((((((((((((((/     ((((((((/
+          (((((((((((((((((((((((((    .//////////////*    .((((((((
+         ,(((((((((((((((((((((((((((((/              ((((((((((((.
+         ((((((((((((((((((((((((((((((/              (((((((((((
+         (((((((((((((((((((((((((((((((((((((((((((((((((((((((*
+        .(((((((((((((((((((((((((((((((((((((((((((((((((((((*
+        /((((((((((((((((((((((((((((((((((((((((((((((((((*
+        (((((((((((((((((((((((((((((((((((((((((((((((*
+        (((((((((((/.                     ....
+        (((((((/
+        (((((
+        (((
+        /.
+    ''')
+
+
+# List direct rooms (https://developer.webex.com/docs/api/v1/rooms/list-rooms)
+def list_rooms(session, headers):
+    url = 'https://api.ciscospark.com/v1/rooms?type=direct'
+    response = fetch(session, url, headers)
+    return response.json()['items']
+
+
+# List messages for room (https://developer.webex.com/docs/api/v1/messages/list-messages)
+def list_messages(session, headers, room_id):
+    url = f'https://api.ciscospark.com/v1/messages?roomId={room_id}'
+    response = fetch(session, url, headers)
+    return response.json()['items']
+
+
+# Function to prevent duplicating messages if matching snippet for user's email and within lookback time in minutes
+def already_duplicated(session, headers, snippet, email, lookback):
+    # Get current time
+    now = datetime.utcnow()
+
+    # Get list of rooms for chatbot, and then find user's room
+    rooms = list_rooms(session, headers)
+    for room in rooms:
+        user_id = room['creatorId']
+        if email in get_emails(session, user_id, headers):
+            break
+
+    # Get list of messages in that room
+    messages = list_messages(session, headers, room['id'])
+
+    # Filter on messages that match
+    match_snippet = [m for m in messages if 'webex.bot' in m['personEmail'] and m['markdown'] == snippet]
+
+    # See if any matched messages are within last lookback minutes
+    if match_snippet:
+        earlier = now - timedelta(minutes=lookback)
+        matches = [m for m in match_snippet if earlier < datetime.strptime(m['created'], '%Y-%m-%dT%H:%M:%S.%fZ')]
+        if matches:
+            return True
+    else:
+        return False
@@ -3,11 +3,19 @@ import sys
 
 import requests
 
+from async_api import *
 from chatbot import *
+from device_index import DeviceIndex
+from history import UplinkHistory
+from metrics import dump
+from uplinks import UplinkTable
 
 LOSS_THRESHOLD = 7.0
 LATENCY_THRESHOLD = 49.0
 
+# Where uplink results are kept with --history, for rolling statistics beyond the API's last few minutes
+HISTORY_DIR = 'history'
+
 
 # Store credentials in a separate file
 def gather_credentials():
@@ -25,36 +33,32 @@ def gather_credentials():
     return cam_key, chatbot_token, user_email, org_id, perf_tag
 
 
-# List the devices in an organization
-# https://api.meraki.com/api_docs#list-the-devices-in-an-organization
-def get_org_devices(session, api_key, org_id):
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-    response = session.get(f'https://api.meraki.com/api/v0/organizations/{org_id}/devices', headers=headers)
-    return response.json()
-
-
-# List the status of every Meraki device in the organization
-# https://api.meraki.com/api_docs#list-the-status-of-every-meraki-device-in-the-organization
-def get_org_statuses(session, api_key, org_id):
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-    response = session.get(f'https://api.meraki.com/api/v0/organizations/{org_id}/deviceStatuses', headers=headers)
-    return response.json()
-
+# Report tagged appliances (or all of them) whose uplinks have high loss or latency
+def report_uplinks(session, headers, payload, perf_tag, index, perf):
+    interesting_devices = [d['serial'] for d in index.select(family='MX', tag=perf_tag or None)]
 
-# List the networks in an organization
-# https://api.meraki.com/api_docs#list-the-networks-in-an-organization
-def get_org_networks(session, api_key, org_id):
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-    response = session.get(f'https://api.meraki.com/api/v0/organizations/{org_id}/networks', headers=headers)
-    return response.json()
+    # Calculate average loss and latency across all probes for last 5 minutes, for each appliance's uplinks at once
+    summary = UplinkTable(perf).summarize(set(interesting_devices))
 
-
-# Return the uplink loss and latency for every MX in the organization from at latest 2 minutes ago
-# https://api.meraki.com/api_docs#return-the-uplink-loss-and-latency-for-every-mx-in-the-organization-from-at-latest-2-minutes-ago
-def get_appliance_perf(session, api_key, org_id):
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-    response = session.get(f'https://api.meraki.com/api/v0/organizations/{org_id}/uplinksLossAndLatency', headers=headers)
-    return response.json()
+    for serial in interesting_devices:
+        for (uplink, text) in [('wan1', 'WAN1'), ('wan2', 'WAN2')]:
+            stats = summary.get((serial, uplink))
+            if stats is None:
+                continue
+            device = index[serial]
+            network_name = index.network(serial)['name']
+
+            # High packet loss
+            if stats.loss is not None and stats.loss > LOSS_THRESHOLD:
+                # Send message to user
+                message = f'🕳 **{device["name"]}** ({device["model"]}) in _{network_name}_ has packet loss of **{stats.loss:.1f}%** on _{text}_'
+                post_message(session, headers, payload, message)
+
+            # High latency
+            if stats.latency is not None and stats.latency > LATENCY_THRESHOLD:
+                # Send message to user
+                message = f'🐢 **{device["name"]}** ({device["model"]}) in _{network_name}_ has latency of **{stats.latency:.1f} ms** on _{text}_'
+                post_message(session, headers, payload, message)
 
 
 # Main function
@@ -72,60 +76,23 @@ if __name__ == '__main__':
         'toPersonEmail': user_email
     }
 
-    # Get org data
-    devices = get_org_devices(session, api_key, org_id)
-    statuses = get_org_statuses(session, api_key, org_id)
-    networks = get_org_networks(session, api_key, org_id)
-    perf = get_appliance_perf(session, api_key, org_id)
-
-    # Analyze the data
-    device_serials = [d['serial'] for d in devices]
-    network_ids = [n['id'] for n in networks]
-    if perf_tag:
-        interesting_devices = [d['serial'] for d in devices if 'tags' in d and perf_tag in d['tags'] and d['model'][:2] in ('MX', 'Z1', 'Z3')]
-    else:
-        interesting_devices = [d['serial'] for d in devices if d['model'][:2] in ('MX', 'Z1', 'Z3')]
-
-    # Calculate average loss and latency across all probes for last 5 minutes, for given appliance's uplink
-    for serial in interesting_devices:
-        data = [p for p in perf if p['serial'] == serial]
-        data_wan1 = [u for u in data if u['uplink'] == 'wan1']
-        data_wan2 = [u for u in data if u['uplink'] == 'wan2']
-        for (wan_data, text) in [(data_wan1, 'WAN1'), (data_wan2, 'WAN2')]:
-            if wan_data:
-                total_loss = 0
-                loss_samples = 0
-                total_latency = 0
-                latency_samples = 0
-                for tuple in wan_data:
-                    for sample in tuple['timeSeries']:
-                        total_loss += sample['lossPercent']
-                        loss_samples += 1
-                        total_latency += sample['latencyMs']
-                        latency_samples += 1
-                average_loss = total_loss / loss_samples
-                average_latency = total_latency / latency_samples
-
-                # High packet loss
-                if average_loss > LOSS_THRESHOLD:
-                    # Format message®
-                    device_name = devices[device_serials.index(serial)]['name']
-                    model = devices[device_serials.index(serial)]['model']
-                    net_id = devices[device_serials.index(serial)]['networkId']
-                    network_name = networks[network_ids.index(net_id)]['name']
-
-                    # Send message to user
-                    message = f'🕳 **{device_name}** ({model}) in _{network_name}_ has packet loss of **{average_loss:.1f}%** on _{text}_'
-                    post_message(session, headers, payload, message)
-
-                # High latency
-                if average_latency > LATENCY_THRESHOLD:
-                    # Format message
-                    device_name = devices[device_serials.index(serial)]['name']
-                    model = devices[device_serials.index(serial)]['model']
-                    net_id = devices[device_serials.index(serial)]['networkId']
-                    network_name = networks[network_ids.index(net_id)]['name']
-
-                    # Send message to user
-                    message = f'🐢 **{device_name}** ({model}) in _{network_name}_ has latency of **{average_latency:.1f} ms** on _{text}_'
-                    post_message(session, headers, payload, message)
+    # Get org data, all at once
+    dashboard = AsyncDashboard(api_key, session)
+    (devices, statuses, networks, perf) = run(gather(dashboard.get_org_devices(org_id),
+                                                     dashboard.get_device_statuses(org_id),
+                                                     dashboard.get_org_networks(org_id),
+                                                     dashboard.get_uplinks_loss_latency(org_id)))
+    dashboard.close()
+
+    # Keep the results
+    if '--history' in sys.argv and perf:
+        history = UplinkHistory(HISTORY_DIR)
+        history.append(perf)
+        history.close()
+
+    # Index the data, then analyze it and send messages to user
+    index = DeviceIndex(devices, statuses, networks)
+    report_uplinks(session, headers, payload, perf_tag, index, perf)
+
+    # Print API call metrics, if enabled with METRICS=1
+    dump()
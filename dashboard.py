@@ -1,37 +1,115 @@
 #!/usr/bin/env python3
 
-import time
-
 import requests
-from requests_toolbelt.multipart.encoder import MultipartEncoder
+from requests.adapters import HTTPAdapter
+
+from cache import cached, invalidate
+from metrics import instrument
+from outbox import deliver
+from readiness import wait_for_snapshot
 
 base_url = 'https://api.meraki.com/api/v0'
 
+# Number of keep-alive connections kept open per host
+POOL_SIZE = 10
+
+
+# Client sharing one pooled session, with auth headers preset for every call
+class APIClient:
+    def __init__(self, headers=None, pool_size=None):
+        pool_size = pool_size or POOL_SIZE
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        instrument(self.session)
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+# Shared clients, one per set of credentials
+clients = {}
+
+
+# Return the shared Meraki dashboard client for an API key, creating it on first use
+def get_client(api_key, pool_size=None):
+    key = ('meraki', api_key)
+    if key not in clients:
+        headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+        clients[key] = APIClient(headers, pool_size)
+    return clients[key]
+
+
+# Return the shared Webex Teams client for a bot token, creating it on first use
+def get_webex_client(token, pool_size=None):
+    key = ('webex', token)
+    if key not in clients:
+        clients[key] = APIClient({'Authorization': f'Bearer {token}'}, pool_size)
+    return clients[key]
+
+
+# Return the shared client without credentials, for pre-signed URLs such as snapshots
+def get_public_client(pool_size=None):
+    key = ('public', None)
+    if key not in clients:
+        clients[key] = APIClient(None, pool_size)
+    return clients[key]
+
+
+# Close all shared clients and their pooled connections
+def close_clients():
+    for client in clients.values():
+        client.close()
+    clients.clear()
+
+
+# Send a dashboard API call through the caller's session if given, otherwise the shared client
+def dashboard_request(api_key, method, url, session=None, **kwargs):
+    if session is None:
+        return get_client(api_key).request(method, url, **kwargs)
+    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+    return session.request(method, url, headers=headers, **kwargs)
+
 
 # List the organizations that the user has privileges on
 # https://api.meraki.com/api_docs#list-the-organizations-that-the-user-has-privileges-on
+@cached('organizations', keep=lambda result: result[0])
 def get_user_orgs(api_key):
     get_url = f'{base_url}/organizations'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
-    response = requests.get(get_url, headers=headers)
+    response = dashboard_request(api_key, 'GET', get_url)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
 
 # List the networks in an organization
 # https://api.meraki.com/api_docs#list-the-networks-in-an-organization
+@cached('networks', keep=lambda result: result[0])
 def get_networks(api_key, org_id, configTemplateId=None, session=None):
     get_url = f'{base_url}/organizations/{org_id}/networks'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
     if configTemplateId:
         get_url += f'?configTemplateId={configTemplateId}'
 
-    if session:
-        response = session.get(get_url, headers=headers)
-    else:
-        response = requests.get(get_url, headers=headers)
+    response = dashboard_request(api_key, 'GET', get_url, session)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
@@ -40,11 +118,10 @@ def get_networks(api_key, org_id, configTemplateId=None, session=None):
 # https://api.meraki.com/api_docs#enable/disable-vlans-for-the-given-network
 def enable_vlans(api_key, net_id, enabled=True):
     put_url = f'{base_url}/networks/{net_id}/vlansEnabledState'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
     payload = {'enabled': enabled}
 
-    response = requests.put(put_url, headers=headers, json=payload)
+    response = dashboard_request(api_key, 'PUT', put_url, json=payload)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
@@ -53,7 +130,6 @@ def enable_vlans(api_key, net_id, enabled=True):
 # https://api.meraki.com/api_docs#create-a-network
 def create_network(api_key, org_id, name, net_type='wireless', tags='', copyFromNetworkId=None, timeZone='America/Los_Angeles', session=None):
     post_url = f'{base_url}/organizations/{org_id}/networks'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
     if tags and type(tags) == list:
         tags = ' '.join(tags)
@@ -63,10 +139,9 @@ def create_network(api_key, org_id, name, net_type='wireless', tags='', copyFrom
     payload = dict((k, vars[k]) for k in params if vars[k])
     payload['type'] = net_type
 
-    if session:
-        response = session.post(post_url, headers=headers, json=payload)
-    else:
-        response = requests.post(post_url, headers=headers, json=payload)
+    response = dashboard_request(api_key, 'POST', post_url, session, json=payload)
+    if response.ok:
+        invalidate('networks', org_id=org_id)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
@@ -75,9 +150,11 @@ def create_network(api_key, org_id, name, net_type='wireless', tags='', copyFrom
 # https://api.meraki.com/api_docs#delete-a-network
 def delete_network(api_key, net_id):
     delete_url = f'{base_url}/networks/{net_id}'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
-    response = requests.delete(delete_url, headers=headers)
+    response = dashboard_request(api_key, 'DELETE', delete_url)
+    if response.ok:
+        invalidate('networks', api_key=api_key)
+        invalidate('network', net_id=net_id)
     return response.ok
 
 
@@ -85,13 +162,12 @@ def delete_network(api_key, net_id):
 # https://api.meraki.com/api_docs#blink-the-leds-on-a-device
 def blink_device(api_key, net_id, serial, duration=20, period=160, duty=50):
     post_url = f'{base_url}/networks/{net_id}/devices/{serial}/blinkLeds'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
     vars = locals()
     params = ['duration', 'period', 'duty']
     payload = dict((k, vars[k]) for k in params)
 
-    response = requests.post(post_url, headers=headers, json=payload)
+    response = dashboard_request(api_key, 'POST', post_url, json=payload)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
@@ -100,43 +176,33 @@ def blink_device(api_key, net_id, serial, duration=20, period=160, duty=50):
 # https://api.meraki.com/api_docs#generate-a-snapshot-of-what-the-camera-sees-at-the-specified-time-and-return-a-link-to-that-image
 def take_snapshot(api_key, net_id, serial, timestamp=None):
     post_url = f'{base_url}/networks/{net_id}/cameras/{serial}/snapshot'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'} if timestamp else {'X-Cisco-Meraki-API-Key': api_key}
 
     payload = {'timestamp': timestamp} if timestamp else {}
 
-    response = requests.post(post_url, headers=headers, json=payload)
+    response = dashboard_request(api_key, 'POST', post_url, json=payload)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
 
-# Try snapshot URL to see if ready, and if so, download to local disk
-def try_snapshot(url, name):
-    attempts = 10
-    while attempts > 0:
-        # print(attempts)
-        r = requests.get(url, stream=True)
-        if r.ok:
-            temp_file = f'{name}.jpg'
-            with open(temp_file, 'wb') as f:
-                for chunk in r:
-                    f.write(chunk)
-            return temp_file
-        else:
-            time.sleep(1)
-            attempts -= 1
+# Wait for snapshot URL to be ready, and then download to local disk
+def try_snapshot(url, name, model=None):
+    r = wait_for_snapshot(get_public_client(), url, model, timeout=10)
+    if r:
+        temp_file = f'{name}.jpg'
+        with open(temp_file, 'wb') as f:
+            for chunk in r:
+                f.write(chunk)
+        return temp_file
     return None
 
 
 # Return the inventory for an organization
 # https://api.meraki.com/api_docs#return-the-inventory-for-an-organization
+@cached('inventory', keep=lambda result: result[0])
 def get_inventory(api_key, org_id, session=None):
     get_url = f'{base_url}/organizations/{org_id}/inventory'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
-    if session:
-        response = session.get(get_url, headers=headers)
-    else:
-        response = requests.get(get_url, headers=headers)
+    response = dashboard_request(api_key, 'GET', get_url, session)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
@@ -146,24 +212,23 @@ def get_inventory(api_key, org_id, session=None):
 def update_mx_port(api_key, net_id, port, enabled=None, dropUntaggedTraffic=None,
                    type=None, vlan=None, allowedVlans=None, accessPolicy=None):
     put_url = f'{base_url}/networks/{net_id}/appliancePorts/{port}'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
     vars = locals()
     params = ['enabled', 'dropUntaggedTraffic', 'type', 'vlan', 'allowedVlans', 'accessPolicy']
     payload = dict((k, vars[k]) for k in params if vars[k])
 
-    response = requests.put(put_url, headers=headers, json=payload)
+    response = dashboard_request(api_key, 'PUT', put_url, json=payload)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
 
 # List the status of every Meraki device in the organization
 # https://api.meraki.com/api_docs#list-the-status-of-every-meraki-device-in-the-organization
+@cached('deviceStatuses', keep=lambda result: result[0])
 def get_device_statuses(api_key, org_id):
     get_url = f'{base_url}/organizations/{org_id}/deviceStatuses'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
-    response = requests.get(get_url, headers=headers)
+    response = dashboard_request(api_key, 'GET', get_url)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
@@ -172,7 +237,6 @@ def get_device_statuses(api_key, org_id):
 # https://api.meraki.com/api_docs#update-the-attributes-of-an-ssid
 def open_ssid(api_key, net_id, number, name):
     put_url = f'{base_url}/networks/{net_id}/ssids/{number}'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
     payload = {
         'name': name,
@@ -180,28 +244,23 @@ def open_ssid(api_key, net_id, number, name):
         'authMode': 'open',
     }
 
-    response = requests.put(put_url, headers=headers, json=payload)
+    response = dashboard_request(api_key, 'PUT', put_url, json=payload)
     data = response.json() if response.ok else response.text
     return (response.ok, data)
 
 
 # Send a message in Webex Teams
 def post_message(url, message, token, email):
-    headers = {'content-type': 'application/json; charset=utf-8', 'authorization': f'Bearer {token}'}
     payload = {'toPersonEmail': email, 'file': url, 'markdown': message}
-    requests.post('https://api.ciscospark.com/v1/messages/', headers=headers, json=payload)
+    return deliver(get_webex_client(token), {}, payload).ok
 
 
 # Send a message with file attached from local storage
 def send_file(message, file_path, file_type, token, email):
     # file_type such as 'image/png'
-    m = MultipartEncoder({'toPersonEmail': email,
-                          'markdown': message,
-                          'files': (file_path, open(file_path, 'rb'),
-                                    file_type)})
-    r = requests.post('https://api.ciscospark.com/v1/messages', data=m,
-                  headers={'Authorization': f'Bearer {token}', 'Content-Type': m.content_type})
+    with open(file_path, 'rb') as fp:
+        contents = fp.read()
+    r = deliver(get_webex_client(token), {}, {'toPersonEmail': email, 'markdown': message},
+                files=(file_path, contents, file_type))
     if r.ok:
         print(message)
-    else:
-        print(r.text)
@@ -86,6 +86,9 @@ def create_networks(api_key, org_id, sites, locations, custom_tags, time_zones):
     if not demo_isp:
         delete_network(api_key, demo_net)
 
+    # Networks were created outside of the dashboard module, so refetch next time
+    invalidate('networks', org_id=org_id)
+
 
 # Helper function to claim devices
 def add_devices(actions, net_id, serial):
@@ -125,6 +128,10 @@ def create_devices(api_key, org_id, actions):
             batch_id = data['id']
             done = check_until_completed(api_key, org_id, batch_id)
 
+    # Devices were claimed outside of the dashboard module, so refetch next time
+    invalidate('inventory', org_id=org_id)
+    invalidate('deviceStatuses', org_id=org_id)
+
     # Check status and return completion success
 
 
@@ -632,6 +639,7 @@ def main():
             attempts = 6
             while attempts > 0:
                 time.sleep(6)
+                invalidate('deviceStatuses', org_id=org_id)
                 (ok, data) = get_device_statuses(api_key, org_id)
                 if not ok:
                     sys.exit(data)
@@ -673,4 +681,7 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    finally:
+        close_clients()
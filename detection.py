@@ -0,0 +1,121 @@
+from itertools import count as counter
+
+# Values of boolean rule settings that mean yes
+TRUE = ('1', 'yes', 'true', 'on')
+
+
+# When to alert on one class of object: once at least min_hits messages in a row have had min_count or more of
+# them, and either more than cooldown_ms have passed since the last alert or, if rising, the count went up since.
+# A message more than max_gap_ms after the previous one, if set, starts the run of hits over.
+class Rule:
+    __slots__ = ('min_hits', 'min_count', 'cooldown_ms', 'rising', 'max_gap_ms')
+
+    def __init__(self, min_hits=6, min_count=1, cooldown_ms=30000, rising=True, max_gap_ms=None):
+        self.min_hits = min_hits
+        self.min_count = min_count
+        self.cooldown_ms = cooldown_ms
+        self.rising = rising
+        self.max_gap_ms = max_gap_ms
+
+    def __repr__(self):
+        return (f'Rule(min_hits={self.min_hits}, min_count={self.min_count}, cooldown_ms={self.cooldown_ms}, '
+                f'rising={self.rising}, max_gap_ms={self.max_gap_ms})')
+
+
+# Rules matching the original MV Sense alerts: more than 5 messages in a row with objects, and either 30 seconds
+# since the last alert or more objects than then
+DEFAULT_RULES = {'person': Rule(), 'vehicle': Rule()}
+
+
+# Rule from a setting such as 'min_hits=6 cooldown_ms=30000 rising=yes', or None for 'off'
+def parse_rule(text):
+    if text.strip().lower() in ('', 'off', 'none'):
+        return None
+    settings = {}
+    for item in text.split():
+        (name, value) = item.split('=', 1)
+        if name == 'rising':
+            settings[name] = value.lower() in TRUE
+        else:
+            settings[name] = None if value.lower() in ('', 'none') else int(value)
+    return Rule(**settings)
+
+
+# Detection state of one class of object on one camera
+class State:
+    __slots__ = ('rule', 'hits', 'last_time', 'last_count', 'last_ts')
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.hits = 0
+        self.last_time = 0
+        self.last_count = 0
+        self.last_ts = None
+
+    # Count of a message at time ts (ms), returning whether to alert
+    def update(self, ts, count):
+        rule = self.rule
+        gap = rule.max_gap_ms is not None and self.last_ts is not None and ts - self.last_ts > rule.max_gap_ms
+        self.last_ts = ts
+        if count < rule.min_count:
+            self.hits = 0
+            return False
+        self.hits = 1 if gap else self.hits + 1
+        if self.hits >= rule.min_hits and (ts > self.last_time + rule.cooldown_ms or
+                                           (rule.rising and count > self.last_count)):
+            # Recalibrate
+            self.last_time = ts
+            self.last_count = count
+            self.hits = 0
+            return True
+        return False
+
+
+# Detection state of every camera and class, applying each class's rule to its counts. Classes without a rule
+# (and no default rule) are ignored, so new classes and rule changes are a matter of configuration.
+class DetectionEngine:
+    def __init__(self, rules=None, default=None):
+        self.rules = dict(DEFAULT_RULES if rules is None else rules)
+        self.default = default
+        self.cameras = {}
+
+    # State of a camera's class, or None if the class has no rule
+    def state(self, camera, cls):
+        states = self.cameras.get(camera)
+        if states is None:
+            states = self.cameras[camera] = {}
+        if cls not in states:
+            rule = self.rules.get(cls, self.default)
+            states[cls] = State(rule) if rule else None
+        return states[cls]
+
+    # One (camera, class, ts, count) event, returning whether to alert
+    def update(self, camera, cls, ts, count):
+        state = self.state(camera, cls)
+        return state.update(ts, count) if state else False
+
+    # All the counts of one message from a camera, as {class: count}, returning the classes to alert on. Classes
+    # with rules, or seen before, but absent from the message count as zero.
+    def observe(self, camera, ts, counts):
+        states = self.cameras.get(camera)
+        if states is None:
+            for cls in self.rules:
+                self.state(camera, cls)
+            states = self.cameras[camera]
+        if not states.keys() >= counts.keys():
+            for cls in counts:
+                self.state(camera, cls)
+        return [cls for (cls, state) in states.items() if state and state.update(ts, counts.get(cls, 0))]
+
+    # Events given as columns of equal length, such as from a recording, returning the indexes of those to alert on
+    def replay(self, cameras, classes, ts, counts):
+        alerts = []
+        states = {}
+        for (i, camera, cls, t, n) in zip(counter(), cameras, classes, ts, counts):
+            key = (camera, cls)
+            state = states.get(key, False)
+            if state is False:
+                state = states[key] = self.state(camera, cls)
+            if state and state.update(t, n):
+                alerts.append(i)
+        return alerts
@@ -0,0 +1,100 @@
+from async_api import gather
+
+# Product families by model prefix, with Z-series teleworker gateways grouped with the MX appliances
+FAMILIES = {'MX': 'MX', 'Z1': 'MX', 'Z3': 'MX', 'MS': 'MS', 'MR': 'MR', 'MV': 'MV'}
+
+
+# Product family of a model, such as MX for Z3 or MR for MR42
+def family_of(model):
+    prefix = (model or '')[:2]
+    return FAMILIES.get(prefix, prefix)
+
+
+# Split a device's tags, which the API returns as one space-separated string
+def tags_of(device):
+    tags = device.get('tags') or ''
+    return tags.split() if isinstance(tags, str) else list(tags)
+
+
+# An org's devices indexed once by serial, with precomputed groupings by network, tag, product family and status,
+# each group a dict of serials so that membership is a lookup
+class DeviceIndex:
+    def __init__(self, devices, statuses=None, networks=None):
+        self.devices = {}
+        self.order = {}
+        self.networks = {n['id']: n for n in networks or []}
+        self.statuses = {}
+        self.tags = {}
+        self.by_network = {}
+        self.by_tag = {}
+        self.by_family = {}
+        self.by_status = {}
+
+        for device in devices or []:
+            serial = device['serial']
+            self.order[serial] = len(self.devices)
+            self.devices[serial] = device
+            self.tags[serial] = set(tags_of(device))
+            self.by_network.setdefault(device.get('networkId'), {})[serial] = None
+            self.by_family.setdefault(family_of(device.get('model')), {})[serial] = None
+            for tag in self.tags[serial]:
+                self.by_tag.setdefault(tag, {})[serial] = None
+
+        for status in statuses or []:
+            serial = status['serial']
+            self.statuses[serial] = status
+            if serial in self.devices:
+                self.by_status.setdefault(status['status'], {})[serial] = None
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __contains__(self, serial):
+        return serial in self.devices
+
+    def __getitem__(self, serial):
+        return self.devices[serial]
+
+    def get(self, serial, default=None):
+        return self.devices.get(serial, default)
+
+    # Status of a device, or None if not reported
+    def status(self, serial):
+        status = self.statuses.get(serial)
+        return status['status'] if status else None
+
+    # Network of a device, or None if unassigned or unknown
+    def network(self, serial):
+        return self.networks.get(self.devices[serial].get('networkId'))
+
+    # Devices matching all the given criteria, in the order listed by the API; network=None matches unassigned devices
+    def select(self, family=None, tag=None, status=None, **kwargs):
+        groups = []
+        if family:
+            groups.append(self.by_family.get(family, {}))
+        if tag:
+            groups.append(self.by_tag.get(tag, {}))
+        if status:
+            groups.append(self.by_status.get(status, {}))
+        if 'network' in kwargs:
+            groups.append(self.by_network.get(kwargs['network'], {}))
+        if not groups:
+            return list(self.devices.values())
+
+        # Scan the smallest group, checking the others with lookups, then put the matches back in API order
+        groups.sort(key=len)
+        matches = [serial for serial in groups[0] if all(serial in other for other in groups[1:])]
+        matches.sort(key=self.order.__getitem__)
+        return [self.devices[serial] for serial in matches]
+
+    # Serials of devices not reported with the given status, such as every device not online
+    def not_in_status(self, serials, status='online'):
+        return [serial for serial in serials if self.status(serial) != status]
+
+
+# Fetch an org's devices, statuses and networks at once, and index them
+async def get_org_index(dashboard, org_id):
+    (devices, statuses, networks) = await gather(dashboard.get_org_devices(org_id),
+                                                 dashboard.get_device_statuses(org_id),
+                                                 dashboard.get_org_networks(org_id))
+    return DeviceIndex(devices, statuses, networks)
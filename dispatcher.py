@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from dashboard import APIClient
+
+# Alerts sent at once, and alerts running or waiting beyond which new ones are dropped
+WORKERS = 4
+MAX_PENDING = 32
+
+
+# Runs alert jobs in-process on a bounded pool of threads sharing one pooled session, so that connections to the
+# dashboard and Webex stay warm between alerts. Each job is called as job(session, *args), at most one per key
+# (such as a camera serial) at a time: an alert for a key that already has one waiting takes its place with the
+# newer arguments, and one for a key whose job is running is sent once that finishes, with the newest arguments.
+class AlertDispatcher:
+    def __init__(self, job, workers=WORKERS, max_pending=MAX_PENDING, session=None):
+        self.job = job
+        self.session = session or APIClient(pool_size=workers).session
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='alert')
+        self.max_pending = max_pending
+        self.in_flight = {}
+        self.waiting = {}
+        self.lock = threading.Lock()
+        self.counts = {'submitted': 0, 'coalesced': 0, 'dropped': 0, 'completed': 0, 'failed': 0}
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    # Queue an alert, returning its future, or None if coalesced into one in flight or dropped
+    def submit(self, key, *args, **kwargs):
+        with self.lock:
+            if key in self.in_flight:
+                self.counts['coalesced'] += 1
+                self.waiting[key] = (time.monotonic(), args, kwargs)
+                return None
+            if len(self.in_flight) >= self.max_pending:
+                self.counts['dropped'] += 1
+                return None
+            self.counts['submitted'] += 1
+            self.waiting[key] = (time.monotonic(), args, kwargs)
+            future = self.in_flight[key] = self.executor.submit(self.run, key)
+        return future
+
+    # Send the newest alert waiting for a key, then any that arrived while it was being sent
+    def run(self, key):
+        with self.lock:
+            (submitted, args, kwargs) = self.waiting.pop(key)
+        failed = False
+        try:
+            return self.job(self.session, *args, **kwargs)
+        except Exception as e:
+            failed = True
+            print(f'Alert for {key} failed: {e}')
+        finally:
+            elapsed = time.monotonic() - submitted
+            with self.lock:
+                self.counts['failed' if failed else 'completed'] += 1
+                self.seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+                del self.in_flight[key]
+                if key in self.waiting:
+                    try:
+                        self.in_flight[key] = self.executor.submit(self.run, key)
+                    except RuntimeError:
+                        # Closing, so no new jobs are accepted
+                        del self.waiting[key]
+
+    # Counts of alerts, and seconds from submitting them until they were sent (mean and max)
+    def stats(self):
+        with self.lock:
+            done = self.counts['completed'] + self.counts['failed']
+            return dict(self.counts, in_flight=len(self.in_flight), mean_seconds=self.seconds / done if done else None,
+                        max_seconds=self.max_seconds)
+
+    # Wait for the alerts in flight, then stop the workers
+    def close(self, wait=True):
+        self.executor.shutdown(wait)
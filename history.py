@@ -0,0 +1,189 @@
+from array import array
+import calendar
+from datetime import datetime
+import math
+import mmap
+import os
+import struct
+import time
+
+from uplinks import UplinkStats, mean_of, percentile_of
+
+# Samples kept per (serial, uplink, ip) probe, oldest overwritten first; three days of the API's one per minute
+CAPACITY = 3 * 24 * 60
+
+# Slots added to the data file at a time as new probes are seen
+GROW_SLOTS = 64
+
+# File header: magic, format version, capacity, epoch that timestamps are stored relative to
+HEADER = struct.Struct('<4sIII')
+MAGIC = b'UPLK'
+VERSION = 1
+
+# Slot header: next index to write, samples stored, timestamp of the newest sample
+SLOT_HEADER = struct.Struct('<III')
+
+# Timestamps are stored as uint32 seconds since 2019-01-01, which lasts until the 2150s
+EPOCH = 1546300800
+
+# Smoothing factor for exponentially weighted moving averages
+ALPHA = .1
+
+
+# Seconds since the Unix epoch of an API timestamp such as 2019-06-19T18:05:00Z
+def parse_time(ts):
+    try:
+        return calendar.timegm(datetime.strptime(ts, '%Y-%m-%dT%H:%M:%SZ').timetuple())
+    except ValueError:
+        return calendar.timegm(datetime.strptime(ts, '%Y-%m-%dT%H:%M:%S.%fZ').timetuple())
+
+
+# Exponentially weighted moving average of values in time order, or None if there are none
+def ewma_of(values, alpha=ALPHA):
+    average = None
+    for v in values:
+        average = v if average is None else alpha * v + (1 - alpha) * average
+    return average
+
+
+# Rolling history of uplink loss and latency, in a memory-mapped file of fixed-size ring buffers, one per probe.
+# Each ring stores columns of uint32 seconds since the file's epoch and float32 loss (%) and latency (ms),
+# so the file only grows with new probes, and never with time.
+class UplinkHistory:
+    def __init__(self, directory, capacity=CAPACITY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, 'uplinks.dat')
+        self.keys_path = os.path.join(directory, 'uplinks.keys')
+
+        # Probe keys in slot order, one per line
+        self.slots = {}
+        self.by_serial = {}
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path) as fp:
+                for line in fp:
+                    if line.strip():
+                        self.add_key(tuple(line.rstrip('\n').split('\t')))
+
+        # Header fixes the capacity and epoch for the life of the file
+        if not os.path.exists(self.data_path):
+            with open(self.data_path, 'wb') as fp:
+                fp.write(HEADER.pack(MAGIC, VERSION, capacity, EPOCH))
+        self.fp = open(self.data_path, 'r+b')
+        (magic, version, self.capacity, self.epoch) = HEADER.unpack(self.fp.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{self.data_path} is not an uplink history file')
+        self.slot_size = SLOT_HEADER.size + 12 * self.capacity
+        self.map = None
+        self.remap(len(self.slots))
+
+    # Map the file, extending it to hold at least the given number of slots
+    def remap(self, slots):
+        if os.path.getsize(self.data_path) < HEADER.size + self.slot_size * max(slots, 1):
+            self.fp.truncate(HEADER.size + self.slot_size * math.ceil(slots / GROW_SLOTS) * GROW_SLOTS)
+        if self.map:
+            self.map.close()
+        self.map = mmap.mmap(self.fp.fileno(), 0)
+
+    def add_key(self, key):
+        self.slots[key] = len(self.slots)
+        self.by_serial.setdefault(key[0], []).append(key)
+
+    # Slot number of a probe, adding one if new
+    def slot(self, key):
+        if key not in self.slots:
+            with open(self.keys_path, 'a') as fp:
+                fp.write('\t'.join(key) + '\n')
+            self.add_key(key)
+            if HEADER.size + self.slot_size * len(self.slots) > len(self.map):
+                self.remap(len(self.slots))
+        return self.slots[key]
+
+    # Columns of a slot, as views directly onto the mapped file
+    def columns(self, slot):
+        start = HEADER.size + self.slot_size * slot + SLOT_HEADER.size
+        view = memoryview(self.map)
+        times = view[start:start + 4 * self.capacity].cast('I')
+        loss = view[start + 4 * self.capacity:start + 8 * self.capacity].cast('f')
+        latency = view[start + 8 * self.capacity:start + 12 * self.capacity].cast('f')
+        return times, loss, latency
+
+    def header(self, slot):
+        return SLOT_HEADER.unpack_from(self.map, HEADER.size + self.slot_size * slot)
+
+    # Append the response of uplinksLossAndLatency, skipping samples already stored from overlapping polls
+    def append(self, perf):
+        added = 0
+        for probe in perf:
+            slot = self.slot((probe['serial'], probe['uplink'], probe['ip']))
+            (head, count, newest) = self.header(slot)
+            (times, loss, latency) = self.columns(slot)
+            for sample in probe['timeSeries']:
+                t = parse_time(sample['ts']) - self.epoch
+                if t < 0 or (count and t <= newest):
+                    continue
+                times[head] = t
+                loss[head] = math.nan if sample['lossPercent'] is None else sample['lossPercent']
+                latency[head] = math.nan if sample['latencyMs'] is None else sample['latencyMs']
+                head = (head + 1) % self.capacity
+                count = min(count + 1, self.capacity)
+                newest = t
+                added += 1
+            times.release()
+            loss.release()
+            latency.release()
+            SLOT_HEADER.pack_into(self.map, HEADER.size + self.slot_size * slot, head, count, newest)
+        return added
+
+    # Probe keys, optionally only those of a serial and/or uplink
+    def keys(self, serial=None, uplink=None):
+        keys = self.slots if serial is None else self.by_serial.get(serial, [])
+        return [key for key in keys if uplink is None or key[1] == uplink]
+
+    # Samples of a probe's column ('loss' or 'latency') in time order, from the last window seconds if given,
+    # reading back from the newest so that cost depends on the window rather than on how much is stored
+    def samples(self, key, column, window=None):
+        slot = self.slots.get(key)
+        if slot is None:
+            return array('f')
+        (head, count, newest) = self.header(slot)
+        (times, loss, latency) = self.columns(slot)
+        values = loss if column == 'loss' else latency
+        since = int(time.time()) - self.epoch - window if window else None
+        picked = array('f')
+        for i in range(1, count + 1):
+            index = (head - i) % self.capacity
+            if since is not None and times[index] < since:
+                break
+            picked.append(values[index])
+        times.release()
+        loss.release()
+        latency.release()
+        picked.reverse()
+        return picked
+
+    # Non-missing samples of a column across all of a serial's probes on an uplink
+    def uplink_samples(self, serial, uplink, column, window=None):
+        values = array('f')
+        for key in self.keys(serial, uplink):
+            values.extend(self.samples(key, column, window))
+        return [v for v in values if v == v]
+
+    # Rolling mean and percentile of loss and latency for an uplink, across its probes
+    def stats(self, serial, uplink, window=None, q=95):
+        loss = sorted(self.uplink_samples(serial, uplink, 'loss', window))
+        latency = sorted(self.uplink_samples(serial, uplink, 'latency', window))
+        return UplinkStats(mean_of(loss), percentile_of(loss, q),
+                           mean_of(latency), percentile_of(latency, q), len(loss))
+
+    # Exponentially weighted moving average of a probe's column, over time
+    def ewma(self, key, column, window=None, alpha=ALPHA):
+        return ewma_of([v for v in self.samples(key, column, window) if v == v], alpha)
+
+    # Write changes through to disk
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.fp.close()
@@ -0,0 +1,56 @@
+import codecs
+import json
+import re
+
+decoder = json.JSONDecoder()
+separators = re.compile(r'[\s,]*')
+
+
+# Yield each element of a JSON array as soon as it has fully arrived, from an iterable of byte chunks,
+# so that only the current chunk and element are held in memory rather than the whole decoded array
+def iter_array(chunks):
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    started = False
+    finished = False
+
+    for chunk in chunks:
+        buffer = buffer[pos:] + text.decode(chunk)
+        pos = 0
+        while True:
+            pos = separators.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('Response is not a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                finished = True
+                break
+            try:
+                (element, end) = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break
+            # A number may continue in the next chunk unless a separator already follows it
+            if not isinstance(element, (dict, list)):
+                follow = separators.match(buffer, end).end()
+                if follow == len(buffer) or buffer[end:follow + 1].strip()[:1] not in (',', ']'):
+                    break
+            yield element
+            pos = end
+        if finished:
+            return
+
+    # Whatever is left must be a final scalar element followed by the closing bracket
+    buffer = buffer[pos:] + text.decode(b'', final=True)
+    pos = separators.match(buffer).end()
+    if started and buffer[pos:pos + 1] != ']':
+        (element, end) = decoder.raw_decode(buffer, pos)
+        yield element
+        pos = separators.match(buffer, end).end()
+    if not started or buffer[pos:pos + 1] != ']':
+        raise ValueError('JSON array was truncated')
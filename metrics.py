@@ -0,0 +1,221 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sys
+import threading
+from urllib.parse import urlsplit
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+# APIs by host, anything else under meraki.com being a camera snapshot URL
+APIS = {'api.meraki.com': 'meraki', 'api.ciscospark.com': 'webex', 'webexapis.com': 'webex'}
+
+# Path segments followed by an ID, which is replaced to group calls by endpoint template
+ID_AFTER = {'organizations', 'networks', 'devices', 'cameras', 'clients', 'snapshot', 'messages', 'people', 'rooms',
+            'actions', 'ports', 'ssids', 'vlans', 'staticRoutes', 'groupPolicies', 'floorPlans'}
+
+# Distinct URLs whose templates are remembered, so that parsing is only paid once per URL
+MAX_TEMPLATES = 4096
+
+
+# Which API a URL belongs to, and its endpoint template, such as ('meraki', '/organizations/{id}/devices')
+def endpoint_of(url):
+    parts = urlsplit(url)
+    host = parts.hostname or ''
+    api = APIS.get(host) or ('snapshot' if host.endswith('.meraki.com') else host)
+    segments = parts.path.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ID_AFTER and segments[i]:
+            segments[i] = '{id}'
+    path = '/'.join(segments)
+    for prefix in ('/api/v0', '/v1'):
+        if path.startswith(prefix + '/'):
+            path = path[len(prefix):]
+    return api, path
+
+
+# Bytes of a request or response body that is already known without reading it
+def size_of(body, headers=None):
+    if headers and 'Content-Length' in headers:
+        try:
+            return int(headers['Content-Length'])
+        except ValueError:
+            return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return getattr(body, 'len', 0) if body is not None else 0
+
+
+# Cumulative latency histogram for one series
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+# In-process histograms of API call latency by (api, method, endpoint, status), with bytes and retries per endpoint.
+# Sessions are only hooked while enabled, so nothing is recorded or paid for otherwise.
+class Metrics:
+    def __init__(self, enabled=False, buckets=BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.templates = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.latency = {}
+            self.sent = {}
+            self.received = {}
+            self.retries = {}
+
+    def endpoint(self, url):
+        template = self.templates.get(url)
+        if template is None:
+            template = endpoint_of(url)
+            if len(self.templates) < MAX_TEMPLATES:
+                self.templates[url] = template
+        return template
+
+    # Record one completed call
+    def observe(self, method, url, status, seconds, sent=0, received=0):
+        (api, endpoint) = self.endpoint(url)
+        key = (api, method, endpoint)
+        with self.lock:
+            histogram = self.latency.get(key + (status,))
+            if histogram is None:
+                histogram = self.latency[key + (status,)] = Histogram(self.buckets)
+            histogram.counts[bisect_left(self.buckets, seconds)] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+            self.sent[key] = self.sent.get(key, 0) + sent
+            self.received[key] = self.received.get(key, 0) + received
+
+    # Record that a call is being retried, such as after a 429 or while a snapshot is not ready yet
+    def retry(self, method, url):
+        if not self.enabled:
+            return
+        (api, endpoint) = self.endpoint(url)
+        key = (api, method, endpoint)
+        with self.lock:
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    # Response hook for requests sessions
+    def record(self, response, *args, **kwargs):
+        request = response.request
+        self.observe(request.method, request.url, response.status_code, response.elapsed.total_seconds(),
+                     size_of(request.body, request.headers),
+                     size_of(None, response.headers))
+        return response
+
+    # Hook a session so that its calls are recorded, if enabled; hooking the same session again has no effect
+    def instrument(self, session):
+        if self.enabled and self.record not in session.hooks['response']:
+            session.hooks['response'].append(self.record)
+        return session
+
+    # Everything recorded, as plain data
+    def summary(self):
+        with self.lock:
+            calls = []
+            for ((api, method, endpoint, status), histogram) in sorted(self.latency.items()):
+                calls.append({'api': api, 'method': method, 'endpoint': endpoint, 'status': status,
+                              'count': histogram.count, 'seconds': round(histogram.sum, 6),
+                              'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], histogram.counts))})
+            totals = [{'api': api, 'method': method, 'endpoint': endpoint, 'bytes_sent': self.sent.get(key, 0),
+                       'bytes_received': self.received.get(key, 0), 'retries': self.retries.get(key, 0)}
+                      for key in sorted(set(self.sent) | set(self.retries)) for (api, method, endpoint) in [key]]
+        return {'calls': calls, 'endpoints': totals}
+
+    # Prometheus text exposition format
+    def export(self):
+        lines = ['# HELP api_request_duration_seconds Time until the response headers of API calls',
+                 '# TYPE api_request_duration_seconds histogram']
+        with self.lock:
+            for ((api, method, endpoint, status), histogram) in sorted(self.latency.items()):
+                labels = f'api="{api}",method="{method}",endpoint="{endpoint}",status="{status}"'
+                cumulative = 0
+                for (bound, count) in zip(list(self.buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'api_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'api_request_duration_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'api_request_duration_seconds_count{{{labels}}} {histogram.count}')
+            for (name, text, values) in [('api_request_bytes_total', 'Bytes sent in API request bodies', self.sent),
+                                         ('api_response_bytes_total', 'Bytes received in API response bodies', self.received),
+                                         ('api_retries_total', 'API calls retried after rate limiting or not being ready', self.retries)]:
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} counter')
+                for ((api, method, endpoint), value) in sorted(values.items()):
+                    lines.append(f'{name}{{api="{api}",method="{method}",endpoint="{endpoint}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    # Print the summary as one JSON line, such as at the end of a Lambda invocation, and start over
+    def dump(self, file=None):
+        if not self.enabled:
+            return
+        print(json.dumps({'metrics': self.summary()}, separators=(',', ':')), file=file or sys.stdout)
+        self.reset()
+
+
+# Metrics shared by the whole process, enabled by setting the METRICS environment variable
+metrics = Metrics(os.environ.get('METRICS', '') not in ('', '0', 'false', 'no'))
+
+
+def enable():
+    metrics.enabled = True
+
+
+def instrument(session):
+    return metrics.instrument(session)
+
+
+def retry(method, url):
+    metrics.retry(method, url)
+
+
+def export():
+    return metrics.export()
+
+
+def dump(file=None):
+    metrics.dump(file)
+
+
+# Wrap a Lambda or Cloud Functions handler to dump the metrics it recorded once each invocation finishes
+def report(handler):
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            metrics.dump()
+    return wrapper
+
+
+# Serve the Prometheus text format at /metrics from a background thread, for long-running processes
+def serve(port, host='0.0.0.0'):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = export().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,199 @@
+import configparser
+from json import loads
+import queue
+import sys
+import threading
+
+import paho.mqtt.client as mqtt
+import requests
+
+from async_api import *
+from detection import *
+from device_index import get_org_index
+from dispatcher import AlertDispatcher
+from occupancy import OCCUPANCY_DIR, OccupancySeries
+from send import send_alert
+
+# Messages held between the MQTT network thread and the engine, beyond which new ones are dropped
+QUEUE_SIZE = 10000
+
+
+# Store credentials in a separate file
+def gather_credentials():
+    cp = configparser.ConfigParser()
+    try:
+        cp.read('credentials.ini')
+        cam_key = cp.get('meraki', 'key2')
+        org_id = cp.get('meraki', 'organization')
+        chatbot_token = cp.get('chatbot', 'token')
+        user_email = cp.get('chatbot', 'email')
+        mv_serials = cp.get('sense', 'serial')
+        mv_serials = [s.strip() for s in mv_serials.split(',') if s.strip()]
+        home_macs = cp.get('sense', 'home')
+        home_macs = [mac.strip().lower() for mac in home_macs.split(',') if mac.strip()]
+        nearby = cp.get('sense', 'nearby', fallback='')
+        nearby = [float(n) for n in nearby.split(',')] if nearby else None
+
+        # Rules for when to alert on each class of object, with any default for the other classes
+        rules = dict(DEFAULT_RULES)
+        if cp.has_section('detection'):
+            rules.update((cls, parse_rule(text)) for (cls, text) in cp.items('detection'))
+        default = rules.pop('default', None)
+    except:
+        print('Missing credentials or input file!')
+        sys.exit(2)
+    return cam_key, org_id, chatbot_token, user_email, mv_serials, home_macs, nearby, rules, default
+
+
+# An MV camera subscribed to
+class Camera:
+    __slots__ = ('serial', 'name', 'net_id', 'model', 'messages')
+
+    def __init__(self, serial, name, net_id, model=None):
+        self.serial = serial
+        self.name = name or serial
+        self.net_id = net_id
+        self.model = model
+        self.messages = 0
+
+    @property
+    def topic(self):
+        return f'/merakimv/{self.serial}/raw_detections'
+
+
+# Online MV cameras of the org, only those given if any, by serial
+def discover_cameras(session, api_key, org_id, serials=None):
+    dashboard = AsyncDashboard(api_key, session)
+    try:
+        index = run(get_org_index(dashboard, org_id))
+    finally:
+        dashboard.close()
+    cameras = {}
+    for device in index.select(family='MV', status='online'):
+        if not serials or device['serial'] in serials:
+            cameras[device['serial']] = Camera(device['serial'], device.get('name'), device['networkId'],
+                                               device.get('model'))
+    return cameras
+
+
+# Raw detections from many cameras: the paho network thread only queues each message, and one engine thread
+# decodes them and keeps each camera's detection state, calling on_alert(camera, counts) with the count of each
+# class of object when a rule trips, and keeping the counts in any occupancy series given
+class SenseEngine:
+    def __init__(self, cameras, on_alert, rules=None, default=None, queue_size=QUEUE_SIZE, series=None):
+        self.topics = {camera.topic: camera for camera in cameras}
+        self.on_alert = on_alert
+        self.detector = DetectionEngine(rules, default)
+        self.series = series
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.counts = {'handled': 0, 'dropped': 0, 'invalid': 0, 'unknown': 0, 'alerts': 0}
+        self.thread = None
+
+    # Subscribing in on_connect() means that if we lose the connection and reconnect then subscriptions will be renewed
+    def on_connect(self, client, user_data, flags, rc):
+        if self.topics:
+            client.subscribe([(topic, 0) for topic in self.topics])
+
+    def on_message(self, client, user_data, msg):
+        try:
+            self.queue.put_nowait((msg.topic, msg.payload))
+        except queue.Full:
+            with self.lock:
+                self.counts['dropped'] += 1
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='sense-engine', daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self.handle(*item)
+
+    # Stop once the messages queued so far are handled
+    def stop(self, timeout=10):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+    # Decode a raw detections message and update its camera, returning whether it alerted
+    def handle(self, topic, payload):
+        camera = self.topics.get(topic)
+        if camera is None:
+            self.count('unknown')
+            return False
+        try:
+            # Requires camera 4.2+ firmware
+            datum = loads(payload)
+            ts = datum['ts']
+            counts = {}
+            for o in datum['objects']:
+                kind = o['type']
+                counts[kind] = counts.get(kind, 0) + 1
+        except (ValueError, KeyError, TypeError):
+            self.count('invalid')
+            return False
+        camera.messages += 1
+        if self.series:
+            self.series.record(camera.serial, ts, counts, camera.name)
+
+        # Every class is updated, but one alert covers them all
+        alert = bool(self.detector.observe(camera.serial, ts, counts))
+        self.count('handled')
+        if alert:
+            self.count('alerts')
+            self.on_alert(camera, counts)
+        return alert
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, queued=self.queue.qsize(), cameras=len(self.topics))
+
+
+# Main function
+if __name__ == '__main__':
+    # Get credentials
+    (api_key, org_id, chatbot_token, user_email, mv_serials, home_macs, nearby, rules, default) = gather_credentials()
+
+    # Find the cameras to subscribe to, all online MV cameras of the org unless some are given
+    session = requests.Session()
+    cameras = discover_cameras(session, api_key, org_id, mv_serials)
+    if not cameras:
+        sys.exit('No MV cameras online!')
+    missing = [serial for serial in mv_serials if serial not in cameras]
+    if missing:
+        print(f'MV cameras not online: {", ".join(missing)}')
+
+    # Send alerts in the background, one at a time per camera, over warm connections
+    headers = {
+        'content-type': 'application/json; charset=utf-8',
+        'authorization': f'Bearer {chatbot_token}'
+    }
+    payload = {
+        'toPersonEmail': user_email,
+    }
+    dispatcher = AlertDispatcher(send_alert)
+
+    def alert(camera, counts):
+        dispatcher.submit(camera.serial, headers, payload, api_key, camera.serial, camera.net_id, camera.name,
+                          counts.get('person', 0), counts.get('vehicle', 0), home_macs, nearby, camera.model)
+
+    # Start MQTT client, keeping counts for the chatbot's occupancy queries
+    series = OccupancySeries(OCCUPANCY_DIR)
+    engine = SenseEngine(cameras.values(), alert, rules, default, series=series).start()
+    client = mqtt.Client()
+    client.on_connect = engine.on_connect
+    client.on_message = engine.on_message
+    client.connect('localhost', 1883, 300)
+
+    # Blocking call that processes network traffic, dispatches callbacks and handles reconnecting
+    client.loop_forever()
@@ -0,0 +1,366 @@
+from array import array
+from collections import Counter, namedtuple
+import heapq
+from itertools import compress, repeat
+from operator import and_, ge, lshift, lt, mul, or_, rshift
+import os
+import sys
+import threading
+import time
+
+# Where scanning.py keeps the columns of scanning API observations
+OBSERVATIONS_DIR = 'observations'
+
+# Seconds of observations in each partition, and after the end of which a partition is summarized for queries
+PARTITION = 60 * 60
+SEAL_AFTER = 10 * 60
+
+# Partitions are deleted once their hour is this old
+MAX_AGE = 7 * 24 * 60 * 60
+
+# Columns of each partition and their array type codes: seen time (seconds since the Unix epoch), client MAC and
+# AP MAC as IDs into their dictionaries, RSSI (dBm), location latitude, longitude and uncertainty (m), and type
+COLUMNS = {'t': 'I', 'mac': 'I', 'ap': 'I', 'rssi': 'b', 'lat': 'd', 'lng': 'd', 'unc': 'f', 'type': 'B'}
+
+# Columns written when a partition is sealed, which answer queries on whole hours without reading the rows: the
+# clients of each unique (AP, client) pair, the first and last time each client was seen and how often, and each
+# AP's observations and unique clients
+SUMMARY = {'pair_mac': 'I', 'span_mac': 'I', 'first': 'I', 'last': 'I', 'seen': 'I',
+           'ap_id': 'I', 'ap_seen': 'I', 'ap_visitors': 'I'}
+
+# Observation types by scanning API payload type
+WIFI = 0
+BLE = 1
+TYPES = {'DevicesSeen': WIFI, 'BluetoothDevicesSeen': BLE}
+
+MISSING = float('nan')
+
+# When a client was first and last seen in a time range, the seconds in between, and its observations
+Dwell = namedtuple('Dwell', ['mac', 'first', 'last', 'seconds', 'observations'])
+
+
+# Strings stored once each, as IDs in order of first appearance; kept in an append-only file of one value per line
+# that the writer extends and readers catch up on
+class Dictionary:
+    def __init__(self, path):
+        self.path = path
+        self.values = []
+        self.ids = {}
+        self.pending = []
+        self.offset = 0
+        self.refresh()
+
+    # Read values added to the file since last time, ignoring a partly written final line
+    def refresh(self):
+        try:
+            with open(self.path, 'rb') as fp:
+                fp.seek(self.offset)
+                raw = fp.read()
+        except FileNotFoundError:
+            return
+        whole = raw.rfind(b'\n') + 1
+        for value in raw[:whole].decode().splitlines():
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+        self.offset += whole
+
+    def encode(self, value):
+        id = self.ids.get(value)
+        if id is None:
+            id = self.ids[value] = len(self.values)
+            self.values.append(value)
+            self.pending.append(value)
+        return id
+
+    # Values must be written before any rows that refer to them
+    def flush(self):
+        if not self.pending:
+            return
+        data = ''.join(f'{value}\n' for value in self.pending).encode()
+        with open(self.path, 'ab') as fp:
+            fp.write(data)
+        self.offset += len(data)
+        self.pending = []
+
+
+# Scanning API observations, flattened into typed columns in hourly partitions with dictionary-encoded MACs.
+# Rows are appended in the order received; sealing a partition stores a summary of it, so that queries over
+# whole hours only read small summary columns, and only the edges of a range and the current hour are scanned.
+# Client MACs, many of them randomized, have a dictionary per partition that goes when the partition does; APs
+# share one dictionary, as there are only so many of them.
+class ObservationStore:
+    def __init__(self, directory=OBSERVATIONS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.macs = {}
+        self.aps = Dictionary(os.path.join(directory, 'aps.txt'))
+        self.pending = {}
+        self.repaired = set()
+        self.lock = threading.Lock()
+
+    # Start times of the partitions present, oldest first
+    def hours(self):
+        return sorted(int(name) for name in os.listdir(self.directory) if name.isdigit())
+
+    def path(self, hour, name=None):
+        return os.path.join(self.directory, f'{hour:010d}', *([f'{name}.col'] if name else []))
+
+    # Marker of a sealed partition, holding the number of rows its summary covers
+    def marker(self, hour):
+        return os.path.join(self.path(hour), 'sealed')
+
+    # Dictionary of the client MACs of a partition
+    def dictionary(self, hour):
+        dictionary = self.macs.get(hour)
+        if dictionary is None:
+            dictionary = self.macs[hour] = Dictionary(os.path.join(self.path(hour), 'macs.txt'))
+        return dictionary
+
+    # Buffer the observations of a scanning API POST, by the hour they were seen in; received is the fallback time
+    def add(self, data, received=None):
+        received = int(received or time.time())
+        kind = TYPES.get(data.get('type'), WIFI)
+        with self.lock:
+            ap = self.aps.encode((data['data'].get('apMac') or '').lower())
+            for observation in data['data'].get('observations') or []:
+                # Every value is converted before any is appended, so that a bad observation leaves the columns
+                # aligned, and its MAC is only added to the dictionary of its partition last
+                t = int(observation.get('seenEpoch') or received)
+                location = observation.get('location') or {}
+                rssi = observation.get('rssi')
+                mac = observation['clientMac'].lower()
+                row = [t, None, ap,
+                       min(max(int(rssi), -128), 127) if rssi is not None else 0,
+                       MISSING if location.get('lat') is None else float(location['lat']),
+                       MISSING if location.get('lng') is None else float(location['lng']),
+                       MISSING if location.get('unc') is None else float(location['unc']),
+                       kind]
+                hour = t - t % PARTITION
+                row[1] = self.dictionary(hour).encode(mac)
+                columns = self.pending.get(hour)
+                if columns is None:
+                    columns = self.pending[hour] = [array(code) for code in COLUMNS.values()]
+                for (column, value) in zip(columns, row):
+                    column.append(value)
+
+    # Append the buffered rows to their partitions, after the dictionary values they refer to
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.aps.flush()
+            for (hour, columns) in sorted(pending.items()):
+                os.makedirs(self.path(hour), exist_ok=True)
+                if hour not in self.repaired:
+                    self.repair(hour)
+                self.dictionary(hour).flush()
+                for (name, column) in zip(COLUMNS, columns):
+                    with open(self.path(hour, name), 'ab') as fp:
+                        column.tofile(fp)
+
+    # Cut every column back to the rows that all of them have, in case a crash left some longer than others
+    def repair(self, hour):
+        rows = self.rows(hour)
+        for (name, code) in COLUMNS.items():
+            size = rows * array(code).itemsize
+            path = self.path(hour, name)
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, 'ab') as fp:
+                    fp.truncate(size)
+        self.repaired.add(hour)
+
+    # Rows of a partition that every column has
+    def rows(self, hour):
+        sizes = []
+        for (name, code) in COLUMNS.items():
+            path = self.path(hour, name)
+            sizes.append(os.path.getsize(path) // array(code).itemsize if os.path.exists(path) else 0)
+        return min(sizes)
+
+    def read(self, hour, names, rows):
+        columns = {}
+        for name in names:
+            column = columns[name] = array(COLUMNS.get(name) or SUMMARY[name])
+            count = rows if name in COLUMNS else os.path.getsize(self.path(hour, name)) // column.itemsize
+            with open(self.path(hour, name), 'rb') as fp:
+                column.fromfile(fp, count)
+        return columns
+
+    # Rows of the partition covered by its summary, or 0 if it has none
+    def sealed(self, hour):
+        try:
+            with open(self.marker(hour)) as fp:
+                return int(fp.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    # Summarize partitions whose hour ended a while ago, again if rows arrived late, and apply retention. The MAC
+    # dictionaries of sealed partitions are let go, to be read back from their files if late rows arrive.
+    def seal(self, now=None):
+        now = now or time.time()
+        for hour in self.hours():
+            if hour < now - MAX_AGE - PARTITION:
+                self.remove(hour)
+            elif hour + PARTITION + SEAL_AFTER <= now:
+                rows = self.rows(hour)
+                if rows and rows != self.sealed(hour):
+                    self.summarize(hour, rows)
+                with self.lock:
+                    if hour in self.macs and not self.macs[hour].pending:
+                        del self.macs[hour]
+
+    def summarize(self, hour, rows):
+        columns = self.read(hour, ['t', 'mac', 'ap'], rows)
+        for (name, column) in summarize_rows(columns['t'], columns['mac'], columns['ap']).items():
+            path = self.path(hour, name)
+            with open(f'{path}.tmp', 'wb') as fp:
+                column.tofile(fp)
+            os.replace(f'{path}.tmp', path)
+
+        # The summary only counts once the marker says how many rows it covers
+        marker = self.marker(hour)
+        with open(f'{marker}.tmp', 'w') as fp:
+            fp.write(str(rows))
+        os.replace(f'{marker}.tmp', marker)
+
+    def remove(self, hour):
+        with self.lock:
+            self.macs.pop(hour, None)
+            self.repaired.discard(hour)
+        for name in os.listdir(self.path(hour)):
+            os.remove(os.path.join(self.path(hour), name))
+        os.rmdir(self.path(hour))
+
+    # Partitions overlapping a time range, with whether each can be answered from its summary
+    def partitions(self, start, end, filtered=False):
+        for hour in self.hours():
+            if hour + PARTITION <= start or hour >= end:
+                continue
+            rows = self.rows(hour)
+            whole = start <= hour and hour + PARTITION <= end
+            yield hour, rows, bool(whole and not filtered and rows and rows == self.sealed(hour))
+
+    # Columns of the rows of a partition within a time range and matching the filters
+    def scan(self, hour, rows, names, start, end, kind=None, min_rssi=None):
+        needed = set(names) | {'t'} | ({'type'} if kind is not None else set()) | ({'rssi'} if min_rssi is not None else set())
+        columns = self.read(hour, sorted(needed), rows)
+        masks = []
+        if start > hour:
+            masks.append(map(ge, columns['t'], repeat(start)))
+        if end < hour + PARTITION:
+            masks.append(map(lt, columns['t'], repeat(end)))
+        if kind is not None:
+            masks.append(map(kind.__eq__, columns['type']))
+        if min_rssi is not None:
+            masks.append(map(ge, columns['rssi'], repeat(min_rssi)))
+        if not masks:
+            return {name: columns[name] for name in names}
+        mask = masks[0]
+        for other in masks[1:]:
+            mask = map(mul, mask, other)
+        mask = bytes(mask)
+        return {name: array(columns[name].typecode, compress(columns[name], mask)) for name in names}
+
+    # Summary columns of the part of a partition within a time range and matching the filters
+    def summary(self, hour, rows, whole, start, end, kind=None, min_rssi=None):
+        if whole:
+            return self.read(hour, list(SUMMARY), rows)
+        columns = self.scan(hour, rows, ['t', 'mac', 'ap'], start, end, kind, min_rssi)
+        return summarize_rows(columns['t'], columns['mac'], columns['ap'])
+
+    def summaries(self, start, end, kind=None, min_rssi=None):
+        self.refresh()
+        filtered = kind is not None or min_rssi is not None
+        for (hour, rows, whole) in self.partitions(start, end, filtered):
+            yield hour, self.summary(hour, rows, whole, start, end, kind, min_rssi)
+
+    # Unique clients seen by each AP in each hour of a time range, as {hour: {AP MAC: visitors}}
+    def visitors_per_ap(self, start, end, kind=None, min_rssi=None):
+        visitors = {}
+        for (hour, summary) in self.summaries(start, end, kind, min_rssi):
+            if summary['ap_id']:
+                visitors[hour] = dict(zip(map(self.aps.values.__getitem__, summary['ap_id']), summary['ap_visitors']))
+        return visitors
+
+    # MACs of a partition's IDs
+    def decode(self, hour, ids):
+        return map(self.dictionary(hour).values.__getitem__, ids)
+
+    # First and last time each client was seen in a time range, optionally only the given MACs, as {MAC: Dwell}
+    def dwell_times(self, start, end, macs=None, kind=None, min_rssi=None):
+        summaries = [(hour, summary, list(self.decode(hour, summary['span_mac'])))
+                     for (hour, summary) in self.summaries(start, end, kind, min_rssi)]
+        firsts = {}
+        lasts = {}
+        seen = Counter()
+        # Partitions come oldest first, so the earliest first time is the one written last when going backwards
+        for (hour, summary, span) in reversed(summaries):
+            firsts.update(zip(span, summary['first']))
+        for (hour, summary, span) in summaries:
+            lasts.update(zip(span, summary['last']))
+            seen.update(dict(zip(span, summary['seen'])))
+        if macs is not None:
+            wanted = {mac.lower() for mac in macs}
+            lasts = {mac: t for (mac, t) in lasts.items() if mac in wanted}
+        return {mac: Dwell(mac, firsts[mac], t, t - firsts[mac], seen[mac]) for (mac, t) in lasts.items()}
+
+    # The APs with the most unique clients over a time range, as (AP MAC, visitors, observations), busiest first
+    def busiest_aps(self, start, end, n=10, kind=None, min_rssi=None):
+        clients = {}
+        observations = Counter()
+        for (hour, summary) in self.summaries(start, end, kind, min_rssi):
+            # Each AP's clients are a contiguous run of the pairs, in the order of the AP IDs
+            offset = 0
+            pair_mac = summary['pair_mac']
+            for (ap, visitors) in zip(summary['ap_id'], summary['ap_visitors']):
+                if ap not in clients:
+                    clients[ap] = set()
+                clients[ap].update(self.decode(hour, pair_mac[offset:offset + visitors]))
+                offset += visitors
+            observations.update(dict(zip(summary['ap_id'], summary['ap_seen'])))
+        busiest = heapq.nlargest(n, clients, key=lambda ap: (len(clients[ap]), observations[ap]))
+        return [(self.aps.values[ap], len(clients[ap]), observations[ap]) for ap in busiest]
+
+    # Catch up on values that the writer added, such as when querying from another process, and let go of the MAC
+    # dictionaries of partitions removed since
+    def refresh(self):
+        hours = set(self.hours())
+        with self.lock:
+            self.aps.refresh()
+            for hour in list(self.macs):
+                if hour in hours:
+                    self.macs[hour].refresh()
+                else:
+                    del self.macs[hour]
+
+
+# Summary columns of rows in any order. Pairs are packed into one integer each, AP ID in the high bits, so that
+# sorting them groups each AP's clients together.
+def summarize_rows(t, mac, ap):
+    keys = sorted(set(map(or_, map(lshift, ap, repeat(32)), mac)))
+    visitors = Counter(map(rshift, keys, repeat(32)))
+    ap_ids = sorted(visitors)
+    ap_seen = Counter(ap)
+
+    # In time order, the last time kept for each client is its latest, and going backwards its earliest
+    order = sorted(range(len(t)), key=t.__getitem__)
+    macs = list(map(mac.__getitem__, order))
+    times = list(map(t.__getitem__, order))
+    last = dict(zip(macs, times))
+    first = dict(zip(reversed(macs), reversed(times)))
+    seen = Counter(macs)
+    ids = sorted(last)
+    return {'pair_mac': array('I', map(and_, keys, repeat(0xffffffff))),
+            'span_mac': array('I', ids), 'first': array('I', map(first.__getitem__, ids)),
+            'last': array('I', map(last.__getitem__, ids)), 'seen': array('I', map(seen.__getitem__, ids)),
+            'ap_id': array('I', ap_ids), 'ap_seen': array('I', map(ap_seen.__getitem__, ap_ids)),
+            'ap_visitors': array('I', map(visitors.__getitem__, ap_ids))}
+
+
+# Main function, printing the busiest APs over the last given hours (default 24)
+if __name__ == '__main__':
+    hours = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    store = ObservationStore(OBSERVATIONS_DIR)
+    now = time.time()
+    for (ap, visitors, observations) in store.busiest_aps(now - hours * PARTITION, now):
+        print(f'{ap}: {visitors} visitors, {observations} observations')
@@ -0,0 +1,262 @@
+from collections import namedtuple
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+
+from chatbot import *
+
+# Where mqtt.py keeps the counts of each camera, for the chatbot to query on the same host
+OCCUPANCY_DIR = 'occupancy'
+
+# Classes of object given a series for every camera, counted as zero when a message has none
+CLASSES = ('person', 'vehicle')
+
+# Tiers of buckets as seconds per bucket, and buckets kept of each: an hour of seconds, two days of minutes and
+# ninety days of hours, so that longer windows are answered from fewer, coarser buckets
+WIDTHS = (1, 60, 60 * 60)
+CAPACITIES = (60 * 60, 2 * 24 * 60, 90 * 24)
+
+# Slots added to the data file at a time as new series are seen
+GROW_SLOTS = 64
+
+# File header: magic, format version, epoch that bucket times are stored relative to, capacity of each tier
+HEADER = struct.Struct('<4sII3I')
+MAGIC = b'OCCU'
+VERSION = 1
+
+# Tier header: next index to write, buckets stored
+TIER_HEADER = struct.Struct('<II')
+
+# Bucket: start, messages counted, their total, and the lowest, highest and last count
+BUCKET = struct.Struct('<IIfHHH')
+
+# Timestamps are stored as uint32 seconds since 2019-01-01, which lasts until the 2150s
+EPOCH = 1546300800
+
+# Counts above this are stored as this
+MAX_COUNT = 0xFFFF
+
+# Counts of one class of object over a bucket or window, starting at the given epoch seconds
+Bucket = namedtuple('Bucket', ['start', 'min', 'max', 'mean', 'last', 'samples'])
+
+# Windows that the chatbot recognizes in a message, as (words, seconds, phrase), with a day otherwise
+WINDOWS = [(('hour', 'hours'), 60 * 60, 'hour'), (('week', 'weeks'), 7 * 24 * 60 * 60, 'week'),
+           (('month', 'months'), 30 * 24 * 60 * 60, '30 days')]
+DAY = (('day', 'days'), 24 * 60 * 60, 'day')
+
+# Words of a message asking about vehicles rather than people
+VEHICLE_WORDS = ('car', 'cars', 'vehicle', 'vehicles')
+
+
+# Counts of each class of object seen by each MV camera, in a memory-mapped file of fixed-size ring buffers, one
+# slot per (serial, class). Every message updates the current bucket of each tier at once, so the minute and hour
+# tiers are always the rollups of the seconds within them, and the file only grows with new series, never with time.
+class OccupancySeries:
+    def __init__(self, directory=OCCUPANCY_DIR, capacities=CAPACITIES, classes=CLASSES):
+        self.directory = directory
+        self.classes = classes
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, 'occupancy.dat')
+        self.keys_path = os.path.join(directory, 'occupancy.keys')
+
+        # Series keys in slot order, one per line with the camera's name
+        self.slots = {}
+        self.by_serial = {}
+        self.names = {}
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path) as fp:
+                for line in fp:
+                    if line.strip():
+                        (serial, cls, name) = line.rstrip('\n').split('\t')
+                        self.add_key(serial, cls, name)
+
+        # Header fixes the epoch and tier capacities for the life of the file
+        if not os.path.exists(self.data_path):
+            with open(self.data_path, 'wb') as fp:
+                fp.write(HEADER.pack(MAGIC, VERSION, EPOCH, *capacities))
+        self.fp = open(self.data_path, 'r+b')
+        (magic, version, self.epoch, *self.capacities) = HEADER.unpack(self.fp.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{self.data_path} is not an occupancy series file')
+
+        # Offset of each tier within a slot
+        self.offsets = []
+        self.slot_size = 0
+        for capacity in self.capacities:
+            self.offsets.append(self.slot_size)
+            self.slot_size += TIER_HEADER.size + BUCKET.size * capacity
+        self.map = None
+        self.remap(len(self.slots))
+
+    # Map the file, extending it to hold at least the given number of slots
+    def remap(self, slots):
+        if os.path.getsize(self.data_path) < HEADER.size + self.slot_size * max(slots, 1):
+            self.fp.truncate(HEADER.size + self.slot_size * math.ceil(max(slots, 1) / GROW_SLOTS) * GROW_SLOTS)
+        if self.map:
+            self.map.close()
+        self.map = mmap.mmap(self.fp.fileno(), 0)
+
+    def add_key(self, serial, cls, name):
+        self.slots[(serial, cls)] = len(self.slots)
+        self.by_serial.setdefault(serial, []).append(cls)
+        if name or serial not in self.names:
+            self.names[serial] = name or serial
+
+    # Slot number of a series, adding one if new; the file is extended before the key is written, so that other
+    # processes reading the keys always find their slots mapped
+    def slot(self, serial, cls, name=None):
+        slot = self.slots.get((serial, cls))
+        if slot is None:
+            self.add_key(serial, cls, name)
+            slot = self.slots[(serial, cls)]
+            if HEADER.size + self.slot_size * len(self.slots) > len(self.map):
+                self.remap(len(self.slots))
+            with open(self.keys_path, 'a') as fp:
+                fp.write(f'{serial}\t{cls}\t{name or ""}\n')
+        return slot
+
+    # Add a count at t seconds since the epoch to the current bucket of each tier, or start a new one; counts for
+    # buckets already closed, such as from late messages, are left out of that tier
+    def add(self, slot, t, count):
+        base = HEADER.size + self.slot_size * slot
+        count = min(count, MAX_COUNT)
+        for (width, capacity, offset) in zip(WIDTHS, self.capacities, self.offsets):
+            start = t - t % width
+            at = base + offset
+            (head, stored) = TIER_HEADER.unpack_from(self.map, at)
+            ring = at + TIER_HEADER.size
+            if stored:
+                current = ring + BUCKET.size * ((head - 1) % capacity)
+                (newest, samples, total, low, high, last) = BUCKET.unpack_from(self.map, current)
+                if newest == start:
+                    BUCKET.pack_into(self.map, current, start, samples + 1, total + count, min(low, count),
+                                     max(high, count), count)
+                    continue
+                if start < newest:
+                    continue
+            BUCKET.pack_into(self.map, ring + BUCKET.size * head, start, 1, count, count, count, count)
+            TIER_HEADER.pack_into(self.map, at, (head + 1) % capacity, min(stored + 1, capacity))
+
+    # Counts of an MV Sense message, as {class: count} at ts milliseconds, from a camera; classes seen before but
+    # absent from the message count as zero
+    def record(self, serial, ts, counts, name=None):
+        t = int(ts) // 1000 - self.epoch
+        if not 0 <= t < 1 << 32:
+            return
+        if serial not in self.by_serial:
+            for cls in self.classes:
+                self.slot(serial, cls, name)
+        for cls in counts:
+            if (serial, cls) not in self.slots:
+                self.slot(serial, cls, name)
+        for cls in self.by_serial[serial]:
+            self.add(self.slots[(serial, cls)], t, counts.get(cls, 0))
+
+    # Finest tier holding the whole window
+    def tier(self, seconds):
+        for (tier, (width, capacity)) in enumerate(zip(WIDTHS, self.capacities)):
+            if width * capacity >= seconds:
+                return tier
+        return len(WIDTHS) - 1
+
+    # Buckets of a camera's class over the last given seconds in time order, from the finest tier holding the
+    # window unless a tier is given, reading back from the newest so that cost depends on the buckets returned
+    def buckets(self, serial, cls, seconds, tier=None, now=None):
+        slot = self.slots.get((serial, cls))
+        if slot is None:
+            return []
+        tier = self.tier(seconds) if tier is None else tier
+        (width, capacity) = (WIDTHS[tier], self.capacities[tier])
+        since = (now or time.time()) - self.epoch - seconds
+        at = HEADER.size + self.slot_size * slot + self.offsets[tier]
+        (head, stored) = TIER_HEADER.unpack_from(self.map, at)
+        ring = at + TIER_HEADER.size
+        picked = []
+        for i in range(1, stored + 1):
+            (start, samples, total, low, high, last) = BUCKET.unpack_from(self.map,
+                                                                          ring + BUCKET.size * ((head - i) % capacity))
+            if start + width <= since:
+                break
+            picked.append(Bucket(start + self.epoch, low, high, total / samples, last, samples))
+        picked.reverse()
+        return picked
+
+    # Counts of a camera's class over the whole of the last given seconds, or None if none were recorded
+    def summary(self, serial, cls, seconds, now=None):
+        buckets = self.buckets(serial, cls, seconds, now=now)
+        if not buckets:
+            return None
+        samples = sum(b.samples for b in buckets)
+        return Bucket(buckets[0].start, min(b.min for b in buckets), max(b.max for b in buckets),
+                      sum(b.mean * b.samples for b in buckets) / samples, buckets[-1].last, samples)
+
+    # Serials of the cameras named (or whose serials appear) in some text, longest names first
+    def find(self, text):
+        text = text.lower()
+        found = []
+        for (serial, name) in sorted(self.names.items(), key=lambda item: -len(item[1])):
+            if serial.lower() in text or name.lower() in text:
+                found.append(serial)
+                text = text.replace(name.lower(), '')
+        return found
+
+    # Write changes through to disk
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.fp.close()
+
+
+# Answer the chatbot with the people (or vehicle) counts at the cameras named in a message, such as
+# "how many people at Front door over the last day", from the series that mqtt.py keeps on this host
+def occupancy_report(session, headers, payload, message, directory=OCCUPANCY_DIR):
+    series = OccupancySeries(directory)
+    try:
+        serials = series.find(message)
+        if not serials:
+            names = ', '.join(sorted(series.names.values()))
+            post_message(session, headers, payload,
+                         f'Which camera? Counts are kept for: {names}' if names else 'No MV Sense counts kept yet')
+            return
+
+        # Whole words of the message besides the cameras' names and serials, so that a camera named Carport
+        # is not taken as asking about cars
+        text = message.lower()
+        for serial in serials:
+            text = text.replace(series.names[serial].lower(), ' ').replace(serial.lower(), ' ')
+        words = set(re.findall(r'[a-z]+', text))
+
+        (window, seconds, period) = next((w for w in WINDOWS if words.intersection(w[0])), DAY)
+        (cls, label) = ('vehicle', 'vehicles') if words.intersection(VEHICLE_WORDS) else ('person', 'people')
+        lines = []
+        for serial in serials:
+            name = series.names[serial]
+            stats = series.summary(serial, cls, seconds)
+            if stats is None:
+                lines.append(f'- **{name}**: no counts of {label} over the last {period}')
+            else:
+                lines.append(f'- **{name}**: {label} peaked at **{stats.max}**, averaging **{stats.mean:.1f}**, '
+                             f'latest **{stats.last}**')
+        post_message(session, headers, payload, f'Over the last {period}:  \n' + '  \n'.join(lines))
+    finally:
+        series.close()
+
+
+# Main function
+if __name__ == '__main__':
+    # Summary of each camera's counts over the last given hours, a day by default
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    series = OccupancySeries(OCCUPANCY_DIR)
+    for (serial, name) in sorted(series.names.items(), key=lambda item: item[1]):
+        for cls in series.by_serial[serial]:
+            stats = series.summary(serial, cls, hours * 60 * 60)
+            if stats:
+                print(f'{name} ({serial}) {cls}: min {stats.min}, max {stats.max}, mean {stats.mean:.2f}, '
+                      f'last {stats.last}, {stats.samples} messages')
+    series.close()
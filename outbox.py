@@ -0,0 +1,137 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+from metrics import instrument, retry
+
+messages_url = 'https://api.ciscospark.com/v1/messages'
+
+# Rooms delivered to at once; messages within a room always go one at a time, in order
+WORKERS = 4
+
+# Attempts per message while Webex is rate limiting, and the wait if it does not give a Retry-After
+MAX_ATTEMPTS = 5
+DEFAULT_RETRY_AFTER = 1.0
+
+
+# Seconds to wait before retrying, from the Retry-After header if present
+def retry_after(response):
+    try:
+        return max(float(response.headers['Retry-After']), 0.0)
+    except (KeyError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+# Function to go back to the start of file contents before another attempt: nothing for bytes, the position they
+# started at for files, and rewind() for streams that keep what they have read
+def rewinder(contents):
+    if hasattr(contents, 'rewind'):
+        return contents.rewind
+    if hasattr(contents, 'seek'):
+        start = contents.tell()
+        return lambda: contents.seek(start)
+    return lambda: None
+
+
+# Post one message (optionally with file contents attached), retrying when rate limited, and return the final response
+def deliver(session, headers, body, files=None, attempts=MAX_ATTEMPTS):
+    instrument(session)
+    rewind = rewinder(files[1]) if files else None
+    for attempt in range(1, attempts + 1):
+        if files:
+            if attempt > 1:
+                rewind()
+            fields = dict(body)
+            fields['files'] = files
+            m = MultipartEncoder(fields)
+            file_headers = {k: v for (k, v) in headers.items() if k.lower() != 'content-type'}
+            file_headers['Content-Type'] = m.content_type
+            response = session.post(messages_url, data=m, headers=file_headers)
+        else:
+            response = session.post(messages_url, headers=headers, json=body)
+
+        if response.status_code not in (429, 503) or attempt == attempts:
+            break
+        retry('POST', messages_url)
+        time.sleep(retry_after(response))
+
+    if not response.ok:
+        print(f'Webex message not sent ({response.status_code}): {response.text}')
+    return response
+
+
+# GET from the Webex API, retrying when rate limited as deliver does, and return the final response
+def fetch(session, url, headers, attempts=MAX_ATTEMPTS):
+    instrument(session)
+    for attempt in range(1, attempts + 1):
+        response = session.get(url, headers=headers)
+        if response.status_code not in (429, 503) or attempt == attempts:
+            break
+        retry('GET', url)
+        time.sleep(retry_after(response))
+    return response
+
+
+# Queue of outgoing Webex messages: FIFO per room, rooms delivered in parallel over pooled connections
+class Outbox:
+    def __init__(self, session=None, workers=WORKERS):
+        if session:
+            self.session = session
+        else:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            self.session.mount('https://', adapter)
+        instrument(self.session)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.rooms = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+
+    # Queue a message for the room/person in payload, returning a future for the response
+    def post(self, headers, payload, message, files=None):
+        body = dict(payload)
+        body['markdown'] = message
+        room = body.get('roomId') or body.get('toPersonEmail') or body.get('toPersonId')
+        future = Future()
+        with self.lock:
+            self.pending += 1
+            if room in self.rooms:
+                self.rooms[room].append((headers, body, files, future))
+            else:
+                self.rooms[room] = deque([(headers, body, files, future)])
+                self.executor.submit(self.drain, room)
+        return future
+
+    # Deliver a room's messages in order until its queue is empty
+    def drain(self, room):
+        while True:
+            with self.lock:
+                queue = self.rooms[room]
+                if not queue:
+                    del self.rooms[room]
+                    return
+                (headers, body, files, future) = queue[0]
+            try:
+                future.set_result(deliver(self.session, headers, body, files))
+            except Exception as e:
+                future.set_exception(e)
+            with self.lock:
+                queue.popleft()
+                self.pending -= 1
+                if self.pending == 0:
+                    self.idle.notify_all()
+
+    # Block until every queued message has been delivered, returning False on timeout
+    def flush(self, timeout=None):
+        with self.lock:
+            return self.idle.wait_for(lambda: self.pending == 0, timeout)
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown()
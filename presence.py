@@ -0,0 +1,159 @@
+from collections import namedtuple
+import configparser
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+
+from async_api import *
+from device_index import family_of
+
+# Where each source keeps its snapshot of the index, for send.py to read
+PRESENCE_DIR = 'presence'
+
+# Sightings older than this are dropped, and snapshots are written at most this often while observations arrive
+RETENTION = 60 * 60
+SAVE_INTERVAL = 5
+
+# Seconds between polls of the network clients API
+POLL_INTERVAL = 60
+
+# When a MAC was last seen (seconds since the Unix epoch), by which source, and at which AP or device if known
+Sighting = namedtuple('Sighting', ['mac', 'seen', 'source', 'ap'])
+
+
+# Last sighting of each client MAC, kept up to date incrementally by each source (scanning.py, the clients poller)
+# and shared through one small snapshot file per source, so that each writer owns its own file
+class PresenceIndex:
+    def __init__(self, directory=PRESENCE_DIR, source=None):
+        self.directory = directory
+        self.source = source
+        self.sightings = {}
+        self.updated = {}
+        self.saved = 0
+        self.lock = threading.Lock()
+
+    def update(self, mac, seen, source, ap=None):
+        mac = mac.lower()
+        with self.lock:
+            current = self.sightings.get(mac)
+            if current is None or seen > current.seen:
+                self.sightings[mac] = Sighting(mac, seen, source, ap)
+
+    # Add the observations of a scanning API POST
+    def observe_scanning(self, data, now=None):
+        now = now or time.time()
+        ap = data['data'].get('apMac')
+        for observation in data['data'].get('observations') or []:
+            self.update(observation['clientMac'], observation.get('seenEpoch') or now, 'scanning', ap)
+
+    # Add the response of the network clients API
+    def observe_clients(self, clients, now=None):
+        now = now or time.time()
+        for client in clients:
+            self.update(client['mac'], client.get('lastSeen') or now, 'clients', client.get('recentDeviceSerial'))
+
+    def last_seen(self, mac):
+        return self.sightings.get(mac.lower())
+
+    # Most recent sighting of any of the MACs within the last given seconds, or None
+    def seen_within(self, macs, seconds, now=None):
+        since = (now or time.time()) - seconds
+        sightings = [self.sightings.get(mac.lower()) for mac in macs]
+        recent = [s for s in sightings if s and s.seen >= since]
+        return max(recent, key=lambda s: s.seen) if recent else None
+
+    # Whether a source has written its snapshot within the last given seconds
+    def fresh(self, source, seconds, now=None):
+        return self.updated.get(source, 0) >= (now or time.time()) - seconds
+
+    # Atomically write this source's sightings, dropping expired ones; unless forced, at most every SAVE_INTERVAL
+    def save(self, force=False, now=None):
+        now = now or time.time()
+        if not force and now - self.saved < SAVE_INTERVAL:
+            return False
+        with self.lock:
+            self.sightings = {mac: s for (mac, s) in self.sightings.items() if s.seen >= now - RETENTION}
+            macs = {mac: [s.seen, s.ap] for (mac, s) in self.sightings.items() if s.source == self.source}
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'{self.source}.json')
+            with open(f'{path}.tmp', 'w') as fp:
+                json.dump({'updated': now, 'macs': macs}, fp, separators=(',', ':'))
+            os.replace(f'{path}.tmp', path)
+            self.saved = now
+        return True
+
+    # Merge every source's snapshot into one index for lookups
+    @classmethod
+    def load(cls, directory=PRESENCE_DIR):
+        index = cls(directory)
+        if not os.path.isdir(directory):
+            return index
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            source = name[:-5]
+            try:
+                with open(os.path.join(directory, name)) as fp:
+                    snapshot = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            index.updated[source] = snapshot['updated']
+            for (mac, (seen, ap)) in snapshot['macs'].items():
+                index.update(mac, seen, source, ap)
+        return index
+
+
+# List the clients that have used this network in the timespan
+# https://api.meraki.com/api_docs#list-the-clients-that-have-used-this-network-in-the-timespan
+def get_net_clients(session, api_key, net_id, start_time=None, timespan=None):
+    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+    params = {'perPage': 1000}
+    if start_time:
+        params['t0'] = start_time
+    if timespan:
+        params['timespan'] = timespan
+    response = session.get(f'{base_url}/networks/{net_id}/clients', headers=headers, params=params)
+    return response.json() if response.ok else []
+
+
+# Store credentials in a separate file
+def gather_credentials():
+    cp = configparser.ConfigParser()
+    try:
+        cp.read('credentials.ini')
+        cam_key = cp.get('meraki', 'key2')
+        org_id = cp.get('meraki', 'organization')
+        mv_serials = cp.get('sense', 'serial')
+        mv_serials = [s.strip() for s in mv_serials.split(',') if s.strip()]
+    except:
+        print('Missing credentials or input file!')
+        sys.exit(2)
+    return cam_key, org_id, mv_serials
+
+
+# Main function, polling the clients of the MV Sense cameras' networks into the index
+if __name__ == '__main__':
+    (api_key, org_id, mv_serials) = gather_credentials()
+    session = requests.Session()
+
+    # Find the cameras' networks, those of all MV cameras unless some are given
+    dashboard = AsyncDashboard(api_key, session)
+    devices = run(dashboard.get_org_devices(org_id)) or []
+    dashboard.close()
+    cameras = [d for d in devices if d['serial'] in mv_serials or (not mv_serials and family_of(d.get('model')) == 'MV')]
+    net_ids = sorted({d['networkId'] for d in cameras if d.get('networkId')})
+    if not net_ids:
+        print(f'Cameras {", ".join(mv_serials) or "(all)"} not found in organization {org_id}!')
+        sys.exit(2)
+
+    index = PresenceIndex(PRESENCE_DIR, 'clients')
+    while True:
+        started = time.time()
+        for net_id in net_ids:
+            index.observe_clients(get_net_clients(session, api_key, net_id, timespan=2 * POLL_INTERVAL), started)
+        index.save(force=True)
+        time.sleep(max(POLL_INTERVAL - (time.time() - started), 0))
@@ -3,32 +3,27 @@ import random
 import re
 
 from chatbot import *
+from device_index import DeviceIndex
+from metrics import instrument
 from status import *
 
 
 # Display input card with form for creating network and claiming devices
 def get_inputs(session, headers, payload, api_key, org_id):
+    instrument(session)
     # Load cards for Webex Teams
     with open('deploy.json') as fp:
         card = json.load(fp)
     card['roomId'] = payload['roomId']
 
     # Get org inventory, and list up to 7 serials of each product family
-    inventory = get_org_inventory(session, api_key, org_id)
-    unused = [d for d in inventory if not d['networkId']]
-    random.shuffle(unused)
-    mx_unused = [d for d in unused if d['model'][:2] in ('MX', 'Z1', 'Z3')][:7]
-    mx_unused = sorted(mx_unused, key=lambda d: d['model'], reverse=True)
-    ms_unused = [d for d in unused if d['model'][:2] == 'MS'][:7]
-    ms_unused = sorted(ms_unused, key=lambda d: d['model'], reverse=True)
-    mr_unused = [d for d in unused if d['model'][:2] == 'MR'][:7]
-    mr_unused = sorted(mr_unused, key=lambda d: d['model'], reverse=True)
-    mv_unused = [d for d in unused if d['model'][:2] == 'MV'][:7]
-    mv_unused = sorted(mv_unused, key=lambda d: d['model'], reverse=True)
+    index = DeviceIndex(get_org_inventory(session, api_key, org_id))
 
     # Format output of card
     new_card_items = []
-    for (product, unused) in zip(('MX', 'MS', 'MR', 'MV'), (mx_unused, ms_unused, mr_unused, mv_unused)):
+    for product in ('MX', 'MS', 'MR', 'MV'):
+        unused = index.select(family=product, network=None)
+        unused = sorted(random.sample(unused, min(len(unused), 7)), key=lambda d: d['model'], reverse=True)
         new_card_items.append({'type': 'TextBlock', 'text': f'{product} serial number'})
         choices = []
         for d in unused:
@@ -66,6 +61,7 @@ def display_success(session, headers, payload, name, devices):
 
 # Process inputs based on form or confirmation card
 def process_inputs(session, headers, payload, api_key, org_id, inputs):
+    instrument(session)
     # Empty submission (try again)
     inputs = inputs['inputs']
     if not inputs:
@@ -0,0 +1,99 @@
+import asyncio
+import random
+import threading
+import time
+
+from metrics import retry
+
+# Backoff between probes of a snapshot URL that is not ready yet, in seconds
+INITIAL_DELAY = 0.25
+MAX_DELAY = 4.0
+BACKOFF_FACTOR = 2.0
+
+# Give up on a snapshot that is still not ready after this many seconds
+TIMEOUT = 30.0
+
+# Weight of the newest observation in each camera model's delay estimate
+SMOOTHING = 0.3
+
+# Fraction of the estimated delay to wait before the first probe
+HEADSTART = 0.8
+
+
+# Learns, per camera model, how long snapshots take to become ready after they are requested
+class ReadyEstimator:
+    def __init__(self, smoothing=SMOOTHING):
+        self.smoothing = smoothing
+        self.estimates = {}
+        self.lock = threading.Lock()
+
+    # Seconds to wait before probing a new snapshot from this model
+    def first_probe(self, model):
+        return self.estimates.get(model, 0.0) * HEADSTART
+
+    # Fold how long a snapshot actually took into the model's running average
+    def observe(self, model, elapsed):
+        with self.lock:
+            if model in self.estimates:
+                self.estimates[model] += self.smoothing * (elapsed - self.estimates[model])
+            else:
+                self.estimates[model] = elapsed
+
+
+# Estimates shared by all snapshots in this process
+estimator = ReadyEstimator()
+
+
+# Delays between probes, growing exponentially up to a cap, with jitter so probes do not line up
+def backoff_delays(initial=INITIAL_DELAY, maximum=MAX_DELAY, factor=BACKOFF_FACTOR):
+    delay = initial
+    while True:
+        yield random.uniform(delay / 2, delay)
+        delay = min(delay * factor, maximum)
+
+
+# Probe the URL once, returning the streaming response if the image is ready, otherwise None
+def probe(session, url):
+    response = session.get(url, stream=True)
+    if response.ok:
+        return response
+    response.close()
+    return None
+
+
+# Wait until a snapshot URL is ready, returning its streaming response, or None if it times out
+def wait_for_snapshot(session, url, model=None, timeout=TIMEOUT):
+    requested = time.monotonic()
+    time.sleep(estimator.first_probe(model))
+    for delay in backoff_delays():
+        response = probe(session, url)
+        if response:
+            estimator.observe(model, time.monotonic() - requested)
+            return response
+        if time.monotonic() + delay - requested > timeout:
+            return None
+        retry('GET', url)
+        time.sleep(delay)
+
+
+# Same as wait_for_snapshot, but waiting on the event loop so that many snapshots can be pending at once
+async def poll_snapshot(session, url, model=None, timeout=TIMEOUT, executor=None):
+    loop = asyncio.get_running_loop()
+    requested = time.monotonic()
+    await asyncio.sleep(estimator.first_probe(model))
+    for delay in backoff_delays():
+        response = await loop.run_in_executor(executor, probe, session, url)
+        if response:
+            estimator.observe(model, time.monotonic() - requested)
+            return response
+        if time.monotonic() + delay - requested > timeout:
+            return None
+        retry('GET', url)
+        await asyncio.sleep(delay)
+
+
+# Poll many snapshot URLs at once, returning their responses (or None) in the same order
+async def poll_snapshots(session, urls, models=None, timeout=TIMEOUT, executor=None):
+    models = models or [None] * len(urls)
+    return await asyncio.gather(*[poll_snapshot(session, url, model, timeout, executor)
+                                  for (url, model) in zip(urls, models)])
@@ -0,0 +1,222 @@
+from bisect import bisect_left
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Where scanning.py logs the scanning API data that send.py reads
+LOG_DIR = 'logs'
+
+# Bytes written to a segment, or seconds since its first record, before rolling over to a new one
+SEGMENT_BYTES = 8 * 1024 * 1024
+SEGMENT_AGE = 60 * 60
+
+# Retention: segments are deleted, oldest first, once over this total size or once all their records are this old
+MAX_BYTES = 256 * 1024 * 1024
+MAX_AGE = 7 * 24 * 60 * 60
+
+# Record header: compressed length, timestamp (ms since the Unix epoch), CRC-32 of the compressed data
+RECORD = struct.Struct('<IQI')
+
+# Time index entry, one per record: timestamp (ms), offset of the record in its segment
+INDEX = struct.Struct('<QQ')
+
+# zlib level, trading a little ratio for speed on bursts of scanning POSTs
+COMPRESSION = 1
+
+
+# Append-only log of JSON records, in segment files named by their first record's timestamp. Each record is
+# compressed and length-prefixed, and each segment has a sidecar index of record times so that readers can seek
+# straight to a time range. Readers in other processes only ever see whole records.
+class SegmentLog:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_bytes=MAX_BYTES, max_age=MAX_AGE,
+                 segment_age=SEGMENT_AGE):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment = None
+        self.index = None
+        self.size = 0
+        self.start = 0
+        self.last = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    # First timestamps (ms) of the segments present, oldest first
+    def segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.seg'))
+
+    def path(self, start, extension='seg'):
+        return os.path.join(self.directory, f'{start:016d}.{extension}')
+
+    # Open the newest segment for appending, first dropping any record left half written by a crash. Index entries
+    # are only trusted while each is the record right after the one before and no earlier in time; from the first
+    # that is not, such as one torn or stale, the index is rebuilt from the records themselves.
+    def open_segment(self, timestamp):
+        starts = self.segments()
+        if starts:
+            start = starts[-1]
+            entries = read_index(self.path(start, 'idx'))
+            valid = 0
+            trusted = 0
+            rebuilt = bytearray()
+            with open(self.path(start), 'rb') as fp:
+                for (ts, offset) in entries:
+                    if offset != valid or ts < self.last or read_record(fp, offset) is None:
+                        break
+                    valid = fp.tell()
+                    self.last = ts
+                    trusted += 1
+                while True:
+                    fp.seek(valid)
+                    header = fp.read(RECORD.size)
+                    if read_record(fp, valid) is None:
+                        break
+                    ts = max(RECORD.unpack(header)[1], self.last)
+                    rebuilt += INDEX.pack(ts, valid)
+                    valid = fp.tell()
+                    self.last = ts
+            with open(self.path(start), 'ab') as fp:
+                fp.truncate(valid)
+            with open(self.path(start, 'idx'), 'ab') as fp:
+                fp.truncate(trusted * INDEX.size)
+                fp.write(rebuilt)
+            self.size = valid
+        else:
+            start = timestamp
+            self.size = 0
+        self.start = start
+        self.segment = open(self.path(start), 'ab')
+        self.index = open(self.path(start, 'idx'), 'ab')
+
+    # Close the current segment and start a new one, then apply retention
+    def roll(self, timestamp):
+        self.close()
+        start = max([timestamp] + [s + 1 for s in self.segments()])
+        self.start = start
+        self.segment = open(self.path(start), 'ab')
+        self.index = open(self.path(start, 'idx'), 'ab')
+        self.size = 0
+        self.retain()
+
+    # Append records at once, as a group that is written and flushed together; timestamp in seconds, default now
+    def append_many(self, records, timestamp=None):
+        timestamp = timestamp or time.time()
+        self.append_timed([(timestamp, record) for record in records])
+
+    # Append (timestamp in seconds, record) pairs as one group, such as records queued up since they were received
+    def append_timed(self, pairs):
+        with self.lock:
+            self.append_group([(int(ts * 1000), record) for (ts, record) in pairs])
+
+    def append_group(self, pairs):
+        if not pairs:
+            return
+        if self.segment is None:
+            self.open_segment(pairs[0][0])
+
+        data = bytearray()
+        entries = bytearray()
+        for (timestamp, record) in pairs:
+            # Keep times in order within the log even if the clock steps back, so that indexes stay sorted
+            timestamp = max(timestamp, self.last)
+            self.last = timestamp
+            size = self.size + len(data)
+            if size and (size >= self.segment_bytes or timestamp - self.start >= self.segment_age * 1000):
+                self.write(data, entries)
+                data = bytearray()
+                entries = bytearray()
+                self.roll(timestamp)
+            compressed = zlib.compress(json.dumps(record, separators=(',', ':')).encode(), COMPRESSION)
+            entries += INDEX.pack(timestamp, self.size + len(data))
+            data += RECORD.pack(len(compressed), timestamp, zlib.crc32(compressed))
+            data += compressed
+        self.write(data, entries)
+
+    def append(self, record, timestamp=None):
+        self.append_many([record], timestamp)
+
+    # Records go out before their index entries, so any indexed record is complete
+    def write(self, data, entries):
+        if not data:
+            return
+        self.segment.write(data)
+        self.segment.flush()
+        self.index.write(entries)
+        self.index.flush()
+        self.size += len(data)
+
+    # Delete the oldest segments while over the size limit or entirely older than the age limit
+    def retain(self, now=None):
+        now_ms = int((now or time.time()) * 1000)
+        starts = self.segments()
+        sizes = [os.path.getsize(self.path(s)) + os.path.getsize(self.path(s, 'idx')) for s in starts]
+        total = sum(sizes)
+        for (i, start) in enumerate(starts[:-1]):
+            # A segment's records all come before the next segment's first one
+            expired = starts[i + 1] < now_ms - self.max_age * 1000
+            if total <= self.max_bytes and not expired:
+                break
+            os.remove(self.path(start))
+            os.remove(self.path(start, 'idx'))
+            total -= sizes[i]
+
+    # Yield (timestamp in seconds, record) for records from start up to but not including end, in order
+    def scan(self, start=None, end=None):
+        start_ms = int(start * 1000) if start is not None else 0
+        end_ms = int(end * 1000) if end is not None else None
+        starts = self.segments()
+        for (i, first) in enumerate(starts):
+            if end_ms is not None and first >= end_ms:
+                break
+            if i + 1 < len(starts) and starts[i + 1] <= start_ms:
+                continue
+            try:
+                entries = read_index(self.path(first, 'idx'))
+                times = [ts for (ts, offset) in entries]
+                with open(self.path(first), 'rb') as fp:
+                    for (ts, offset) in entries[bisect_left(times, start_ms):]:
+                        if end_ms is not None and ts >= end_ms:
+                            return
+                        data = read_record(fp, offset)
+                        if data is None:
+                            break
+                        yield ts / 1000, json.loads(zlib.decompress(data))
+            except FileNotFoundError:
+                # Deleted by retention while being read
+                continue
+
+    def close(self):
+        if self.segment:
+            self.segment.close()
+            self.index.close()
+            self.segment = None
+            self.index = None
+
+
+# Entries of a time index file, ignoring any partly written final entry
+def read_index(path):
+    try:
+        with open(path, 'rb') as fp:
+            raw = fp.read()
+    except FileNotFoundError:
+        return []
+    whole = len(raw) - len(raw) % INDEX.size
+    return list(INDEX.iter_unpack(raw[:whole]))
+
+
+# Compressed data of the record at an offset, or None if incomplete or corrupt
+def read_record(fp, offset):
+    fp.seek(offset)
+    header = fp.read(RECORD.size)
+    if len(header) < RECORD.size:
+        return None
+    (length, timestamp, crc) = RECORD.unpack(header)
+    data = fp.read(length)
+    if len(data) < length or zlib.crc32(data) != crc:
+        return None
+    return data
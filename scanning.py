@@ -1,17 +1,154 @@
+import atexit
 import configparser
-from datetime import datetime
-import json
-import os
+import queue
 import sys
+import threading
+import time
 
 from flask import Flask
 from flask import request
 
+from observations import OBSERVATIONS_DIR, ObservationStore
+from presence import PRESENCE_DIR, SAVE_INTERVAL, PresenceIndex
+from scanlog import LOG_DIR, SegmentLog
+from spatial import SPATIAL_DIR, SpatialIndex
+
 app = Flask(__name__)
 
-# Create folder for scanning API logs
-if 'logs' not in os.listdir():
-    os.mkdir('logs')
+# Append-only log of scanning API data, the last sighting and recent positions of each client MAC, read by send.py,
+# and the columns of observations for location analytics
+log = SegmentLog(LOG_DIR)
+presence = PresenceIndex(PRESENCE_DIR, 'scanning')
+spatial = SpatialIndex(SPATIAL_DIR)
+store = ObservationStore(OBSERVATIONS_DIR)
+
+# POSTs held in memory waiting to be written, beyond which new ones are dropped rather than slowing down the ack,
+# and the most written as one group
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+
+# Seconds between checks for observation partitions to seal
+SEAL_INTERVAL = 60
+
+
+# Writes queued scanning API POSTs to the log, indexes and observation store from a background thread, in batches
+# that are committed together, so that the receiver can ack Meraki as soon as a POST is accepted
+class ScanningWriter:
+    def __init__(self, log, presence, spatial, store, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE):
+        self.log = log
+        self.presence = presence
+        self.spatial = spatial
+        self.store = store
+        self.sealed = 0
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.counts = {'received': 0, 'dropped': 0, 'rejected': 0, 'written': 0, 'batches': 0, 'errors': 0}
+        self.max_batch = 0
+        self.dirty = False
+        self.thread = None
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    # Queue a POST with the time it was received, returning False if it had to be dropped
+    def submit(self, data):
+        try:
+            self.queue.put_nowait((time.time(), data))
+        except queue.Full:
+            self.count('dropped')
+            return False
+        self.count('received')
+        return True
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='scanning-writer', daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+        return self
+
+    # Wait for POSTs, then take whatever else is queued up to a batch; when idle, still save pending sightings
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=SAVE_INTERVAL)
+            except queue.Empty:
+                self.save()
+                continue
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self.write(batch)
+            if item is None:
+                self.save(force=True)
+                return
+
+    def write(self, batch):
+        try:
+            self.log.append_timed(batch)
+        except OSError as e:
+            self.count('errors')
+            print(f'Could not log {len(batch)} scanning POSTs: {e}')
+        else:
+            self.count('written', len(batch))
+        for (received, data) in batch:
+            # A malformed POST is still logged as received, but must not stop the writer
+            try:
+                self.presence.observe_scanning(data, received)
+                self.spatial.observe_scanning(data, received)
+                self.store.add(data, received)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                self.count('errors')
+        try:
+            self.store.flush()
+        except OSError as e:
+            self.count('errors')
+            print(f'Could not store observations of {len(batch)} scanning POSTs: {e}')
+        self.dirty = True
+        with self.lock:
+            self.counts['batches'] += 1
+            self.max_batch = max(self.max_batch, len(batch))
+        self.save()
+
+    # Save pending sightings and positions, and now and then seal finished observation partitions
+    def save(self, force=False):
+        if self.dirty:
+            saved = [self.presence.save(force), self.spatial.save(force)]
+            self.dirty = not all(saved)
+        now = time.time()
+        if now - self.sealed >= SEAL_INTERVAL:
+            self.sealed = now
+            try:
+                self.store.seal(now)
+            except OSError as e:
+                print(f'Could not seal observations: {e}')
+
+    # Write out everything queued so far and stop, such as on exit, giving up after the timeout if the writer is stuck
+    def stop(self, timeout=10):
+        if self.thread is not None and self.thread.is_alive():
+            deadline = time.monotonic() + timeout
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                print(f'Scanning writer did not stop within {timeout} s, with {self.queue.qsize()} POSTs queued')
+                return
+            self.thread.join(max(deadline - time.monotonic(), 0))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, queued=self.queue.qsize(), capacity=self.queue.maxsize, max_batch=self.max_batch)
+
+
+writer = ScanningWriter(log, presence, spatial, store)
 
 
 # Store credentials in a separate file
@@ -30,50 +167,37 @@ def gather_credentials():
 # Respond to Meraki with validator
 @app.route('/', methods=['GET'])
 def get_validator():
-    print(f'VALIDATOR sent')
     return VALIDATOR, 200
 
 
-# Accept scanning API JSON POST
+# Accept scanning API JSON POST, only checking it before queueing it for the writer
 @app.route('/', methods=['POST'])
 def get_json():
-    if not request.json or not 'data' in request.json:
+    data = request.get_json(silent=True)
+    if not data or not 'data' in data:
         return 'invalid data', 400
-    data = request.json
-    print(f'Received POST: {data["type"]}, {data["version"]}')
 
     # Verify secret
-    if data['secret'] != SECRET:
-        print(f'Invalid secret: {data["secret"]}')
+    if data.get('secret') != SECRET:
+        writer.count('rejected')
         return 'invalid secret', 403
-    else:
-        print(f'Secret verified: {data["secret"]}')
-
-    # Save data locally to logs folder
-    if data['type'] == 'BluetoothDevicesSeen':
-        data_type = 'Blue'
-    else:
-        data_type = 'WiFi'
-    file_name = f'{datetime.now():%Y-%m-%d_%H-%M-%S}_{data_type}.json'
-    with open(f'logs/{file_name}', 'w') as fp:
-        json.dump(data, fp)
-    print(f'Saved locally: {file_name}\n')
-
-    # Delete any logs, keeping only the latest 100
-    log_files = os.listdir('logs/')
-    if len(log_files) > 100:
-        log_files.sort()
-        for file in log_files[:-100]:
-            os.remove(f'logs/{file}')
-
-    # Return success message
+
+    # Ack even when the queue is full and the POST is dropped, since errors would only get the receiver marked unhealthy
+    writer.submit(data)
     return 'Scanning API POST received', 200
 
 
+# Queue depth and counts of POSTs received, dropped, rejected and written since start
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    return writer.stats(), 200
+
+
 if __name__ == '__main__':
     # Get credentials and object count
     global VALIDATOR, SECRET
     (VALIDATOR, SECRET) = gather_credentials()
 
-    # Run Flask application
+    # Run Flask application, with the writer in the background
+    writer.start()
     app.run(port=5000, debug=False)
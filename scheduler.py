@@ -0,0 +1,187 @@
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import random
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from always_on import report_offline
+from async_api import *
+from check_perf import report_uplinks
+from dashboard import close_clients
+from device_index import DeviceIndex
+from history import UplinkHistory
+import metrics
+
+# Default seconds between runs of each check, and between refetches of each org's devices and networks
+INTERVALS = {'always_on': 60, 'check_perf': 60}
+TOPOLOGY_TTL = 900
+
+# Longest random delay before a check's first run, so that checks across orgs do not all call the API at once
+MAX_JITTER = 30
+
+# Checks running at once
+WORKERS = 4
+
+
+# Store credentials in a separate file, with each check's interval in an optional [schedule] section
+def gather_credentials():
+    cp = configparser.ConfigParser()
+    try:
+        cp.read('credentials.ini')
+        api_key = cp.get('meraki', 'key2')
+        chatbot_token = cp.get('chatbot', 'token')
+        user_email = cp.get('chatbot', 'email')
+        org_ids = [org_id.strip() for org_id in cp.get('meraki', 'organization').split(',') if org_id.strip()]
+        on_tag = cp.get('meraki', 'tag1')
+        perf_tag = cp.get('meraki', 'tag2')
+    except:
+        print('Missing credentials or input file!')
+        sys.exit(2)
+    intervals = {check: cp.getint('schedule', check, fallback=interval) for (check, interval) in INTERVALS.items()}
+    changes = cp.getboolean('schedule', 'changes', fallback=True)
+    history_dir = cp.get('schedule', 'history', fallback='')
+    metrics_port = cp.getint('schedule', 'metrics_port', fallback=0)
+    return api_key, chatbot_token, user_email, org_ids, on_tag, perf_tag, intervals, changes, history_dir, metrics_port
+
+
+# An org's devices and networks, kept between checks and refetched only once stale, while statuses are always fresh
+class OrgTopology:
+    def __init__(self, dashboard, org_id, ttl=TOPOLOGY_TTL):
+        self.dashboard = dashboard
+        self.org_id = org_id
+        self.ttl = ttl
+        self.devices = None
+        self.networks = None
+        self.fetched = 0
+        self.lock = threading.Lock()
+
+    # Index the org with current statuses, also awaiting any other calls needed with it and returning their results
+    def index(self, *calls):
+        dashboard = self.dashboard
+        with self.lock:
+            stale = self.devices is None or time.monotonic() - self.fetched > self.ttl
+        if stale:
+            (devices, networks, statuses, *results) = run(gather(dashboard.get_org_devices(self.org_id),
+                                                                 dashboard.get_org_networks(self.org_id),
+                                                                 dashboard.get_device_statuses(self.org_id),
+                                                                 *calls))
+            if devices is not None and networks is not None:
+                with self.lock:
+                    (self.devices, self.networks, self.fetched) = (devices, networks, time.monotonic())
+        else:
+            (statuses, *results) = run(gather(dashboard.get_device_statuses(self.org_id), *calls))
+        if self.devices is None or statuses is None:
+            raise RuntimeError(f'Could not retrieve devices for org {self.org_id}')
+        return (DeviceIndex(self.devices, statuses, self.networks), *results)
+
+
+# Runs jobs repeatedly on fixed intervals in one process, each starting after a random delay and never overlapping itself
+class Scheduler:
+    def __init__(self, workers=WORKERS, max_jitter=MAX_JITTER):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_jitter = max_jitter
+        self.jobs = []
+        self.running = {}
+        self.stopped = threading.Event()
+
+    # Schedule job(*args) every interval seconds
+    def every(self, interval, name, job, *args):
+        start = time.monotonic() + random.uniform(0, min(interval, self.max_jitter))
+        heapq.heappush(self.jobs, (start, name, interval, job, args))
+
+    # Run one job, reporting rather than raising any error so the others carry on
+    def call(self, name, job, args):
+        started = time.monotonic()
+        try:
+            job(*args)
+        except Exception as e:
+            print(f'Error running {name}: {e}')
+        else:
+            print(f'Ran {name} in {time.monotonic() - started:.1f}s')
+
+    # Run jobs as they come due until stopped, then wait for those running, skipping any run whose previous one has not yet finished
+    def run(self):
+        while self.jobs and not self.stopped.is_set():
+            (due, name, interval, job, args) = heapq.heappop(self.jobs)
+            if self.stopped.wait(max(due - time.monotonic(), 0)):
+                break
+            previous = self.running.get(name)
+            if previous and not previous.done():
+                print(f'Skipping {name}, still running')
+            else:
+                self.running[name] = self.executor.submit(self.call, name, job, args)
+
+            # Keep to the interval, unless so far behind that a run would be missed anyway
+            heapq.heappush(self.jobs, (max(due + interval, time.monotonic()), name, interval, job, args))
+        self.executor.shutdown()
+
+    # Stop scheduling jobs, letting any that are running finish
+    def stop(self):
+        self.stopped.set()
+
+
+# Main function
+if __name__ == '__main__':
+    # Get credentials, once
+    (api_key, chatbot_token, user_email, org_ids, on_tag, perf_tag, intervals, changes, history_dir, metrics_port) = gather_credentials()
+
+    # Serve API call metrics for Prometheus to scrape, if configured
+    if metrics_port:
+        metrics.enable()
+        metrics.serve(metrics_port)
+
+    # One warm session shared by every check, pooling connections to both the Meraki and Webex APIs
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=CONCURRENCY, pool_maxsize=CONCURRENCY)
+    session.mount('https://', adapter)
+    dashboard = AsyncDashboard(api_key, session)
+
+    # Webex Teams data
+    headers = {
+        'content-type': 'application/json; charset=utf-8',
+        'authorization': f'Bearer {chatbot_token}'
+    }
+    payload = {
+        'toPersonEmail': user_email
+    }
+
+    # Uplink results kept across all orgs' checks, if configured
+    history = UplinkHistory(history_dir) if history_dir else None
+    history_lock = threading.Lock()
+
+    # Device status check, by default reporting only changes since the last run
+    def check_offline(org_id, topology):
+        (index,) = topology.index()
+        report_offline(session, headers, payload, org_id, on_tag, index, changes)
+
+    # Uplink performance check
+    def check_uplinks(org_id, topology):
+        (index, perf) = topology.index(dashboard.get_uplinks_loss_latency(org_id))
+        if perf is not None:
+            if history:
+                with history_lock:
+                    history.append(perf)
+            report_uplinks(session, headers, payload, perf_tag, index, perf)
+
+    # Schedule both checks for each org
+    scheduler = Scheduler()
+    for org_id in org_ids:
+        topology = OrgTopology(dashboard, org_id)
+        scheduler.every(intervals['always_on'], f'always_on ({org_id})', check_offline, org_id, topology)
+        scheduler.every(intervals['check_perf'], f'check_perf ({org_id})', check_uplinks, org_id, topology)
+
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+        dashboard.close()
+        close_clients()
+        if history:
+            history.close()
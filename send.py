@@ -1,13 +1,16 @@
 import configparser
 from datetime import datetime, timedelta
-import json
-import os
 import sys
 
 import requests
 
 from chatbot import *
+from presence import POLL_INTERVAL, PRESENCE_DIR, PresenceIndex, get_net_clients
 from snapshot import *
+from spatial import SPATIAL_DIR, SpatialIndex
+
+# Alerts are muted if a home device has been seen within this many seconds
+MUTE_WINDOW = 5 * 60
 
 
 # Store credentials in a separate file
@@ -21,89 +24,93 @@ def gather_credentials():
         user_email = cp.get('chatbot', 'email')
         mv_serial = cp.get('sense', 'serial')
         home_macs = cp.get('sense', 'home')
+        home_macs = [mac.strip().lower() for mac in home_macs.split(',') if mac.strip()]
+        nearby = cp.get('sense', 'nearby', fallback='')
+        nearby = [float(n) for n in nearby.split(',')] if nearby else None
     except:
         print('Missing credentials or input file!')
         sys.exit(2)
-    return cam_key, org_id, chatbot_token, user_email, mv_serial, home_macs
+    return cam_key, org_id, chatbot_token, user_email, mv_serial, home_macs, nearby
 
 
-# List the devices in an organization
-def get_net_clients(session, api_key, net_id, start_time):
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-    response = session.get(f'https://api.meraki.com/api/v0/networks/{net_id}/clients?perPage=1000&t0={start_time}', headers=headers)
-    return response.json()
+# Why to mute an alert, if home devices have been seen in the last 5 minutes, via the indexes kept by scanning.py
+# and presence.py, or else None
+def muted(session, api_key, net_id, home_macs, nearby=None):
+    if not home_macs:
+        return None
 
+    # Only mute while they are near the given point, if scanning.py is keeping the spatial index up to date
+    spatial = SpatialIndex.load(SPATIAL_DIR) if nearby else None
+    if spatial and spatial.fresh(MUTE_WINDOW):
+        (lat, lng, metres) = nearby
+        found = spatial.near(lat, lng, metres, MUTE_WINDOW, home_macs)
+        return f'Home MAC {min(found)} found within {metres:g} m' if found else None
 
-# Main function
-if __name__ == '__main__':
-    # Get credentials and object count
-    (api_key, org_id, chatbot_token, user_email, mv_serial, home_macs) = gather_credentials()
-    count = int(sys.argv[1])
-    net_id = sys.argv[2]
-    mv_name = sys.argv[3]
+    presence = PresenceIndex.load(PRESENCE_DIR)
+    sighting = presence.seen_within(home_macs, MUTE_WINDOW)
+    if sighting:
+        return f'Home MAC {sighting.mac} found via {sighting.source}'
 
-    # Establish session
-    session = requests.Session()
-
-    # Check if home devices have been seen in the last 5 minutes, via network-wide clients
-    if home_macs:
-        home_macs = home_macs.split(',')
-        home_macs = [mac.strip().lower() for mac in home_macs]
-        time_now = datetime.now()
-        just_now = time_now - timedelta(minutes=5)
+    # Unless presence.py is keeping the index up to date, check network-wide clients directly
+    if not presence.fresh('clients', 2 * POLL_INTERVAL):
+        just_now = datetime.utcnow() - timedelta(seconds=MUTE_WINDOW)
         start_time = datetime.isoformat(just_now) + 'Z'
         clients = get_net_clients(session, api_key, net_id, start_time)
         client_macs = [c['mac'] for c in clients]
-        seen = set(home_macs).intersection(client_macs)
-
-        # If so, no need to alert and exit
-        if seen:
-            print('MUTED!! Home MACs found via network-wide clients')
-            sys.exit(0)
-
-    # Check if home devices have been seen in the last 5 minutes, via scanning API
-    if 'logs' in os.listdir():
-        logs = [file for file in os.listdir('logs') if '.json' in file]
-        recent_logs = []
-        time_now = datetime.now()
-        just_now = time_now - timedelta(minutes=5)
-        for log in logs:
-            log_time = datetime.strptime(log[:-10], '%Y-%m-%d_%H-%M-%S')
-            if log_time > just_now:
-                recent_logs.append(log)
-        if recent_logs:
-            for log in recent_logs:
-                file_path = 'logs/' + log
-                with open(file_path) as fp:
-                    data = json.load(fp)
-                client_macs = [c['clientMac'] for c in data['data']['observations']]
-                seen = set(home_macs).intersection(client_macs)
-
-                # If so, no need to alert and exit
-                if seen:
-                    print('MUTED!! Home MACs found via scanning API')
-                    sys.exit(0)
+        if set(home_macs).intersection(client_macs):
+            return 'Home MACs found via network-wide clients'
+    return None
+
+
+# Alert of people (and cars) seen by an MV camera, with a snapshot, unless muted; returns whether it was sent
+def send_alert(session, headers, payload, api_key, mv_serial, net_id, mv_name, count_people, count_cars,
+               home_macs=None, nearby=None, model=None):
+    # If home devices are around, no need to alert
+    reason = muted(session, api_key, net_id, home_macs, nearby)
+    if reason:
+        print(f'MUTED!! {reason}')
+        return False
 
     # Format message
-    headers = {
-        'content-type': 'application/json; charset=utf-8',
-        'authorization': f'Bearer {chatbot_token}'
-    }
-    payload = {
-        'toPersonEmail': user_email,
-    }
-    plural = 'person' if count == 1 else 'people'
-    message = f'**{count} {plural}** seen by MV camera _{mv_name}_'
+    people = '1 person' if count_people == 1 else f'{count_people} people'
+    cars = '1 car' if count_cars == 1 else f'{count_cars} cars'
+    if mv_serial.upper()[:4] in ('Q2JV', 'Q2TV'):
+        message = f'**{people}** & **{cars}** seen by MV camera _{mv_name}_'
+    else:
+        message = f'**{people}** seen by MV camera _{mv_name}_'
 
     # Generate snapshot and send
     file_url = generate_snapshot(api_key, net_id, mv_serial, session=session)
-    if file_url:  # download/GET image from URL
-        temp_file = download_file(session, mv_name, file_url)
-        if temp_file:
-            send_file(session, headers, payload, message, temp_file, file_type='image/jpg')
-        else:
+    if file_url:  # relay image from URL straight into the message
+        if not relay_file(session, headers, payload, message, mv_name, file_url, model=model):
             message += ' (snapshot unsuccessfully retrieved)'
             post_message(session, headers, payload, message)
     else:
         message += ' (snapshot unsuccessfully requested)'
         post_message(session, headers, payload, message)
+    return True
+
+
+# Main function
+if __name__ == '__main__':
+    # Get credentials and object count
+    (api_key, org_id, chatbot_token, user_email, mv_serial, home_macs, nearby) = gather_credentials()
+    count_people = int(sys.argv[1])
+    count_cars = int(sys.argv[2])
+    net_id = sys.argv[3]
+    mv_name = sys.argv[4]
+
+    # The camera that alerted, when mqtt.py is subscribed to several
+    mv_serial = sys.argv[5] if len(sys.argv) > 5 else mv_serial.split(',')[0].strip()
+
+    # Establish session
+    session = requests.Session()
+    headers = {
+        'content-type': 'application/json; charset=utf-8',
+        'authorization': f'Bearer {chatbot_token}'
+    }
+    payload = {
+        'toPersonEmail': user_email,
+    }
+    send_alert(session, headers, payload, api_key, mv_serial, net_id, mv_name, count_people, count_cars,
+               home_macs, nearby)
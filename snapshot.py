@@ -1,11 +1,20 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import pytz
 import requests
 
+from cache import cached
 from chatbot import *
+from device_index import DeviceIndex
+from metrics import instrument
+from readiness import poll_snapshot
 from status import *
 
+# Maximum number of snapshot probes and downloads running at once
+SNAPSHOT_CONCURRENCY = 8
+
 
 # List the devices in an organization
 # https://api.meraki.com/api_docs#list-the-devices-in-an-organization
@@ -89,6 +98,7 @@ def get_network_devices(api_key, net_id, session=None):
 
 # Return a network
 # https://api.meraki.com/api_docs#return-a-network
+@cached('network')
 def get_network(api_key, net_id, session=None):
     headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
 
@@ -106,30 +116,24 @@ def get_network(api_key, net_id, session=None):
         return None
 
 
-# Retrieve cameras' snapshots, links to video, and timestamps in local time zone
-def meraki_snapshots(session, api_key, timestamp=None, cameras=None):
-    # Temporarily store mappings of networks to their time zones
-    network_times = {}
-
-    # Assemble return data
-    snapshots = []
-    for camera in cameras:
-        net_id = camera['networkId']
-        serial = camera['serial']
-        cam_name = camera['name'] if 'name' in camera and camera['name'] else serial
+# Look up one camera's time zone, video link and snapshot link, with the time zone shared per network
+async def camera_snapshot(dashboard, camera, timestamp, network_times):
+    net_id = camera['networkId']
+    serial = camera['serial']
+    cam_name = camera['name'] if 'name' in camera and camera['name'] else serial
 
-        # Get time zone
+    try:
+        # Get time zone (cached), video link, and snapshot link all at once
         if net_id not in network_times:
-            time_zone = get_network(api_key, net_id, session)['timeZone']
-            network_times[net_id] = time_zone
-        else:
-            time_zone = network_times[net_id]
-
-        # Get video link
-        video_link = get_video_link(api_key, net_id, serial, timestamp, session)
-
-        # Get snapshot link
-        snapshot_link = generate_snapshot(api_key, net_id, serial, timestamp, session)
+            loop = asyncio.get_running_loop()
+            network_times[net_id] = loop.run_in_executor(dashboard.executor, get_network,
+                                                         dashboard.api_key, net_id, dashboard.session)
+        (network, video_link, snapshot_link) = await gather(
+            asyncio.shield(network_times[net_id]),
+            dashboard.get_video_link(net_id, serial, timestamp),
+            dashboard.generate_snapshot(net_id, serial, timestamp)
+        )
+        time_zone = network['timeZone'] if network else 'UTC'
 
         # Add timestamp to file name
         if not timestamp:
@@ -138,62 +142,117 @@ def meraki_snapshots(session, api_key, timestamp=None, cameras=None):
             file_name = cam_name + ' - ' + local_now.strftime('%Y-%m-%d_%H-%M-%S')
         else:
             file_name = cam_name
+    except Exception as e:
+        print(f'Error requesting snapshot for camera {cam_name}: {e}')
+        return (cam_name, cam_name, None, None)
+
+    return (cam_name, file_name, snapshot_link, video_link)
+
+
+# Retrieve cameras' snapshots, links to video, and timestamps in local time zone
+def meraki_snapshots(session, api_key, timestamp=None, cameras=None):
+    # Temporarily store mappings of networks to their time zone lookups
+    network_times = {}
 
-        # Add to list of snapshots to send
-        snapshots.append((cam_name, file_name, snapshot_link, video_link))
+    # Assemble return data, in the same order as the cameras
+    dashboard = AsyncDashboard(api_key, session)
+    snapshots = run(gather(*[camera_snapshot(dashboard, camera, timestamp, network_times) for camera in cameras]))
+    dashboard.close()
 
-    return snapshots
+    return list(snapshots)
+
+
+# Queue one camera's snapshot, or the reason it could not be sent
+def send_snapshot(outbox, headers, payload, cam_name, file_name, snapshot, video, image):
+    if not snapshot:
+        # Snapshot POST was not successful in retrieving image URL
+        outbox.post(headers, payload,
+                    f'POST error with requesting snapshot for camera **{cam_name}**')
+    elif not image:
+        # Snapshot GET with URL did not return any image
+        outbox.post(headers, payload,
+                    f'GET error with retrieving snapshot for camera **{cam_name}**')
+    else:
+        # Send snapshot without analysis
+        outbox.post(headers, payload, f'[{cam_name}]({video})', files=(f'{file_name}.jpg', image, 'image/jpg'))
+
+        # Send to computer vision API for analysis
+        pass
+
+
+# Wait for a snapshot to be ready and read it into memory, without holding a thread while waiting
+async def fetch_snapshot(session, snapshot, model, executor):
+    response = await poll_snapshot(session, snapshot, model, executor=executor)
+    if not response:
+        return None
+    return await asyncio.get_running_loop().run_in_executor(executor, read_file, response)
+
+
+# Download snapshots concurrently into memory, but queue them in camera order as soon as each one and those before it are ready
+async def deliver_snapshots(outbox, session, headers, payload, snapshots, models, concurrency=SNAPSHOT_CONCURRENCY):
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    total = len(snapshots)
+    progress = {'ready': 0}
+
+    # Report progress as downloads finish, in whatever order that is
+    def report(download):
+        progress['ready'] += 1
+        print(f'{progress["ready"]}/{total} snapshots downloaded')
+
+    downloads = []
+    for ((cam_name, file_name, snapshot, video), model) in zip(snapshots, models):
+        if snapshot:
+            download = asyncio.ensure_future(fetch_snapshot(session, snapshot, model, executor))
+            download.add_done_callback(report)
+        else:
+            download = None
+        downloads.append(download)
+
+    # The outbox uploads them one at a time, keeping the chat in camera order
+    for ((cam_name, file_name, snapshot, video), download) in zip(snapshots, downloads):
+        try:
+            image = await download if download else None
+            send_snapshot(outbox, headers, payload, cam_name, file_name, snapshot, video, image)
+        except Exception as e:
+            print(f'Error sending snapshot for camera {cam_name}: {e}')
+            outbox.post(headers, payload, f'Error with sending snapshot for camera **{cam_name}**')
+
+    executor.shutdown(wait=False)
 
 
 # Determine whether to retrieve all cameras or just selected snapshots
 def return_snapshots(session, headers, payload, api_key, org_id, message, labels):
+    instrument(session)
     try:
-        # Get org's devices
-        devices = get_org_devices(session, api_key, org_id)
-        cameras = [d for d in devices if d['model'][:2] == 'MV']
-        statuses = get_device_statuses(session, api_key, org_id)
-        online = [d['serial'] for d in statuses if d['status'] == 'online']
+        # Get org's devices and their statuses, at once
+        dashboard = AsyncDashboard(api_key, session)
+        (devices, statuses) = run(gather(dashboard.get_org_devices(org_id), dashboard.get_device_statuses(org_id)))
+        dashboard.close()
+        index = DeviceIndex(devices, statuses)
 
         # All cameras in the org that are online
         if message_contains(message, ['all', 'complete', 'entire', 'every', 'full']) or not labels:
             post_message(session, headers, payload,
                         '📸 _Retrieving all cameras\' snapshots..._')
-            online_cams = []
-            for c in cameras:
-                if c['serial'] in online:
-                    online_cams.append(c)
+            online_cams = index.select(family='MV', status='online')
             snapshots = meraki_snapshots(session, api_key, None, online_cams)
+            models = [c['model'] for c in online_cams]
 
         # Or just specified/filtered ones, skipping those that do not match filtered names/tags
         else:
             post_message(session, headers, payload,
                         '📷 _Retrieving camera snapshots..._')
-            filtered_cams = []
-            for c in cameras:
-                if 'name' in c and c['name'] in labels:
-                    filtered_cams.append(c)
-                elif 'tags' in c and set(labels).intersection(c['tags'].split()):
-                    filtered_cams.append(c)
+            tagged = set(serial for label in labels for serial in index.by_tag.get(label, []))
+            filtered_cams = [c for c in index.select(family='MV')
+                             if ('name' in c and c['name'] in labels) or c['serial'] in tagged]
             snapshots = meraki_snapshots(session, api_key, None, filtered_cams)
-
-        # Send cameras names with files (URLs)
-        for (cam_name, file_name, snapshot, video) in snapshots:
-            if snapshot:
-                temp_file = download_file(session, file_name, snapshot)
-                if temp_file:
-                    # Send snapshot without analysis
-                    send_file(session, headers, payload, f'[{cam_name}]({video})', temp_file, file_type='image/jpg')
-
-                    # Send to computer vision API for analysis
-                    pass
-                # Snapshot GET with URL did not return any image
-                else:
-                    post_message(session, headers, payload,
-                                f'GET error with retrieving snapshot for camera **{cam_name}**')
-            else:
-                # Snapshot POST was not successful in retrieving image URL
-                post_message(session, headers, payload,
-                            f'POST error with requesting snapshot for camera **{cam_name}**')
+            models = [c['model'] for c in filtered_cams]
     except:
         post_message(session, headers, payload,
                      'Does your API key have write access to the specified organization ID with cameras? 😳')
+        return
+
+    # Send cameras names with files (URLs), each camera's errors reported separately
+    outbox = Outbox(session)
+    run(deliver_snapshots(outbox, session, headers, payload, snapshots, models))
+    outbox.close()
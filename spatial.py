@@ -0,0 +1,191 @@
+from collections import Counter, deque, namedtuple
+import json
+import math
+import os
+import threading
+import time
+
+# Where scanning.py keeps its snapshot of the index, for send.py to read
+SPATIAL_DIR = 'spatial'
+
+# Side of each grid cell in metres (north-south; east-west cells narrow away from the equator)
+CELL = 10
+
+# Positions older than this are dropped, and snapshots are written at most this often while observations arrive
+RETENTION = 60 * 60
+SAVE_INTERVAL = 5
+
+# Metres per degree of latitude, close enough at the scale of a site
+METRES_PER_DEGREE = 111320
+
+# Where and when a MAC was seen, with the location's uncertainty (m) and floor, if known
+Position = namedtuple('Position', ['mac', 'seen', 'lat', 'lng', 'unc', 'floor'])
+
+
+# Distance in metres between two points, by the equirectangular approximation
+def distance(lat1, lng1, lat2, lng2):
+    x = (lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = lat2 - lat1
+    return math.hypot(x, y) * METRES_PER_DEGREE
+
+
+# Whether a point is inside a polygon of (lat, lng) vertices, by ray casting
+def inside(lat, lng, polygon):
+    result = False
+    (lat1, lng1) = polygon[-1]
+    for (lat2, lng2) in polygon:
+        if (lat1 > lat) != (lat2 > lat) and lng < lng1 + (lat - lat1) * (lng2 - lng1) / (lat2 - lat1):
+            result = not result
+        (lat1, lng1) = (lat2, lng2)
+    return result
+
+
+# Recent positions of client MACs from the scanning API, in a grid of cells over latitude and longitude so that
+# proximity and geofence queries only look at the cells they overlap. Each cell keeps the latest position of each
+# MAC seen in it, and positions expire in the order they were added.
+class SpatialIndex:
+    def __init__(self, directory=SPATIAL_DIR, cell=CELL, floors=None):
+        self.directory = directory
+        self.step = cell / METRES_PER_DEGREE
+        self.floors = {ap.lower(): floor for (ap, floor) in (floors or {}).items()}
+        self.cells = {}
+        self.latest = {}
+        self.expiry = deque()
+        self.updated = 0
+        self.saved = 0
+        self.lock = threading.Lock()
+
+    def key(self, lat, lng):
+        return int(lat // self.step), int(lng // self.step)
+
+    def update(self, mac, seen, lat, lng, unc=None, floor=None):
+        position = Position(mac.lower(), seen, lat, lng, unc, floor)
+        key = self.key(lat, lng)
+        with self.lock:
+            cell = self.cells.get(key)
+            if cell is None:
+                cell = self.cells[key] = {}
+            current = cell.get(position.mac)
+            if current is None or seen > current.seen:
+                cell[position.mac] = position
+                self.expiry.append((seen, key, position.mac))
+            current = self.latest.get(position.mac)
+            if current is None or seen > current.seen:
+                self.latest[position.mac] = position
+
+    # Add the located observations of a scanning API POST; the floor is the floor plan's if given, or else the AP's
+    def observe_scanning(self, data, now=None):
+        now = now or time.time()
+        ap = (data['data'].get('apMac') or '').lower()
+        for observation in data['data'].get('observations') or []:
+            location = observation.get('location') or {}
+            (lat, lng) = (location.get('lat'), location.get('lng'))
+            if lat is None or lng is None or math.isnan(lat) or math.isnan(lng):
+                continue
+            floor = location.get('floorPlanName') or location.get('floorPlanId') or self.floors.get(ap)
+            self.update(observation['clientMac'], observation.get('seenEpoch') or now, lat, lng,
+                        location.get('unc'), floor)
+
+    # Drop positions older than the retention, oldest added first
+    def expire(self, now=None):
+        since = (now or time.time()) - RETENTION
+        with self.lock:
+            while self.expiry and self.expiry[0][0] < since:
+                (seen, key, mac) = self.expiry.popleft()
+                cell = self.cells.get(key)
+                if cell and mac in cell and cell[mac].seen < since:
+                    del cell[mac]
+                    if not cell:
+                        del self.cells[key]
+                if mac in self.latest and self.latest[mac].seen < since:
+                    del self.latest[mac]
+
+    # Positions within the bounding box and time window, from the cells that overlap the box
+    def candidates(self, south, west, north, east, since):
+        (row0, col0) = self.key(south, west)
+        (row1, col1) = self.key(north, east)
+        with self.lock:
+            if (row1 - row0 + 1) * (col1 - col0 + 1) <= len(self.cells):
+                keys = [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+            else:
+                keys = [(row, col) for (row, col) in self.cells if row0 <= row <= row1 and col0 <= col <= col1]
+            cells = [self.cells[key] for key in keys if key in self.cells]
+            return [p for cell in cells for p in cell.values() if p.seen >= since]
+
+    # Most recent position of each MAC seen within the radius (m) of a point in the last given seconds, as {MAC: Position}
+    def near(self, lat, lng, metres, seconds, macs=None, now=None):
+        since = (now or time.time()) - seconds
+        dlat = metres / METRES_PER_DEGREE
+        dlng = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        found = {}
+        for p in self.candidates(lat - dlat, lng - dlng, lat + dlat, lng + dlng, since):
+            if distance(lat, lng, p.lat, p.lng) <= metres:
+                found = keep_latest(found, p)
+        return only(found, macs)
+
+    # Most recent position of each MAC seen inside a polygon of (lat, lng) vertices in the last given seconds
+    def within(self, polygon, seconds, macs=None, now=None):
+        since = (now or time.time()) - seconds
+        lats = [lat for (lat, lng) in polygon]
+        lngs = [lng for (lat, lng) in polygon]
+        found = {}
+        for p in self.candidates(min(lats), min(lngs), max(lats), max(lngs), since):
+            if inside(p.lat, p.lng, polygon):
+                found = keep_latest(found, p)
+        return only(found, macs)
+
+    # MACs on each floor, by where each was last seen, counting those seen in the last given seconds
+    def occupancy(self, seconds, now=None):
+        since = (now or time.time()) - seconds
+        with self.lock:
+            return Counter(p.floor for p in self.latest.values() if p.seen >= since)
+
+    # Whether the snapshot was written within the last given seconds
+    def fresh(self, seconds, now=None):
+        return self.updated >= (now or time.time()) - seconds
+
+    # Atomically write the positions, dropping expired ones; unless forced, at most every SAVE_INTERVAL
+    def save(self, force=False, now=None):
+        now = now or time.time()
+        if not force and now - self.saved < SAVE_INTERVAL:
+            return False
+        self.expire(now)
+        since = now - RETENTION
+        with self.lock:
+            positions = [list(p) for cell in self.cells.values() for p in cell.values() if p.seen >= since]
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, 'positions.json')
+            with open(f'{path}.tmp', 'w') as fp:
+                json.dump({'updated': now, 'positions': positions}, fp, separators=(',', ':'))
+            os.replace(f'{path}.tmp', path)
+            self.saved = now
+        return True
+
+    # Index the snapshot that scanning.py writes, for lookups
+    @classmethod
+    def load(cls, directory=SPATIAL_DIR, cell=CELL):
+        index = cls(directory, cell)
+        try:
+            with open(os.path.join(directory, 'positions.json')) as fp:
+                snapshot = json.load(fp)
+        except (OSError, ValueError):
+            return index
+        index.updated = snapshot['updated']
+        for position in sorted(snapshot['positions'], key=lambda p: p[1]):
+            index.update(*position)
+        return index
+
+
+# Keep the more recent of a MAC's positions
+def keep_latest(found, position):
+    current = found.get(position.mac)
+    if current is None or position.seen > current.seen:
+        found[position.mac] = position
+    return found
+
+
+# Only the results for the given MACs, if any are given
+def only(found, macs):
+    if macs is None:
+        return found
+    return {mac: found[mac] for mac in (m.lower() for m in macs) if mac in found}
@@ -1,6 +1,12 @@
-from statistics import mean
+from functools import partial
 
+from async_api import *
+from cache import cached, invalidate
+from changes import *
 from chatbot import *
+from metrics import instrument
+from outbox import Outbox
+from uplinks import UplinkTable
 
 LOSS_THRESHOLD = 7.0
 LATENCY_THRESHOLD = 49.0
@@ -10,6 +16,7 @@ base_url = 'https://api.meraki.com/api/v0'
 
 # List the organizations that the user has privileges on
 # https://api.meraki.com/api_docs#list-the-organizations-that-the-user-has-privileges-on
+@cached('organizations')
 def get_organizations(session, api_key):
     headers = {'X-Cisco-Meraki-API-Key': api_key}
     response = session.get(f'{base_url}/organizations', headers=headers)
@@ -18,22 +25,16 @@ def get_organizations(session, api_key):
 
 # List the status of every Meraki device in the organization
 # https://api.meraki.com/api_docs#list-the-status-of-every-meraki-device-in-the-organization
+@cached('deviceStatuses')
 def get_device_statuses(session, api_key, org_id):
     headers = {'X-Cisco-Meraki-API-Key': api_key}
     response = session.get(f'{base_url}/organizations/{org_id}/deviceStatuses', headers=headers)
     return response.json() if response.ok else None
 
 
-# Return the uplink loss and latency for every MX in the organization from at latest 2 minutes ago
-# https://api.meraki.com/api_docs#return-the-uplink-loss-and-latency-for-every-mx-in-the-organization-from-at-latest-2-minutes-ago
-def get_orgs_uplinks(session, api_key, org_id):
-    headers = {'X-Cisco-Meraki-API-Key': api_key}
-    response = session.get(f'{base_url}/organizations/{org_id}/uplinksLossAndLatency', headers=headers)
-    return response.json() if response.ok else None
-
-
 # Return the inventory for an organization
 # https://api.meraki.com/api_docs#return-the-inventory-for-an-organization
+@cached('inventory')
 def get_org_inventory(session, api_key, org_id):
     headers = {'X-Cisco-Meraki-API-Key': api_key}
     response = session.get(f'{base_url}/organizations/{org_id}/inventory', headers=headers)
@@ -42,17 +43,7 @@ def get_org_inventory(session, api_key, org_id):
 
 # List the networks in an organization
 # https://api.meraki.com/api_docs#list-the-networks-in-an-organization
-def get_networks(session, api_key, org_id, configTemplateId=None):
-    get_url = f'{base_url}/organizations/{org_id}/networks'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-    if configTemplateId:
-        get_url += f'?configTemplateId={configTemplateId}'
-    response = session.get(get_url, headers=headers)
-    return response.json() if response.ok else None
-
-
-# List the networks in an organization
-# https://api.meraki.com/api_docs#list-the-networks-in-an-organization
+@cached('networks')
 def get_networks(session, api_key, org_id, configTemplateId=None):
     get_url = f'{base_url}/organizations/{org_id}/networks'
     headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
@@ -74,6 +65,8 @@ def create_network(session, api_key, org_id, name=None, type=None, tags=None, ti
                if key in variables and value is not None}
 
     response = session.post(post_url, headers=headers, json=payload)
+    if response.ok:
+        invalidate('networks', org_id=org_id)
     return response.json() if response.ok else None
 
 
@@ -86,6 +79,9 @@ def claim_device(session, api_key, net_id, serial):
     payload = {'serial': serial}
 
     response = session.post(post_url, headers=headers, json=payload)
+    if response.ok:
+        invalidate('inventory', api_key=api_key)
+        invalidate('deviceStatuses', api_key=api_key)
     return True if response.ok else False
 
 
@@ -105,106 +101,156 @@ def update_device(session, api_key, net_id, serial, name=None, tags=None, lat=No
     return response.json() if response.ok else response.status_code, response.text
 
 
+# Running tally of an org's device statuses, built one device at a time so the full list is never held in memory
+class StatusTally:
+    # Devices are only listed by name in sections with at most this many
+    SAMPLES = 10
+
+    def __init__(self):
+        self.total = 0
+        self.counts = {'online': 0, 'alerting': 0, 'offline': 0}
+        self.names = {'online': [], 'alerting': [], 'offline': []}
+        self.cellular = 0
+        self.failover = 0
+
+    def add(self, device):
+        self.total += 1
+        status = device['status']
+        if status in self.counts:
+            self.counts[status] += 1
+            if len(self.names[status]) < self.SAMPLES:
+                self.names[status].append(device.get('name') or device['mac'])
+
+        # Appliances online with cellular failover capability, and those using it
+        if status == 'online' and 'usingCellularFailover' in device:
+            self.cellular += 1
+            if device['usingCellularFailover'] == True:
+                self.failover += 1
+
+
+# Stream an org's device statuses into a tally, or None if unsuccessful
+async def tally_device_statuses(dashboard, org_id):
+    tally = StatusTally()
+    ok = await dashboard.stream(f'/organizations/{org_id}/deviceStatuses', tally.add)
+    return tally if ok else None
+
+
+# Fetch device status tallies and uplink performance for every org at once
+async def get_orgs_health(dashboard, org_ids):
+    return await gather(dashboard.for_orgs(partial(tally_device_statuses, dashboard), org_ids),
+                        dashboard.for_orgs(dashboard.get_uplinks_loss_latency, org_ids))
+
+
+# Format an org's status summary, displaying devices names if <= 10 per section
+def format_status(org_name, tally):
+    message = f'### **{org_name}**'
+    total = tally.total
+    for (status, heading) in [('online', '{} devices ✅ online'), ('alerting', '_{} ⚠️ alerting_'), ('offline', '**{} ❌ offline**')]:
+        count = tally.counts[status]
+        if count > 0:
+            message += f'  \n- {heading.format(count)} ({count / total * 100:.1f}%)'
+            if count <= tally.SAMPLES:
+                message += ': ' + ', '.join(tally.names[status])
+    return message
+
+
 # Return device status for each org
 def device_status(session, headers, payload, api_key):
+    instrument(session)
     orgs = get_organizations(session, api_key)
     responded = False
 
-    for org in orgs:
+    # Skip Meraki corporate for admin users
+    orgs = [org for org in orgs if org['id'] != 1]
 
-        # Skip Meraki corporate for admin users
-        if org['id'] == 1:
-            continue
+    # Query all orgs concurrently, then report on each in order, queueing messages as they are ready
+    outbox = Outbox(session)
+    dashboard = AsyncDashboard(api_key, session)
+    (org_tallies, org_uplinks) = run(get_orgs_health(dashboard, [org['id'] for org in orgs]))
+    dashboard.close()
+
+    for org in orgs:
 
         # Org-wide device statuses
-        statuses = get_device_statuses(session, api_key, org['id'])
-        if statuses:
-
-            # Tally devices across org
-            total = len(statuses)
-            online_devices = [device for device in statuses if device['status'] == 'online']
-            online = len(online_devices)
-            alerting_devices = [device for device in statuses if device['status'] == 'alerting']
-            alerting = len(alerting_devices)
-            offline_devices = [device for device in statuses if device['status'] == 'offline']
-            offline = len(offline_devices)
-
-            # Format message, displaying devices names if <= 10 per section
-            message = f'### **{org["name"]}**'
-            if online > 0:
-                message += f'  \n- {online} devices ✅ online ({online / total * 100:.1f}%)'
-                if online <= 10:
-                    message += ': '
-                    for device in online_devices:
-                        if device['name']:
-                            message += f'{device["name"]}, '
-                        else:
-                            message += f'{device["mac"]}, '
-                    message = message[:-2]
-
-            if alerting > 0:
-                message += f'  \n- _{alerting} ⚠️ alerting_ ({alerting / total * 1004:.1f}%)'
-                if alerting <= 10:
-                    message += ': '
-                    for device in alerting_devices:
-                        if device['name']:
-                            message += f'{device["name"]}, '
-                        else:
-                            message += f'{device["mac"]}, '
-                    message = message[:-2]
-
-            if offline > 0:
-                message += f'  \n- **{offline} ❌ offline** ({offline / total * 100:.1f}%)'
-                if offline <= 10:
-                    message += ': '
-                    for device in offline_devices:
-                        if device['name']:
-                            message += f'{device["name"]}, '
-                        else:
-                            message += f'{device["mac"]}, '
-                    message = message[:-2]
-
-            post_message(session, headers, payload, message)
+        tally = org_tallies[org['id']]
+        if tally and tally.total:
+            outbox.post(headers, payload, format_status(org['name'], tally))
             responded = True
 
             # Show cellular failover information, if applicable
-            cellular_online = [device for device in statuses if
-                               'usingCellularFailover' in device and device['status'] == 'online']
-            cellular = len(cellular_online)
-            if cellular > 0:
-                failover_online = [device for device in cellular_online if device['usingCellularFailover'] == True]
-                failover = len(failover_online)
-
-                if failover > 0:
-                    post_message(session, headers, payload,
-                                 f'> {failover} of {cellular} appliances online ({failover / cellular * 100:.1f}%) using 🗼 cellular failover')
+            if tally.cellular > 0 and tally.failover > 0:
+                outbox.post(headers, payload,
+                            f'> {tally.failover} of {tally.cellular} appliances online ({tally.failover / tally.cellular * 100:.1f}%) using 🗼 cellular failover')
 
         # Org-wide uplink performance
-        uplinks = get_orgs_uplinks(session, api_key, org['id'])
+        uplinks = org_uplinks[org['id']]
         if uplinks:
 
             # Tally up uplinks with worse performance than thresholds here
             loss_count = 0
             latency_count = 0
 
-            for uplink in uplinks:
-                perf = uplink['timeSeries']
-
-                loss = mean([sample['lossPercent'] for sample in perf])
-                if loss > LOSS_THRESHOLD and loss < 100.0:  # ignore probes to unreachable IPs that are incorrectly configured
+            for stats in UplinkTable(uplinks).probe_stats():
+                if stats.loss is not None and LOSS_THRESHOLD < stats.loss < 100.0:  # ignore probes to unreachable IPs that are incorrectly configured
                     loss_count += 1
 
-                latency = mean([sample['latencyMs'] for sample in perf])
-                if latency > LATENCY_THRESHOLD:
+                if stats.latency is not None and stats.latency > LATENCY_THRESHOLD:
                     latency_count += 1
 
             if loss_count > 0:
-                post_message(session, headers, payload,
-                             f'{loss_count} device-uplink-probes currently have 🕳 packet loss higher than **{LOSS_THRESHOLD:.1f}%**!')
+                outbox.post(headers, payload,
+                            f'{loss_count} device-uplink-probes currently have 🕳 packet loss higher than **{LOSS_THRESHOLD:.1f}%**!')
             if latency_count > 0:
-                post_message(session, headers, payload,
-                             f'{latency_count} device-uplink-probes currently have 🐢 latency higher than **{LATENCY_THRESHOLD:.1f} ms**!')
+                outbox.post(headers, payload,
+                            f'{latency_count} device-uplink-probes currently have 🐢 latency higher than **{LATENCY_THRESHOLD:.1f} ms**!')
 
     if not responded:
-        post_message(session, headers, payload,
-                     'Does your API key have access to at least a single org with API enabled? 😫')
+        outbox.post(headers, payload,
+                    'Does your API key have access to at least a single org with API enabled? 😫')
+
+    # Wait for queued messages to be delivered
+    outbox.close()
+
+
+# Status labels for reporting changes
+STATUS_LABELS = {'online': '✅ online', 'alerting': '⚠️ alerting', 'offline': '❌ offline', None: '🚫 removed'}
+
+
+# Report only devices whose status changed since the last time asked, for each org
+def device_changes(session, headers, payload, api_key):
+    instrument(session)
+    orgs = get_organizations(session, api_key)
+    orgs = [org for org in orgs if org['id'] != 1]
+    changed = False
+
+    outbox = Outbox(session)
+    dashboard = AsyncDashboard(api_key, session)
+    org_statuses = run(dashboard.for_orgs(dashboard.get_device_statuses, [org['id'] for org in orgs]))
+    dashboard.close()
+
+    for org in orgs:
+        statuses = org_statuses[org['id']]
+        if statuses is None:
+            continue
+
+        # The first time an org is seen, its baseline is only recorded
+        baseline = StatusBaseline(baseline_path(org['id']))
+        first = not baseline.devices
+        transitions = [t for t in baseline.update(statuses) if t.field == 'status']
+        if first or not transitions:
+            continue
+
+        changed = True
+        message = f'### **{org["name"]}**'
+        for t in transitions:
+            name = (t.device.get('name') or t.device['mac']) if t.device else t.serial
+            if t.before is None:
+                message += f'  \n- **{name}** added, {STATUS_LABELS.get(t.after, t.after)}'
+            else:
+                message += f'  \n- **{name}**: {STATUS_LABELS.get(t.before, t.before)} → {STATUS_LABELS.get(t.after, t.after)}'
+        outbox.post(headers, payload, message)
+
+    if not changed:
+        outbox.post(headers, payload, 'No device status changes since last time 👍')
+
+    outbox.close()
@@ -0,0 +1,87 @@
+from array import array
+from collections import namedtuple
+import math
+
+# Placeholder for samples the API returned without a value
+MISSING = float('nan')
+
+# Summary of an uplink's samples: means and percentiles of loss (%) and latency (ms)
+UplinkStats = namedtuple('UplinkStats', ['loss', 'loss_p', 'latency', 'latency_p', 'samples'])
+
+
+# Mean of the values, or None if there are none
+def mean_of(values):
+    return sum(values) / len(values) if values else None
+
+
+# Nearest-rank percentile of already sorted values, or None if there are none
+def percentile_of(ordered, q):
+    if not ordered:
+        return None
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+# Uplink loss and latency results, loaded once into array-backed columns with one row per (serial, uplink, ip) probe
+class UplinkTable:
+    def __init__(self, perf=None):
+        self.serials = []
+        self.uplinks = []
+        self.ips = []
+        self.starts = array('L')
+        self.ends = array('L')
+        self.loss = array('d')
+        self.latency = array('d')
+        self.rows = {}
+        if perf:
+            self.load(perf)
+
+    # Append the response of uplinksLossAndLatency, each probe's time series stored contiguously
+    def load(self, perf):
+        for probe in perf:
+            row = len(self.serials)
+            self.serials.append(probe['serial'])
+            self.uplinks.append(probe['uplink'])
+            self.ips.append(probe['ip'])
+            series = probe['timeSeries']
+            self.starts.append(len(self.loss))
+            self.loss.extend([MISSING if s['lossPercent'] is None else s['lossPercent'] for s in series])
+            self.latency.extend([MISSING if s['latencyMs'] is None else s['latencyMs'] for s in series])
+            self.ends.append(len(self.loss))
+            self.rows.setdefault((probe['serial'], probe['uplink']), []).append(row)
+
+    def __len__(self):
+        return len(self.serials)
+
+    # Samples of a column across the given rows, skipping missing values
+    def samples(self, column, rows):
+        values = array('d')
+        for row in rows:
+            values.extend(column[self.starts[row]:self.ends[row]])
+        return [v for v in values if v == v]
+
+    # Statistics across all of the rows' probes
+    def stats(self, rows, q=95):
+        loss = sorted(self.samples(self.loss, rows))
+        latency = sorted(self.samples(self.latency, rows))
+        return UplinkStats(mean_of(loss), percentile_of(loss, q),
+                           mean_of(latency), percentile_of(latency, q), len(loss))
+
+    # Statistics per (serial, uplink) across all probe IPs, optionally only for the given serials
+    def summarize(self, serials=None, q=95):
+        return {key: self.stats(rows, q) for (key, rows) in self.rows.items()
+                if serials is None or key[0] in serials}
+
+    # Statistics of each probe, in row order
+    def probe_stats(self, q=95):
+        return [self.stats([row], q) for row in range(len(self))]
+
+    # (serial, uplink, stats, high loss, high latency) for each uplink breaching either threshold on average
+    def breaches(self, loss_threshold, latency_threshold, serials=None, q=95):
+        results = []
+        for ((serial, uplink), stats) in self.summarize(serials, q).items():
+            high_loss = stats.loss is not None and stats.loss > loss_threshold
+            high_latency = stats.latency is not None and stats.latency > latency_threshold
+            if high_loss or high_latency:
+                results.append((serial, uplink, stats, high_loss, high_latency))
+        return results